@@ -1,5 +1,6 @@
 from vivarium.core.registry import (
     divider_registry,
+    emitter_registry,
     updater_registry,
     serializer_registry,
 )
@@ -23,6 +24,7 @@ from ecoli.library.updaters import (
     inverse_update_unique_numpy
 )
 from ecoli.library.serialize import UnumSerializer, ParameterSerializer
+from ecoli.library.table_emitter import TableEmitter
 
 # register :term:`updaters`
 inverse_updater_registry.register(
@@ -52,3 +54,6 @@ for serializer_cls in (UnumSerializer, ParameterSerializer):
     serializer = serializer_cls()
     serializer_registry.register(
         serializer.name, serializer)
+
+# register emitters
+emitter_registry.register('table', TableEmitter)
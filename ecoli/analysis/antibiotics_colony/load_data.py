@@ -10,7 +10,8 @@ from vivarium.library.dict_utils import get_value_from_path
 
 from ecoli.analysis.antibiotics_colony import (EXPERIMENT_ID_MAPPING,
                                                PATHS_TO_LOAD)
-from ecoli.analysis.db import access_counts, deserialize_and_remove_units
+from ecoli.analysis.db import (access_counts, deserialize_and_remove_units,
+    iter_query)
 
 
 def agent_data_table(raw_data, paths_dict, condition, seed):
@@ -45,8 +46,33 @@ def agent_data_table(raw_data, paths_dict, condition, seed):
     return collected_data
 
 
+def write_metadata_start(metadata_file, condition, seed, bounds):
+    """Start writing the metadata JSON file of a replicate, which has the
+    form ``{condition: {seed: {'bounds': bounds, 'fields': {time: fields}}}}``.
+    The environment fields are written a chunk of times at a time with
+    :py:func:`write_metadata_fields` so that they are never all in memory.
+    Close the JSON object by writing ``'}}}}'`` after the last chunk."""
+    metadata_file.write('{{{}: {{{}: {{"bounds": {}, "fields": {{'.format(
+        json.dumps(condition), json.dumps(str(seed)), json.dumps(bounds)))
+
+
+def write_metadata_fields(metadata_file, fields, first=False):
+    """Append the environment fields at some times to the metadata JSON file
+    started with :py:func:`write_metadata_start`.
+
+    Args:
+        metadata_file: Metadata file object
+        fields: Dictionary mapping times to fields at those times
+        first: Whether these are the first fields written to the file
+    """
+    for time, fields_at_time in fields.items():
+        metadata_file.write('{}{}: {}'.format('' if first else ', ',
+            json.dumps(str(time)), json.dumps(fields_at_time)))
+        first = False
+
+
 def load_data(experiment_id=None, cpus=8, sampling_rate=2,
-    host="10.138.0.75", port=27017
+    host="10.138.0.75", port=27017, chunk_size=500
 ):
     # Get data for the specified experiment_id
     monomers = [path[-1] for path in PATHS_TO_LOAD.values() if path[0]=='monomer']
@@ -59,48 +85,53 @@ def load_data(experiment_id=None, cpus=8, sampling_rate=2,
         for seed, curr_experiment_id in seeds.items():
             if curr_experiment_id != experiment_id:
                 continue
-            metadata = {condition: {seed: {}}}
-            rep_data = access_counts(
-                experiment_id=experiment_id,
+            # Query, convert and save a chunk of times at a time to keep
+            # memory use bounded
+            rep_chunks = iter_query(
+                access_counts,
+                experiment_id,
+                chunk_size=chunk_size,
+                host=host,
+                port=port,
+                sampling_rate=sampling_rate,
+                start_time=0,
+                end_time=26000,
                 monomer_names=monomers,
                 mrna_names=mrnas,
                 rna_synth_prob=mrnas,
                 inner_paths=inner_paths,
                 outer_paths=outer_paths,
-                host=host,
-                port=port,
-                sampling_rate=sampling_rate,
-                cpus=cpus,
-                start_time=0,
-                end_time=26000)
-            with ProcessPoolExecutor(cpus) as executor:
-                print('Deserializing data and removing units...')
-                deserialized_data = list(tqdm(executor.map(
-                    deserialize_and_remove_units, rep_data.values()),
-                    total=len(rep_data)))
-            rep_data = dict(zip(rep_data.keys(), deserialized_data))
-            # Get spatial environment data for snapshot plots
-            print('Extracting spatial environment data...')
-            metadata[condition][seed]['bounds'] = rep_data[
-                min(rep_data)]['dimensions']['bounds']
-            metadata[condition][seed]['fields'] = {
-                time: data_at_time['fields']
-                for time, data_at_time in rep_data.items()
-            }
+                cpus=cpus)
             agent_df_paths = partial(agent_data_table,
                 paths_dict=PATHS_TO_LOAD, condition=condition, seed=seed)
-            with ProcessPoolExecutor(cpus) as executor:
-                print('Converting data to DataFrame...')
-                rep_dfs = list(tqdm(executor.map(
-                    agent_df_paths, rep_data.items()),
-                    total=len(rep_data)))
-            # Save data for each experiment as local csv
-            pd.concat(rep_dfs).to_csv(
-                f'data/colony_data/sim_dfs/{experiment_id}.csv')
-            with open(f'data/colony_data/sim_dfs{experiment_id}_metadata.json',
-                'wb'
-            ) as f:
-                json.dump(metadata, f)
+            metadata_path = (f'data/colony_data/sim_dfs/{experiment_id}'
+                '_metadata.json')
+            with ProcessPoolExecutor(cpus) as executor, open(
+                metadata_path, 'w'
+            ) as metadata_file:
+                print('Loading data in chunks of {} times...'.format(
+                    chunk_size))
+                for i, rep_data in enumerate(tqdm(rep_chunks)):
+                    deserialized_data = executor.map(
+                        deserialize_and_remove_units, rep_data.values())
+                    rep_data = dict(zip(rep_data.keys(), deserialized_data))
+                    # Get spatial environment data for snapshot plots
+                    if i == 0:
+                        bounds = rep_data[min(rep_data)]['dimensions'][
+                            'bounds']
+                        write_metadata_start(
+                            metadata_file, condition, seed, bounds)
+                    write_metadata_fields(metadata_file, {
+                        time: data_at_time['fields']
+                        for time, data_at_time in rep_data.items()
+                    }, first=i == 0)
+                    rep_dfs = list(executor.map(
+                        agent_df_paths, rep_data.items()))
+                    # Save data for each experiment as local csv
+                    pd.concat(rep_dfs).to_csv(
+                        f'data/colony_data/sim_dfs/{experiment_id}.csv',
+                        mode='w' if i == 0 else 'a', header=i == 0)
+                metadata_file.write('}}}}')
 
 
 def main():
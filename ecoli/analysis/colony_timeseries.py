@@ -0,0 +1,208 @@
+"""
+========================
+Colony Timeseries Chunks
+========================
+
+Reading a whole colony experiment at once (e.g. with
+:py:func:`ecoli.analysis.db.access_counts`) builds nested dictionaries with
+every agent at every time before any analysis starts, which does not fit in
+memory for long runs with hundreds of agents. The functions here split an
+experiment into chunks of a fixed number of emits, query a few chunks ahead
+in parallel, and convert each chunk into arrays (or DataFrames) per agent::
+
+    path = ('boundary', 'dry_mass')
+    for chunk in iter_colony_timeseries(experiment_id, [path]):
+        for agent_id, timeseries in chunk.items():
+            timeseries['time'], timeseries[path]
+
+At most ``prefetch + 1`` chunks are in memory at a time. See
+:py:func:`ecoli.analysis.db.iter_colony_timeseries` and
+:py:func:`ecoli.analysis.db.iter_query` for the database queries.
+"""
+
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from ecoli.library.bulk_encoding import (
+    BULK_KEY, decode_bulk_timeseries, is_bulk_delta)
+
+
+DEFAULT_CHUNK_SIZE = 500
+TIME_KEY = 'time'
+
+
+def get_time_chunks(times, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Split sorted times into ranges of ``chunk_size`` times.
+
+    Returns:
+        List of ``(first time, last time)`` tuples
+    """
+    return [(times[i], times[min(i + chunk_size, len(times)) - 1])
+        for i in range(0, len(times), chunk_size)]
+
+
+def iter_prefetched(func, args_list, prefetch=2):
+    """Yield ``func(*args)`` for each tuple of arguments in order, running
+    up to ``prefetch`` calls ahead of the caller on threads (sequentially if
+    ``prefetch`` is less than 2)."""
+    if prefetch < 2:
+        for args in args_list:
+            yield func(*args)
+        return
+    with ThreadPoolExecutor(prefetch) as executor:
+        pending = collections.deque()
+        for args in args_list:
+            pending.append(executor.submit(func, *args))
+            if len(pending) > prefetch:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _get_value(data, path):
+    """Get the value at a path (None if it is missing)."""
+    for key in path:
+        if not isinstance(data, dict) or key not in data:
+            return None
+        data = data[key]
+    return data
+
+
+def _to_array(values):
+    """Stack the values of a path at each time (None if missing) into an
+    array. Missing numeric values are NaN; values that are not numeric or
+    change shape are kept in an object array."""
+    present = np.array([value is not None for value in values])
+    non_missing = [value for value in values if value is not None]
+    if not non_missing:
+        return np.full(len(values), np.nan)
+    try:
+        array = np.array(non_missing)
+    except ValueError:
+        # Arrays of different lengths
+        array = None
+    if (array is None or array.dtype.kind not in 'biuf'
+        or len(array) != len(non_missing)
+    ):
+        result = np.empty(len(values), dtype=object)
+        for i, value in enumerate(values):
+            result[i] = value
+        return result
+    if present.all():
+        return array
+    result = np.full((len(values),) + array.shape[1:], np.nan)
+    result[present] = array
+    return result
+
+
+def agent_timeseries(data, paths, previous_bulk=None):
+    """Convert a chunk of :term:`raw data` to timeseries per agent.
+
+    Args:
+        data: Dictionary from time to emitted data with the cells under
+            ``'agents'``
+        paths: Paths in each agent to convert
+        previous_bulk: Dictionary from agent ID to its last bulk counts,
+            used to decode bulk count deltas (see
+            :py:mod:`ecoli.library.bulk_encoding`) at the start of a chunk
+            and updated with the last counts in this chunk. Pass the same
+            dictionary for all chunks of an experiment.
+
+    Returns:
+        Dictionary from agent ID to a dictionary with the times of the
+        agent (``'time'``) and an array with a row per time for each path
+    """
+    if previous_bulk is None:
+        previous_bulk = {}
+    paths = [tuple(path) for path in paths]
+    agents = {}
+    for time in sorted(data):
+        for agent_id, agent_data in data[time].get('agents', {}).items():
+            agent = agents.setdefault(agent_id, {TIME_KEY: []})
+            agent[TIME_KEY].append(time)
+            for path in paths:
+                agent.setdefault(path, []).append(
+                    _get_value(agent_data, path))
+
+    timeseries = {}
+    for agent_id, agent in agents.items():
+        timeseries[agent_id] = {TIME_KEY: np.array(agent.pop(TIME_KEY))}
+        for path, values in agent.items():
+            if path == (BULK_KEY,) and any(
+                is_bulk_delta(value) for value in values
+            ):
+                # Continue from the counts at the end of the last chunk
+                previous = previous_bulk.get(agent_id)
+                if previous is not None:
+                    array = decode_bulk_timeseries([previous] + values)[1:]
+                else:
+                    array = decode_bulk_timeseries(values)
+            else:
+                array = _to_array(values)
+            if path == (BULK_KEY,) and len(array):
+                previous_bulk[agent_id] = array[-1]
+            timeseries[agent_id][path] = array
+    return timeseries
+
+
+def agent_dataframes(data, paths, previous_bulk=None):
+    """Convert a chunk of :term:`raw data` to a DataFrame per agent.
+
+    Args:
+        data, previous_bulk: See :py:func:`agent_timeseries`
+        paths: Dictionary from column name to path in each agent, or a
+            list of paths (columns are named by joining the path with
+            ``'.'``)
+
+    Returns:
+        Dictionary from agent ID to a DataFrame with a ``'time'`` column
+        and a row per time. Paths with array values have a column of
+        arrays.
+    """
+    if not isinstance(paths, dict):
+        paths = {'.'.join(path): path for path in paths}
+    timeseries = agent_timeseries(data, paths.values(), previous_bulk)
+    dataframes = {}
+    for agent_id, agent in timeseries.items():
+        columns = {TIME_KEY: agent[TIME_KEY]}
+        for name, path in paths.items():
+            array = agent[tuple(path)]
+            columns[name] = list(array) if array.ndim > 1 else array
+        dataframes[agent_id] = pd.DataFrame(columns)
+    return dataframes
+
+
+def test_colony_timeseries():
+    assert get_time_chunks([0, 2, 4, 6, 8], 2) == [(0, 2), (4, 6), (8, 8)]
+    assert list(iter_prefetched(lambda x: x * 2, [(i,) for i in range(9)],
+        prefetch=3)) == list(range(0, 18, 2))
+
+    def get_chunk(start, end):
+        return {float(time): {'agents': {
+            **{'0': {
+                'mass': time,
+                'bulk': [time, 1] if time % 4 == 0 else {
+                    'delta_indexes': [0], 'delta_values': [2]},
+            }},
+            **({'1': {'mass': None, 'listeners': {'v': [time] * (time // 2)}}}
+                if time > 2 else {}),
+        }} for time in range(start, end + 1, 2)}
+
+    previous_bulk = {}
+    chunks = [agent_timeseries(chunk, [('mass',), ('bulk',),
+        ('listeners', 'v')], previous_bulk) for chunk in iter_prefetched(
+        get_chunk, get_time_chunks(list(range(0, 11, 2)), 2))]
+    assert [list(chunk) for chunk in chunks] == [['0'], ['0', '1'], ['0', '1']]
+    np.testing.assert_array_equal(
+        np.concatenate([chunk['0'][('bulk',)] for chunk in chunks]),
+        [[time, 1] for time in range(0, 11, 2)])
+    np.testing.assert_array_equal(chunks[2]['0'][('mass',)], [8, 10])
+    assert np.isnan(chunks[1]['1'][('mass',)]).all()
+    assert chunks[1]['1'][('listeners', 'v')].dtype == object
+
+    dataframes = agent_dataframes(get_chunk(0, 4), {'Mass': ('mass',)})
+    assert list(dataframes['0'].columns) == ['time', 'Mass']
+    assert dataframes['1']['time'].tolist() == [4.0]
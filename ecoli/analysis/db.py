@@ -1,4 +1,5 @@
 import copy
+import inspect
 import itertools
 import collections
 from bson import MinKey, MaxKey
@@ -17,6 +18,10 @@ from vivarium.core.serialize import deserialize_value
 from vivarium.library.units import remove_units
 
 from ecoli.analysis.centralCarbonMetabolismScatter import get_toya_flux_rxns
+from ecoli.analysis.colony_timeseries import (DEFAULT_CHUNK_SIZE,
+    agent_dataframes, agent_timeseries, get_time_chunks, iter_prefetched)
+from ecoli.analysis.db_cache import cached_query
+from ecoli.library.bulk_encoding import decode_bulk_deltas
 from ecoli.library.sim_data import LoadSimData, SIM_DATA_PATH
 from wholecell.utils import toya
 
@@ -99,6 +104,8 @@ def access(
     data, sim_config = data_from_database(
         experiment_id, db, query, func_dict, f, filters,
         start_time, end_time, cpus)
+    # Rebuild dense bulk counts if they were emitted as deltas
+    data = decode_bulk_deltas(data)
 
     return data, experiment_id, sim_config
 
@@ -158,10 +165,56 @@ def val_at_idx_in_path(idx, path):
     }
 
 
+def get_count_indices(experiment_id, monomer_names=None, mrna_names=None,
+    rna_init=None, rna_synth_prob=None, host='localhost', port=27017
+):
+    """Load the configuration and sim_data of an experiment to get the
+    listener indices of the molecules that :py:func:`access_counts` reads.
+
+    Args:
+        experiment_id, monomer_names, mrna_names, rna_init, rna_synth_prob,
+            host, port: See :py:func:`access_counts`
+
+    Returns:
+        Dictionary with the lists of indices of ``monomer_names``
+        (``'monomer'``), ``mrna_names`` (``'mrna'``), ``rna_init`` and
+        ``rna_synth_prob``
+    """
+    config = {
+        'host': f'{host}:{port}',
+        'database': 'simulations'
+    }
+    emitter = DatabaseEmitter(config)
+    db = emitter.db
+
+    # Retrieve and re-assemble experiment config
+    experiment_query = {'experiment_id': experiment_id}
+    experiment_config = db.configuration.find(experiment_query)
+    experiment_assembly = assemble_data(experiment_config)
+    assert len(experiment_assembly) == 1
+    assembly_id = list(experiment_assembly.keys())[0]
+    experiment_config = experiment_assembly[assembly_id]['metadata']
+    # Load sim_data using parameters from experiment_config
+    rnai_data = experiment_config['process_configs'].get(
+        'ecoli-rna-interference', None)
+    sim_data = LoadSimData(
+        sim_data_path=experiment_config['sim_data_path'],
+        seed=experiment_config['seed'],
+        mar_regulon=experiment_config.get('mar_regulon', False),
+        rnai_data=rnai_data)
+    return {
+        'monomer': sim_data.get_monomer_counts_indices(monomer_names or []),
+        'mrna': sim_data.get_mrna_counts_indices(mrna_names or []),
+        'rna_init': sim_data.get_rna_indices(rna_init or []),
+        'rna_synth_prob': sim_data.get_rna_indices(rna_synth_prob or []),
+    }
+
+
+@cached_query
 def access_counts(experiment_id, monomer_names=None, mrna_names=None,
     rna_init=None, rna_synth_prob=None, inner_paths=None, outer_paths=None,
     host='localhost', port=27017, sampling_rate=None, start_time=None,
-    end_time=None, cpus=1, func_dict=None
+    end_time=None, cpus=1, func_dict=None, count_indices=None
 ):
     """Retrieve monomer/mRNA counts or any other data from MongoDB. Note that
     this only works for experiments run using EcoliEngineProcess (each cell
@@ -191,6 +244,13 @@ def access_counts(experiment_id, monomer_names=None, mrna_names=None,
             operates on the retrieved values and returns the results. If None
             then the raw values are returned.
             In the format: {('path', 'to', 'field1'): function}
+        count_indices: Indices of the molecules from
+            :py:func:`get_count_indices`, to avoid loading sim_data again
+            when querying an experiment repeatedly (e.g. in chunks)
+        cache_dir: Directory to cache results in (see
+            :py:mod:`ecoli.analysis.db_cache`), e.g. ``out/db_cache``
+            relative to the working directory. None (default) to always
+            query MongoDB.
     """
     if not monomer_names:
         monomer_names = []
@@ -214,23 +274,11 @@ def access_counts(experiment_id, monomer_names=None, mrna_names=None,
     }
     emitter = DatabaseEmitter(config)
     db = emitter.db
+    if count_indices is None:
+        count_indices = get_count_indices(experiment_id, monomer_names,
+            mrna_names, rna_init, rna_synth_prob, host, port)
 
-    # Retrieve and re-assemble experiment config
     experiment_query = {'experiment_id': experiment_id}
-    experiment_config = db.configuration.find(experiment_query)
-    experiment_assembly = assemble_data(experiment_config)
-    assert len(experiment_assembly) == 1
-    assembly_id = list(experiment_assembly.keys())[0]
-    experiment_config = experiment_assembly[assembly_id]['metadata']
-    # Load sim_data using parameters from experiment_config
-    rnai_data = experiment_config['process_configs'].get(
-        'ecoli-rna-interference', None)
-    sim_data = LoadSimData(
-        sim_data_path=experiment_config['sim_data_path'],
-        seed=experiment_config['seed'],
-        mar_regulon=experiment_config.get('mar_regulon', False),
-        rnai_data=rnai_data)
-
     time_filter = {'data.time': {'$gte': start_time, '$lte': end_time}}
     if sampling_rate:
         time_filter['data.time']['$mod'] = [sampling_rate, 0]
@@ -248,7 +296,7 @@ def access_counts(experiment_id, monomer_names=None, mrna_names=None,
         'data.dimensions': 1,
         'assembly_id': 1,
         }})
-    monomer_idx = sim_data.get_monomer_counts_indices(monomer_names)
+    monomer_idx = count_indices['monomer']
     projection = {
         '$project': {
             f'data.agents.v.monomer.{monomer}':
@@ -259,7 +307,7 @@ def access_counts(experiment_id, monomer_names=None, mrna_names=None,
             for monomer, monomer_index in zip(monomer_names, monomer_idx)
         }
     }
-    mrna_idx = sim_data.get_mrna_counts_indices(mrna_names)
+    mrna_idx = count_indices['mrna']
     projection['$project'].update({
         f'data.agents.v.mrna.{mrna}':
             val_at_idx_in_path(
@@ -282,7 +330,7 @@ def access_counts(experiment_id, monomer_names=None, mrna_names=None,
             }
         }
     })
-    rna_idx = sim_data.get_rna_indices(rna_init)
+    rna_idx = count_indices['rna_init']
     projection['$project'].update({
         f'data.agents.v.rna_init.{rna}':
             val_at_idx_in_path(
@@ -291,7 +339,7 @@ def access_counts(experiment_id, monomer_names=None, mrna_names=None,
             )
         for rna, rna_index in zip(rna_init, rna_idx)
     })
-    rna_idx = sim_data.get_rna_indices(rna_synth_prob)
+    rna_idx = count_indices['rna_synth_prob']
     projection['$project'].update({
         f'data.agents.v.rna_synth_prob.{rna}':
             val_at_idx_in_path(
@@ -377,7 +425,10 @@ def access_counts(experiment_id, monomer_names=None, mrna_names=None,
     return data
 
 
-def get_proteome_data(experiment_id, host='localhost', port=27017, cpus=1):
+@cached_query
+def get_proteome_data(experiment_id, host='localhost', port=27017, cpus=1,
+    start_time=None, end_time=None
+):
     """Get monomer counts for all agents in a sim.
     
     Args:
@@ -385,7 +436,17 @@ def get_proteome_data(experiment_id, host='localhost', port=27017, cpus=1):
         host: Host name of MongoDB
         port: Port of MongoDB
         cpus: Number of chunks to split aggregation into to be run in parallel
+        start_time: Time to start pulling data
+        end_time: Time to stop pulling data
+        cache_dir: Directory to cache results in (see
+            :py:mod:`ecoli.analysis.db_cache`), e.g. ``out/db_cache``
+            relative to the working directory. None (default) to always
+            query MongoDB.
     """
+    if not start_time:
+        start_time = MinKey()
+    if not end_time:
+        end_time = MaxKey()
     config = {
         'host': f'{host}:{port}',
         'database': 'simulations'
@@ -394,7 +455,9 @@ def get_proteome_data(experiment_id, host='localhost', port=27017, cpus=1):
     db = emitter.db
 
     aggregation = [
-        {'$match': {'experiment_id': experiment_id}},
+        {'$match': {
+            'experiment_id': experiment_id,
+            'data.time': {'$gte': start_time, '$lte': end_time}}},
         {
             '$project': {
                 'data.agents': {
@@ -425,8 +488,6 @@ def get_proteome_data(experiment_id, host='localhost', port=27017, cpus=1):
     ]
 
     if cpus > 1:
-        start_time = MinKey()
-        end_time = MaxKey()
         chunks = get_data_chunks(
             db.history, experiment_id, start_time, end_time, cpus)
         aggregations = []
@@ -434,7 +495,8 @@ def get_proteome_data(experiment_id, host='localhost', port=27017, cpus=1):
             agg_chunk = copy.deepcopy(aggregation)
             agg_chunk[0]['$match'] = {
                 'experiment_id': experiment_id,
-                '_id': {'$gte': chunk[0], '$lt': chunk[1]}
+                '_id': {'$gte': chunk[0], '$lt': chunk[1]},
+                'data.time': {'$gte': start_time, '$lte': end_time}
             }
             aggregations.append(agg_chunk)
         partial_get_agg = partial(get_aggregation, host, port)
@@ -466,7 +528,10 @@ def get_proteome_data(experiment_id, host='localhost', port=27017, cpus=1):
     return data
 
 
-def get_transcriptome_data(experiment_id, host='localhost', port=27017, cpus=1):
+@cached_query
+def get_transcriptome_data(experiment_id, host='localhost', port=27017, cpus=1,
+    start_time=None, end_time=None
+):
     """Get mRNA counts for all agents in a sim.
     
     Args:
@@ -474,7 +539,17 @@ def get_transcriptome_data(experiment_id, host='localhost', port=27017, cpus=1):
         host: Host name of MongoDB
         port: Port of MongoDB
         cpus: Number of chunks to split aggregation into to be run in parallel
+        start_time: Time to start pulling data
+        end_time: Time to stop pulling data
+        cache_dir: Directory to cache results in (see
+            :py:mod:`ecoli.analysis.db_cache`), e.g. ``out/db_cache``
+            relative to the working directory. None (default) to always
+            query MongoDB.
     """
+    if not start_time:
+        start_time = MinKey()
+    if not end_time:
+        end_time = MaxKey()
     config = {
         'host': f'{host}:{port}',
         'database': 'simulations'
@@ -483,7 +558,9 @@ def get_transcriptome_data(experiment_id, host='localhost', port=27017, cpus=1):
     db = emitter.db
 
     aggregation = [
-        {'$match': {'experiment_id': experiment_id}},
+        {'$match': {
+            'experiment_id': experiment_id,
+            'data.time': {'$gte': start_time, '$lte': end_time}}},
         {
             '$project': {
                 'data.agents': {
@@ -514,8 +591,6 @@ def get_transcriptome_data(experiment_id, host='localhost', port=27017, cpus=1):
     ]
 
     if cpus > 1:
-        start_time = MinKey()
-        end_time = MaxKey()
         chunks = get_data_chunks(
             db.history, experiment_id, start_time, end_time, cpus)
         aggregations = []
@@ -523,7 +598,8 @@ def get_transcriptome_data(experiment_id, host='localhost', port=27017, cpus=1):
             agg_chunk = copy.deepcopy(aggregation)
             agg_chunk[0]['$match'] = {
                 'experiment_id': experiment_id,
-                '_id': {'$gte': chunk[0], '$lt': chunk[1]}
+                '_id': {'$gte': chunk[0], '$lt': chunk[1]},
+                'data.time': {'$gte': start_time, '$lte': end_time}
             }
             aggregations.append(agg_chunk)
         partial_get_agg = partial(get_aggregation, host, port)
@@ -644,7 +720,18 @@ def get_gene_expression_data(experiment_id, host='localhost', port=27017, cpus=1
     return data
 
 
-def get_fluxome_data(experiment_id, host='localhost', port=27017, cpus=1):
+def get_fluxome_rxn_indices():
+    """Get the indices (in the ``reactionFluxes`` listener) of the central
+    carbon metabolism reactions that :py:func:`get_fluxome_data` reads."""
+    rxn_ids = get_toya_flux_rxns(SIM_DATA_PATH)
+    return [int(i) for i in itertools.chain.from_iterable(
+        list(rxn_ids.values()))]
+
+
+@cached_query
+def get_fluxome_data(experiment_id, host='localhost', port=27017, cpus=1,
+    start_time=None, end_time=None, rxn_indices=None
+):
     """Get central carbon metabolism fluxes for all agents in a sim.
     
     Args:
@@ -652,7 +739,20 @@ def get_fluxome_data(experiment_id, host='localhost', port=27017, cpus=1):
         host: Host name of MongoDB
         port: Port of MongoDB
         cpus: Number of chunks to split aggregation into to be run in parallel
+        start_time: Time to start pulling data
+        end_time: Time to stop pulling data
+        rxn_indices: Reaction indices from
+            :py:func:`get_fluxome_rxn_indices`, to avoid loading sim_data
+            again when querying an experiment repeatedly (e.g. in chunks)
+        cache_dir: Directory to cache results in (see
+            :py:mod:`ecoli.analysis.db_cache`), e.g. ``out/db_cache``
+            relative to the working directory. None (default) to always
+            query MongoDB.
     """
+    if not start_time:
+        start_time = MinKey()
+    if not end_time:
+        end_time = MaxKey()
     config = {
         'host': f'{host}:{port}',
         'database': 'simulations'
@@ -660,11 +760,14 @@ def get_fluxome_data(experiment_id, host='localhost', port=27017, cpus=1):
     emitter = DatabaseEmitter(config)
     db = emitter.db
     
-    rxn_ids = get_toya_flux_rxns(SIM_DATA_PATH)
-    sim_rxn_indices = [int(i) for i in itertools.chain.from_iterable(list(rxn_ids.values()))]
+    sim_rxn_indices = rxn_indices
+    if sim_rxn_indices is None:
+        sim_rxn_indices = get_fluxome_rxn_indices()
 
     aggregation = [
-        {'$match': {'experiment_id': experiment_id}},
+        {'$match': {
+            'experiment_id': experiment_id,
+            'data.time': {'$gte': start_time, '$lte': end_time}}},
         {
             '$project': {
                 'data.agents': {
@@ -704,8 +807,6 @@ def get_fluxome_data(experiment_id, host='localhost', port=27017, cpus=1):
     aggregation.append(final_projection)
 
     if cpus > 1:
-        start_time = MinKey()
-        end_time = MaxKey()
         chunks = get_data_chunks(
             db.history, experiment_id, start_time, end_time, cpus)
         aggregations = []
@@ -713,7 +814,8 @@ def get_fluxome_data(experiment_id, host='localhost', port=27017, cpus=1):
             agg_chunk = copy.deepcopy(aggregation)
             agg_chunk[0]['$match'] = {
                 'experiment_id': experiment_id,
-                '_id': {'$gte': chunk[0], '$lt': chunk[1]}
+                '_id': {'$gte': chunk[0], '$lt': chunk[1]},
+                'data.time': {'$gte': start_time, '$lte': end_time}
             }
             aggregations.append(agg_chunk)
         partial_get_agg = partial(get_aggregation, host, port)
@@ -743,3 +845,140 @@ def get_fluxome_data(experiment_id, host='localhost', port=27017, cpus=1):
         )
 
     return data
+
+
+def get_times(experiment_id, host='localhost', port=27017, start_time=None,
+    end_time=None, sampling_rate=None
+):
+    """Get the sorted emit times of an experiment.
+
+    Args:
+        experiment_id: Experiment ID for simulation
+        host: Host name of MongoDB
+        port: Port of MongoDB
+        start_time: First time to include
+        end_time: Last time to include
+        sampling_rate: Only include every this many seconds
+    """
+    config = {
+        'host': f'{host}:{port}',
+        'database': 'simulations'
+    }
+    emitter = DatabaseEmitter(config)
+    db = emitter.db
+
+    times = db.history.distinct('data.time', {
+        'experiment_id': experiment_id,
+        'data.time': {
+            '$gte': start_time if start_time is not None else MinKey(),
+            '$lte': end_time if end_time is not None else MaxKey(),
+        },
+    })
+    times = sorted(time for time in times if isinstance(time, (int, float)))
+    if sampling_rate:
+        times = [time for time in times if time % sampling_rate == 0]
+    return times
+
+
+def _get_query_inputs(query, experiment_id, host, port, kwargs):
+    """Load the inputs of a query that come from the configuration and
+    sim_data of an experiment (see :py:func:`get_count_indices` and
+    :py:func:`get_fluxome_rxn_indices`), unless they are given in
+    ``kwargs``."""
+    parameters = inspect.signature(query).parameters
+    inputs = {}
+    if 'count_indices' in parameters and kwargs.get('count_indices') is None:
+        inputs['count_indices'] = get_count_indices(experiment_id,
+            kwargs.get('monomer_names'), kwargs.get('mrna_names'),
+            kwargs.get('rna_init'), kwargs.get('rna_synth_prob'), host, port)
+    if 'rxn_indices' in parameters and kwargs.get('rxn_indices') is None:
+        inputs['rxn_indices'] = get_fluxome_rxn_indices()
+    return inputs
+
+
+def iter_query(query, experiment_id, chunk_size=DEFAULT_CHUNK_SIZE,
+    prefetch=2, host='localhost', port=27017, start_time=None,
+    end_time=None, sampling_rate=None, **kwargs
+):
+    """Run a query in chunks of emit times to keep only a few chunks of a
+    long experiment in memory.
+
+    Args:
+        query: Query function that takes ``experiment_id``, ``host``,
+            ``port``, ``start_time`` and ``end_time`` (e.g.
+            :py:func:`access_counts` or :py:func:`get_proteome_data`). The
+            results cache of cached queries is not used since it is read
+            whole. Inputs that queries load from sim_data (e.g. molecule
+            indices) are loaded once for all chunks.
+        experiment_id: Experiment ID for simulation
+        chunk_size: Number of emit times per chunk
+        prefetch: Number of chunks to query ahead of the caller in parallel
+        host: Host name of MongoDB
+        port: Port of MongoDB
+        start_time: Time to start pulling data
+        end_time: Time to stop pulling data
+        sampling_rate: Get data every this many seconds
+        kwargs: Other arguments of the query (e.g. ``monomer_names``)
+
+    Yields:
+        :term:`raw data` of each chunk, in time order
+    """
+    query = getattr(query, '__wrapped__', query)
+    times = get_times(experiment_id, host, port, start_time, end_time,
+        sampling_rate)
+    if sampling_rate and 'sampling_rate' in inspect.signature(query).parameters:
+        kwargs['sampling_rate'] = sampling_rate
+    kwargs.update(_get_query_inputs(query, experiment_id, host, port, kwargs))
+    sampled_times = set(times)
+
+    def get_chunk(chunk_start, chunk_end):
+        data = query(experiment_id, host=host, port=port,
+            start_time=chunk_start, end_time=chunk_end, **kwargs)
+        return {time: value for time, value in data.items()
+            if time in sampled_times}
+
+    yield from iter_prefetched(
+        get_chunk, get_time_chunks(times, chunk_size), prefetch)
+
+
+def iter_colony_timeseries(experiment_id, paths, chunk_size=DEFAULT_CHUNK_SIZE,
+    prefetch=2, as_dataframe=False, host='localhost', port=27017,
+    start_time=None, end_time=None, sampling_rate=None, cpus=1
+):
+    """Get timeseries of paths in each agent of a colony, a chunk of emit
+    times at a time (see :py:mod:`ecoli.analysis.colony_timeseries`).
+
+    Args:
+        experiment_id: Experiment ID for simulation
+        paths: Paths to stores inside each agent, or a dictionary from
+            DataFrame column name to path
+        chunk_size: Number of emit times per chunk
+        prefetch: Number of chunks to query ahead of the caller in parallel
+        as_dataframe: Whether to yield DataFrames instead of arrays
+        host: Host name of MongoDB
+        port: Port of MongoDB
+        start_time: Time to start pulling data
+        end_time: Time to stop pulling data
+        sampling_rate: Get data every this many seconds
+        cpus: Number of chunks to split the aggregation of each chunk of
+            times into to be run in parallel
+
+    Yields:
+        Dictionary from agent ID to the timeseries of the agent in a chunk
+        (see :py:func:`ecoli.analysis.colony_timeseries.agent_timeseries`
+        and :py:func:`ecoli.analysis.colony_timeseries.agent_dataframes`)
+    """
+    inner_paths = [tuple(path) for path in (
+        paths.values() if isinstance(paths, dict) else paths)]
+    # Bulk counts at the end of the last chunk to decode deltas
+    previous_bulk = {}
+    for data in iter_query(access_counts, experiment_id, chunk_size,
+        prefetch, host, port, start_time, end_time, sampling_rate,
+        inner_paths=inner_paths, cpus=cpus
+    ):
+        data = {time: deserialize_and_remove_units(value)
+            for time, value in data.items()}
+        if as_dataframe:
+            yield agent_dataframes(data, paths, previous_bulk)
+        else:
+            yield agent_timeseries(data, inner_paths, previous_bulk)
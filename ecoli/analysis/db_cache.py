@@ -0,0 +1,412 @@
+"""
+=====================
+Database Query Cache
+=====================
+
+The queries in :py:mod:`ecoli.analysis.db` run MongoDB aggregation pipelines
+that can take hours for large colony experiments. :py:func:`cached_query`
+caches their results on disk so that plotting scripts only query each time
+range of an experiment once::
+
+    <cache_dir>/<experiment_id>/<query name>-<parameter hash>.*
+
+The cache is keyed by the query name, the experiment ID and all other query
+parameters (e.g. paths and ``sampling_rate``) except ``start_time``,
+``end_time`` and ``cpus``. Functions in parameters (e.g. ``func_dict``) are
+keyed by their name and a hash of their code, so editing them invalidates
+the cache (but changing globals that they read does not). It records which time ranges it covers, so a
+later query only fetches the times that are missing. Ranges are only
+covered up to the last time that was returned, so later queries fetch the
+emits that an experiment that is still running added after it.
+
+Results are stored as columns (one per path in the data, with the rows it
+has a value in) in the format of :py:mod:`ecoli.library.sim_data_cache`, so
+numeric values are saved as NumPy arrays. Each query that fetches missing
+times appends them as a new segment of columns instead of rewriting the
+cache, and ``<query name>-<parameter hash>.json`` lists the segments and the
+covered time ranges. Once there are more than :py:data:`MAX_CACHE_SEGMENTS`
+segments, they are merged into one. Numeric values are returned as
+Python numbers like the database returns them, but integers in columns that
+also have floats come back as floats.
+
+Caching is opt-in: pass a ``cache_dir`` (e.g. :py:data:`DEFAULT_CACHE_DIR`,
+which is relative to the working directory) to a cached query to use it.
+"""
+
+import functools
+import hashlib
+import inspect
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from ecoli.library.sim_data_cache import (
+    write_buffer_cache, read_buffer_cache, load_buffer_cache)
+
+
+DEFAULT_CACHE_DIR = os.path.join('out', 'db_cache')
+# Query parameters that select a time range or only change how it is queried
+_TIME_RANGE_PARAMETERS = ('start_time', 'end_time', 'cpus')
+# Number of segments of columns after which a cache is merged into one
+MAX_CACHE_SEGMENTS = 16
+
+
+def _get_time_bound(time, default):
+    """Get a time bound as a float (MinKey, MaxKey and None are unbounded)."""
+    if isinstance(time, (int, float)) and not isinstance(time, bool):
+        return float(time)
+    return default
+
+
+def _get_query_bound(time):
+    """Get a time bound to pass to a query (None if unbounded)."""
+    return None if np.isinf(time) else time
+
+
+def _get_code_key(code):
+    """Get a hash of the bytecode and constants of a code object (including
+    nested functions) that is the same in every Python process."""
+    constants = []
+    for constant in code.co_consts:
+        if inspect.iscode(constant):
+            constant = _get_code_key(constant)
+        elif isinstance(constant, frozenset):
+            # Set order changes with string hash randomization
+            constant = sorted(repr(item) for item in constant)
+        constants.append(repr(constant))
+    return hashlib.sha256(code.co_code
+        + json.dumps(constants).encode('utf-8')).hexdigest()[:16]
+
+
+def _get_parameter_key(value):
+    if callable(value):
+        key = f'{value.__module__}.{getattr(value, "__qualname__", value)}'
+        # Editing a function (e.g. in a func_dict) must invalidate the cache
+        code = getattr(value, '__code__', None)
+        if code is not None:
+            key += f'-{_get_code_key(code)}'
+        return key
+    return str(value)
+
+
+def get_cache_prefix(cache_dir, query_name, experiment_id, parameters):
+    """Get the path prefix of the cache files of a query.
+
+    Args:
+        cache_dir: Root directory of the cache
+        query_name: Name of the query function
+        experiment_id: Experiment ID
+        parameters: All other query parameters that change the results
+    """
+    parameters_hash = hashlib.sha256(json.dumps(parameters, sort_keys=True,
+        default=_get_parameter_key).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir,
+        str(experiment_id).replace(os.sep, '_'),
+        f'{query_name}-{parameters_hash}')
+
+
+def get_missing_ranges(covered, start, end):
+    """Get the parts of a time range that are not covered.
+
+    Args:
+        covered: Sorted list of non-overlapping ``[start, end]`` ranges
+        start, end: Time range
+
+    Returns:
+        List of ``(start, end)`` ranges (the ranges overlap ``covered`` at
+        their ends)
+    """
+    missing = []
+    for covered_start, covered_end in covered:
+        if covered_end < start or covered_start > end:
+            continue
+        if covered_start > start:
+            missing.append((start, covered_start))
+        start = max(start, covered_end)
+        if start >= end:
+            return missing
+    missing.append((start, end))
+    return missing
+
+
+def add_covered_range(covered, start, end):
+    """Get a sorted list of non-overlapping ranges with a new range."""
+    ranges = sorted(list(covered) + [[start, end]])
+    merged = [list(ranges[0])]
+    for range_start, range_end in ranges[1:]:
+        if range_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], range_end)
+        else:
+            merged.append([range_start, range_end])
+    return merged
+
+
+def _flatten(value, path, row, columns):
+    if isinstance(value, dict) and value:
+        for key, subvalue in value.items():
+            _flatten(subvalue, path + (key,), row, columns)
+    else:
+        rows, values = columns.setdefault(path, ([], []))
+        rows.append(row)
+        values.append(value)
+
+
+def _pack_values(values):
+    """Store numeric values (and lists of them) of a column as an array
+    with a mask of the values that are not None."""
+    present = np.array([value is not None for value in values])
+    numeric = [value for value in values if value is not None]
+    if numeric and not any(isinstance(value, (str, dict)) for value in numeric):
+        try:
+            array = np.array(numeric)
+        except ValueError:
+            # Lists of different lengths
+            array = None
+        if (array is not None and array.dtype.kind in 'biuf'
+            and len(array) == len(numeric)
+        ):
+            return present, array
+    return None, values
+
+
+def _unpack_values(present, values):
+    if present is None:
+        return values
+    numeric = iter(values.tolist())
+    return [next(numeric) if is_present else None for is_present in present]
+
+
+def to_columns(data):
+    """Convert :term:`raw data` to columns.
+
+    Returns:
+        Dictionary with the sorted ``times`` and the ``columns`` keyed by
+        path, each a tuple of the rows (indexes into ``times``) that have
+        a value, a mask of the values that are not None (or None if the
+        values are not numeric) and the values
+    """
+    times = sorted(data)
+    columns = {}
+    for row, time in enumerate(times):
+        _flatten(data[time], (), row, columns)
+    return {
+        'times': np.array(times, dtype=np.float64),
+        'columns': {
+            path: (np.array(rows, dtype=np.int64), *_pack_values(values))
+            for path, (rows, values) in columns.items()},
+    }
+
+
+def from_columns(columnar, start=-np.inf, end=np.inf):
+    """Convert columns made by :py:func:`to_columns` back to :term:`raw
+    data`, optionally for a time range only."""
+    times = columnar['times']
+    first_row = np.searchsorted(times, start, side='left')
+    end_row = np.searchsorted(times, end, side='right')
+    data = {time: {} for time in times[first_row:end_row].tolist()}
+    row_times = times.tolist()
+    for path, (rows, present, values) in columnar['columns'].items():
+        selected = (rows >= first_row) & (rows < end_row)
+        if not selected.all():
+            rows = rows[selected]
+            if present is None:
+                values = [value for value, is_selected
+                    in zip(values, selected) if is_selected]
+            else:
+                values = values[selected[present]]
+                present = present[selected]
+        for row, value in zip(rows.tolist(), _unpack_values(present, values)):
+            if not path:
+                data[row_times[row]] = value
+                continue
+            target = data[row_times[row]]
+            for key in path[:-1]:
+                target = target.setdefault(key, {})
+            target[path[-1]] = value
+    return data
+
+
+def read_cache(cache_prefix):
+    """Read the cached results of a query (None if there are none)."""
+    if not os.path.exists(f'{cache_prefix}.json'):
+        return None
+    return load_buffer_cache(*read_buffer_cache(cache_prefix))
+
+
+def read_cache_index(cache_prefix):
+    """Read the time ranges that the cache of a query covers and the
+    segments of columns that it is made of."""
+    if not os.path.exists(f'{cache_prefix}.json'):
+        return {'covered': [], 'segments': []}
+    with open(f'{cache_prefix}.json', 'r') as f:
+        return json.load(f)
+
+
+def write_cache_index(index, cache_prefix):
+    os.makedirs(os.path.dirname(cache_prefix), exist_ok=True)
+    with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(cache_prefix),
+        delete=False
+    ) as f:
+        json.dump(index, f)
+    os.replace(f.name, f'{cache_prefix}.json')
+
+
+def _from_segments(segments, start=-np.inf, end=np.inf):
+    """Convert segments of columns to :term:`raw data` (later segments
+    replace the times of earlier ones)."""
+    data = {}
+    for segment in segments:
+        data.update(from_columns(segment, start, end))
+    return dict(sorted(data.items()))
+
+
+def cached_query(query):
+    """Decorate a query function to cache its results on disk.
+
+    The query must take the experiment ID as its first argument and
+    ``start_time`` and ``end_time`` arguments (None for an unbounded time
+    range), and return :term:`raw data`. The decorated function takes an
+    additional ``cache_dir`` keyword argument (default: None to always run
+    the query).
+    """
+    signature = inspect.signature(query)
+
+    @functools.wraps(query)
+    def cached(*args, cache_dir=None, **kwargs):
+        if cache_dir is None:
+            return query(*args, **kwargs)
+        arguments = signature.bind(*args, **kwargs)
+        arguments.apply_defaults()
+        arguments = arguments.arguments
+        experiment_id = next(iter(arguments.values()))
+        start = _get_time_bound(arguments.get('start_time'), -np.inf)
+        end = _get_time_bound(arguments.get('end_time'), np.inf)
+        parameters = {key: value for key, value in arguments.items()
+            if key not in _TIME_RANGE_PARAMETERS}
+        cache_prefix = get_cache_prefix(
+            cache_dir, query.__name__, experiment_id, parameters)
+
+        index = read_cache_index(cache_prefix)
+        segments = [read_cache(f'{cache_prefix}.{segment}')
+            for segment in index['segments']]
+        missing = get_missing_ranges(index['covered'], start, end)
+        if not missing:
+            return _from_segments(segments, start, end)
+
+        data = {}
+        for missing_start, missing_end in missing:
+            data.update(query(**dict(arguments,
+                start_time=_get_query_bound(missing_start),
+                end_time=_get_query_bound(missing_end))))
+        # Times after the last emit can still be emitted (e.g. while the
+        # experiment is running), so they are not covered yet
+        last_time = max([*data, *(segment['times'][-1]
+            for segment in segments if len(segment['times']))],
+            default=-np.inf)
+        covered = index['covered']
+        for missing_start, missing_end in missing:
+            missing_end = min(missing_end, last_time)
+            if missing_end >= missing_start:
+                covered = add_covered_range(
+                    covered, missing_start, missing_end)
+        segment_names = list(index['segments'])
+        old_segment_names = []
+        if data:
+            # Only write the new times instead of rewriting the whole cache
+            segments.append(to_columns(data))
+            if len(segments) > MAX_CACHE_SEGMENTS:
+                old_segment_names = segment_names
+                segment_names = []
+                segments = [to_columns(_from_segments(segments))]
+            segment_names.append(max(index['segments'], default=-1) + 1)
+            write_buffer_cache(segments[-1],
+                f'{cache_prefix}.{segment_names[-1]}')
+        # Written last, so an interrupted update leaves the old cache
+        write_cache_index({'covered': covered, 'segments': segment_names},
+            cache_prefix)
+        for segment in old_segment_names:
+            for suffix in ('json', 'pkl', 'buffers'):
+                os.remove(f'{cache_prefix}.{segment}.{suffix}')
+        return _from_segments(segments, start, end)
+
+    return cached
+
+
+def test_db_cache():
+    import tempfile
+
+    queried = []
+    last_emit = [18]
+
+    def query(experiment_id, paths=None, start_time=None, end_time=None,
+        cpus=1
+    ):
+        start = -np.inf if start_time is None else start_time
+        end = np.inf if end_time is None else end_time
+        queried.append((start, end))
+        return {float(time): {
+            'time_str': str(time),
+            'agents': {'0': {'monomer': {'A': time, 'B': None if time % 4
+                else 2.5}, 'location': [time, 1.0]}},
+            'fields': {'GLC': [[time]] * 2},
+        } for time in range(0, last_emit[0] + 1, 2) if start <= time <= end}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cached = cached_query(query)
+        expected = query('exp')
+        window = cached('exp', paths=['a'], start_time=4, end_time=8,
+            cache_dir=tmp_dir)
+        assert window == {
+            time: value for time, value in expected.items() if 4 <= time <= 8}
+        # Only missing times are queried
+        assert cached('exp', ['a'], cpus=4, cache_dir=tmp_dir) == expected
+        assert queried[-2:] == [(-np.inf, 4), (8, np.inf)]
+        assert cached('exp', ['a'], end_time=6, cache_dir=tmp_dir) == {
+            time: value for time, value in expected.items() if time <= 6}
+        assert len(queried) == 4
+        # New emits after the cached times are queried
+        assert cached('exp', ['a'], cache_dir=tmp_dir) == expected
+        assert queried[-1] == (18, np.inf)
+        # Other parameters have their own cache
+        cached('exp', ['b'], cache_dir=tmp_dir)
+        assert queried[-1] == (-np.inf, np.inf)
+        # New times are appended as segments (3 files each) to an index
+        prefix = get_cache_prefix(tmp_dir, 'query', 'exp',
+            {'experiment_id': 'exp', 'paths': ['a']})
+        assert read_cache_index(prefix)['segments'] == [0, 1, 2]
+        assert len(os.listdir(os.path.join(tmp_dir, 'exp'))) == 14
+
+        # Times after the last emit of a running experiment are queried
+        # again, also for bounded ranges
+        assert cached('exp', ['a'], end_time=30, cache_dir=tmp_dir) == expected
+        last_emit[0] = 26
+        assert list(cached('exp', ['a'], start_time=10, end_time=30,
+            cache_dir=tmp_dir)) == list(range(10, 27, 2))
+        assert queried[-1] == (18, 30)
+        assert list(cached('exp', ['a'], start_time=10, end_time=24,
+            cache_dir=tmp_dir)) == list(range(10, 25, 2))
+        assert queried[-1] == (18, 30)
+        # Caching is opt-in
+        cached('exp', ['a'])
+        assert queried[-1] == (-np.inf, np.inf)
+
+        # Segments are merged once there are too many
+        for _ in range(MAX_CACHE_SEGMENTS):
+            last_emit[0] += 2
+            cached('exp', ['a'], cache_dir=tmp_dir)
+        segments = read_cache_index(prefix)['segments']
+        assert len(segments) < MAX_CACHE_SEGMENTS
+        assert len(os.listdir(os.path.join(tmp_dir, 'exp'))) == 3 * len(
+            segments) + 5
+        assert cached('exp', ['a'], cache_dir=tmp_dir) == query('exp')
+
+    # Functions in parameters are keyed by their code
+    def double(value):
+        return value * 2
+    key = _get_parameter_key(double)
+    def double(value):
+        return value * 3
+    assert _get_parameter_key(double) != key
+    assert _get_parameter_key(double) == _get_parameter_key(double)
@@ -46,6 +46,10 @@ def main():
         '--end_time', '-e', type=int, default=MaxKey())
     parser.add_argument(
         '--cpus', '-c', type=int, default=1)
+    parser.add_argument(
+        '--cache_dir', default=None,
+        help='Directory to cache query results in (e.g. out/db_cache, '
+            'relative to the working directory). Default: no caching.')
     args = parser.parse_args()
 
     # Get the required data
@@ -69,7 +73,8 @@ def main():
         sampling_rate=args.sampling_rate,
         start_time=args.start_time,
         end_time=args.end_time,
-        cpus=args.cpus)
+        cpus=args.cpus,
+        cache_dir=args.cache_dir)
     
     with concurrent.futures.ProcessPoolExecutor(args.cpus) as executor:
         data_deserialized = list(tqdm(executor.map(
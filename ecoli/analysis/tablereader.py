@@ -4,6 +4,8 @@ import numpy as np
 from vivarium.core.emitter import timeseries_from_data
 
 from ecoli.composites.ecoli_master import run_ecoli
+from ecoli.library.bulk_encoding import (decode_bulk_deltas,
+    decode_bulk_timeseries, is_bulk_delta)
 
 from ecoli.analysis.tablereader_utils import (
     replace_scalars, replace_scalars_2d, camel_case_to_underscored)
@@ -349,8 +351,11 @@ class TableReader(object):
         self._path = path
 
         # Store reference to the data
+        # Rebuild dense bulk counts if they were emitted as deltas
         if not timeseries_data:
-            data = timeseries_from_data(data)
+            data = timeseries_from_data(decode_bulk_deltas(data))
+        elif any(is_bulk_delta(value) for value in data.get('bulk', [])):
+            data = dict(data, bulk=list(decode_bulk_timeseries(data['bulk'])))
         self._data = data
 
         # List the column file names.
@@ -28,10 +28,12 @@ from ecoli.experiments.ecoli_master_sim import (
     report_profiling,
     _tuplify_topology
 )
+from ecoli.library.emit_schedule import use_emit_schedule
 from ecoli.library.logging_tools import write_json
 from ecoli.library.sim_data import RAND_MAX
 from ecoli.library.schema import not_a_process
-from ecoli.states.wcecoli_state import get_state_from_file
+from ecoli.states.checkpoint import CHECKPOINT_SUFFIX, CheckpointWriter
+from ecoli.states.wcecoli_state import add_dtypes, get_state_from_file
 from ecoli.processes.engine_process import EngineProcess
 from ecoli.processes.environment.field_timeline import FieldTimeline
 from ecoli.processes.environment.lysis import Lysis
@@ -118,6 +120,8 @@ class EcoliEngineProcess(Composer):
         'divide': False,
         'tunnels_in': tuple(),
         'emit_paths': tuple(),
+        'emit_intervals': {},
+        'bulk_keyframe_interval': None,
         'start_time': 0,
         'experiment_id': '',
         'inner_emitter': 'null',
@@ -148,6 +152,8 @@ class EcoliEngineProcess(Composer):
                 for path in config['tunnels_in']
             }),
             'emit_paths': config['emit_paths'],
+            'emit_intervals': config['emit_intervals'],
+            'bulk_keyframe_interval': config['bulk_keyframe_interval'],
             'tunnel_out_schemas': config['tunnel_out_schemas'],
             'stub_schemas': config['stub_schemas'],
             'seed': (config['seed'] + 1) % RAND_MAX,
@@ -188,10 +194,14 @@ class EcoliEngineProcess(Composer):
         return topology
 
 
+def write_serialized_json(path, state):
+    write_json(path, serialize_value(state))
+
+
 def colony_save_states(engine, config):
     """
     Runs the simulation while saving the states of the colony at specific
-    timesteps to jsons.
+    timesteps to jsons (or checkpoints) in the background.
     """
     # Since unique numpy updater is an class method, internal
     # deepcopying in vivarium-core causes this warning to appear
@@ -203,6 +213,7 @@ def colony_save_states(engine, config):
                 f'Config contains save_time ({time}) > total '
                 f'time ({config["total_time"]})')
 
+    writer = CheckpointWriter(delta=config['save_format'] == 'delta')
     for i in range(len(config["save_times"])):
         if i == 0:
             time_to_next_save = config["save_times"][i]
@@ -230,29 +241,34 @@ def colony_save_states(engine, config):
             del cell_state['evolvers_ran']
             # Shared processes are re-initialized on load
             del cell_state['process']
-            # Save bulk and unique dtypes
-            cell_state['bulk_dtypes'] = str(cell_state['bulk'].dtype)
-            cell_state['unique_dtypes'] = {}
-            for name, mols in cell_state['unique'].items():
-                cell_state['unique_dtypes'][name] = str(mols.dtype)
+            # Save bulk and unique dtypes (checkpoints keep them)
+            if config['save_format'] == 'json':
+                add_dtypes(cell_state)
             state_to_save['agents'][agent_id] = cell_state
 
-        state_to_save = serialize_value(state_to_save)
         if config.get('colony_save_prefix', None):
-            write_json('data/' + str(config['colony_save_prefix']) + '_seed_' \
-                + str(config['seed']) + '_colony_t' + str(time_elapsed) \
-                + '.json', state_to_save)
+            save_path = 'data/' + str(config['colony_save_prefix']) \
+                + '_seed_' + str(config['seed']) + '_colony_t' \
+                + str(time_elapsed)
+        else:
+            save_path = 'data/seed_' + str(config['seed']) \
+                + '_colony_t' + str(time_elapsed)
+        # Keep simulating while the state is written
+        message = 'Finished saving the state at t = ' + str(time_elapsed)
+        if config['save_format'] in ('checkpoint', 'delta'):
+            writer.save_checkpoint(save_path + CHECKPOINT_SUFFIX,
+                state_to_save, message)
         else:
-            write_json('data/seed_' + str(config['seed'])
-                + '_colony_t' + str(time_elapsed) + '.json', state_to_save)
+            writer.save(write_serialized_json, save_path + '.json',
+                state_to_save, message)
         # Cleanup namespace (significant with high cell counts)
         del state_to_save, cell_state
-        print('Finished saving the state at t = ' + str(time_elapsed))
         gc.collect()
     # Finish running the simulation
     time_remaining = config["total_time"] - config["save_times"][-1]
     if time_remaining:
         engine.update(time_remaining)
+    writer.close()
 
 
 def run_simulation(config):
@@ -310,6 +326,8 @@ def run_simulation(config):
         'emit_paths': tuple(
             tuple(path) for path in config['engine_process_reports']
         ),
+        'emit_intervals': config.get('emit_intervals', {}),
+        'bulk_keyframe_interval': config.get('bulk_keyframe_interval'),
         'seed': config['seed'],
         'experiment_id': experiment_id,
         'start_time': config.get('start_time', 0),
@@ -320,7 +338,8 @@ def run_simulation(config):
     composite = {}
     if 'initial_colony_file' in config.keys():
         initial_state = get_state_from_file(path='data/' \
-            + config["initial_colony_file"] + '.json')
+            + config["initial_colony_file"] + '.json',
+            n_workers=config.get('load_workers'))
         agent_states = initial_state['agents']
         for agent_id, agent_state in agent_states.items():
             # Assume that initial colony file ends in string
@@ -401,6 +420,7 @@ def run_simulation(config):
         profile=config['profile'],
         initial_global_time=config.get('start_time', 0)
     )
+    use_emit_schedule(engine, config.get('emit_intervals'))
     # Unnecessary reference to initial_state
     engine.initial_state = None
     # Tidy up namespace and free memory
@@ -17,6 +17,7 @@ from vivarium.core.control import run_library_cli
 
 # sim data
 from ecoli.library.sim_data import LoadSimData, RAND_MAX
+from ecoli.library.config_bundle import load_config_bundle
 
 # logging
 from ecoli.library.logging_tools import make_logging_process
@@ -28,10 +29,11 @@ from ecoli.plots.topology import get_ecoli_partition_topology_settings
 from ecoli.processes.cell_division import Division
 from ecoli.processes.allocator import Allocator
 from ecoli.processes.partition import PartitionedProcess
-from ecoli.processes.unique_update import UniqueUpdate
+from ecoli.processes.unique_update import UniqueUpdate, get_unique_update_flow
 
 # state
-from ecoli.processes.partition import filter_bulk_topology, Requester, Evolver, Step
+from ecoli.processes.partition import (filter_bulk_topology, Requester,
+    Evolver, Step, get_evolver_executor, get_evolver_locks)
 from ecoli.states.wcecoli_state import get_state_from_file
 
 
@@ -56,6 +58,7 @@ class Ecoli(Composer):
         'chromosome_path': ('unique',' full_chromosome'),
         'divide': False,
         'log_updates': False,
+        'evolver_threads': 0,
         'mar_regulon': False,
         'amp_lysis': False,
         'process_configs': {},
@@ -65,13 +68,8 @@ class Ecoli(Composer):
 
     def __init__(self, config):
         super().__init__(config)
-        self.load_sim_data = LoadSimData(
-            sim_data_path=self.config['sim_data_path'],
-            seed=self.config['seed'],
-            mar_regulon=self.config['mar_regulon'],
-            rnai_data=self.config['process_configs'].get(
-                'ecoli-rna-interference'),
-            amp_lysis=self.config['amp_lysis'])
+        rnai_data = self.config['process_configs'].get(
+            'ecoli-rna-interference')
 
         if not self.config.get('processes'):
             self.config['processes'] = deepcopy(ECOLI_DEFAULT_PROCESSES)
@@ -81,6 +79,23 @@ class Ecoli(Composer):
         if not self.config.get('topology'):
             self.config['topology'] = deepcopy(ECOLI_DEFAULT_TOPOLOGY)
 
+        # Use prebuilt process configs if available (see
+        # ecoli/library/config_bundle.py)
+        self.load_sim_data = load_config_bundle(
+            sim_data_path=self.config['sim_data_path'],
+            seed=self.config['seed'],
+            process_names=self.config['process_configs'],
+            mar_regulon=self.config['mar_regulon'],
+            rnai_data=rnai_data,
+            amp_lysis=self.config['amp_lysis'])
+        if self.load_sim_data is None:
+            self.load_sim_data = LoadSimData(
+                sim_data_path=self.config['sim_data_path'],
+                seed=self.config['seed'],
+                mar_regulon=self.config['mar_regulon'],
+                rnai_data=rnai_data,
+                amp_lysis=self.config['amp_lysis'])
+
         self.processes = self.config['processes']
         self.topology = self.config['topology']
         self.processes_and_steps = self._generate_processes_and_steps(self.config)
@@ -132,8 +147,9 @@ class Ecoli(Composer):
         and Evolver for each PartitionedProcess as well as Allocator, adds
         division process if configured, ensures that Requesters run after
         all listeners and allocator after all Requesters, adds UniqueUpdate
-        Steps to ensure that unique molecule states are updated before and
-        after running each Step"""
+        Steps to ensure that unique molecule states are updated before any
+        Step runs and after each Step whose unique molecule updates are
+        read by a downstream Step"""
         time_step = config['time_step']
         # get the configs from sim_data (except for allocator, built later)
         process_configs = config['process_configs']
@@ -157,6 +173,17 @@ class Ecoli(Composer):
                         process_configs[process]['seed'] +
                         config['seed']) % RAND_MAX
 
+        # Optionally compute Evolver updates on a thread pool
+        evolver_executor = None
+        evolver_locks = {}
+        if config['evolver_threads']:
+            evolver_executor = get_evolver_executor(config['evolver_threads'])
+            evolver_locks = get_evolver_locks({
+                process_name: config['topology'].get(process_name, {})
+                for process_name, process_class in config['processes'].items()
+                if issubclass(process_class, PartitionedProcess)
+            })
+
         # make the processes
         processes = {}
         steps = {}
@@ -169,7 +196,9 @@ class Ecoli(Composer):
                     processes[f'{process_name}_evolver'] = \
                         make_logging_process(Evolver)({
                             'time_step': time_step,
-                            'process': process
+                            'process': process,
+                            'executor': evolver_executor,
+                            'locks': evolver_locks.get(process_name, [])
                         })
                     steps[f'{process_name}_requester'] = \
                         make_logging_process(Requester)({
@@ -177,9 +206,13 @@ class Ecoli(Composer):
                             'process': process
                         })
                 else:
+                    # Apply bulk updates from all Evolvers at once
                     processes[f'{process_name}_evolver'] = Evolver({
                         'time_step': time_step,
-                        'process': process
+                        'process': process,
+                        'queue_bulk': True,
+                        'executor': evolver_executor,
+                        'locks': evolver_locks.get(process_name, [])
                     })
                     steps[f'{process_name}_requester'] = Requester({
                         'time_step': time_step,
@@ -220,7 +253,7 @@ class Ecoli(Composer):
                 'composer': Ecoli,
                 'composer_config': self.config,
                 'dry_mass_inc_dict': \
-                    self.load_sim_data.sim_data.expectedDryMassIncreaseDict,
+                    self.load_sim_data.get_dry_mass_inc_dict(),
                 'seed': config['seed'],
             }
             steps['division'] = Division(division_config)
@@ -258,14 +291,20 @@ class Ecoli(Composer):
         unique_dict.pop('listeners')
         unique_dict.pop('evolvers_ran')
         unique_dict.pop('first_update')
-        flow_keys = list(flow.keys())
-        params = {'unique_dict': unique_dict}
-        steps['unique-update'] = UniqueUpdate(params)
+        # Update unique molecules (and bulk molecules queued by Evolvers)
+        # before any Steps run
+        steps['unique-update'] = UniqueUpdate({
+            'unique_dict': {**unique_dict, 'bulk': ('bulk',)}})
         flow['unique-update'] = []
-        # Update unique molecules after each Step runs
-        for i in range(len(flow_keys)):
-            flow[f'unique-update-{i+1}'] = [(flow_keys[i],)]
-            steps[f'unique-update-{i+1}'] = UniqueUpdate(params)
+        # Only update unique molecules after a Step runs if another Step
+        # that depends on it reads the unique molecules it may have changed.
+        # Steps without a topology are assumed to access all unique stores.
+        step_topologies = self.generate_step_topology(config)
+        # Requesters only update their request, process and listener ports
+        writers = [name for name, step in steps.items()
+            if name != 'unique-update' and not isinstance(step, Requester)]
+        steps.update(get_unique_update_flow(
+            step_topologies, flow, unique_dict, writers))
         # Free memory by removing reference to sim_data object
         del self.load_sim_data
         return processes, steps, flow
@@ -286,7 +325,9 @@ class Ecoli(Composer):
         return flow
 
 
-    def generate_topology(self, config):
+    def generate_step_topology(self, config):
+        """Generate the topologies of all processes and Steps, except for
+        the UniqueUpdate Steps and the clock process"""
         topology = {}
         # make the topology
         for process_id, ports in config['topology'].items():
@@ -338,14 +379,17 @@ class Ecoli(Composer):
             'bulk': ('bulk',),
             'evolvers_ran': ('evolvers_ran',),
         }
+        return topology
 
+
+    def generate_topology(self, config):
+        topology = self.generate_step_topology(config)
         _, steps, _ = self.processes_and_steps
         # UniqueUpdate signals for collected unique molecule updates
-        # to be applied before and after all Steps run
-        for step_name in steps.keys():
+        # to be applied for the unique molecule stores it is wired to
+        for step_name, step in steps.items():
             if 'unique-update' in step_name:
-                topology[step_name] = steps['unique-update'
-                    ].unique_dict.copy()
+                topology[step_name] = step.unique_dict.copy()
         # Do not keep an unnecessary reference to these
         self.processes_and_steps = None
 
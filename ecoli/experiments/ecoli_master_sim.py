@@ -31,6 +31,11 @@ from ecoli.processes.registries import topology_registry
 
 from ecoli.composites.ecoli_configs import CONFIG_DIR_PATH
 from ecoli.library.schema import not_a_process
+from ecoli.library.bulk_encoding import encode_bulk_deltas
+from ecoli.library.emit_schedule import use_emit_schedule
+from ecoli.library.step_plan import use_step_plan
+from ecoli.states.checkpoint import CHECKPOINT_SUFFIX, CheckpointWriter
+from ecoli.states.wcecoli_state import add_dtypes
 
 
 def _tuplify_topology(topology):
@@ -123,10 +128,11 @@ class SimConfig:
         self.parser.add_argument(
             '--emitter', '-e', action='store',
             choices=["timeseries", "database", "print", "null",
-                "shared_ram"],
+                "shared_ram", "table"],
             help=(
                 "Emitter to use. Timeseries uses RAMEmitter, database "
-                "emits to MongoDB, and print emits to stdout."))
+                "emits to MongoDB, print emits to stdout, and table "
+                "writes local column files (out_dir emitter argument)."))
         self.parser.add_argument(
             '--emitter_arg', '-ea', action='store', nargs='*',
             type=key_value_pair,
@@ -166,6 +172,26 @@ class SimConfig:
         self.parser.add_argument(
             '--parallel', action='store_true', default=False,
             help='Run processes in parallel.')
+        self.parser.add_argument(
+            '--evolver_threads', action='store', type=int,
+            help=(
+                'Number of threads to compute Evolver updates on '
+                '(partitioned model only). Evolvers run serially if 0.'))
+        self.parser.add_argument(
+            '--save_format', action='store',
+            choices=['json', 'checkpoint', 'delta'],
+            help=(
+                'Format of saved states: JSON files, binary checkpoint '
+                'directories or checkpoints that only store changes since '
+                'the previous save (see ecoli/states/checkpoint.py). States '
+                'are saved in the background, but serializing JSON holds '
+                'the GIL and slows the simulation down while it runs, so '
+                'prefer checkpoints for large colonies.'))
+        self.parser.add_argument(
+            '--load_workers', action='store', type=int,
+            help=(
+                'Number of processes to decode agents of initial colony '
+                'JSON files with (default: number of CPUs).'))
         self.parser.add_argument(
             '--profile', action='store_true', default=False,
             help='Print profiling information at the end.')
@@ -445,7 +471,7 @@ class EcoliSim:
     def save_states(self):
         """
         Runs the simulation while saving the states of specific
-        timesteps to jsons.
+        timesteps to jsons (or checkpoints) in the background.
         """
         for time in self.save_times:
             if time > self.total_time:
@@ -453,6 +479,7 @@ class EcoliSim:
                     f'Config contains save_time ({time}) > total '
                     f'time ({self.total_time})')
 
+        writer = CheckpointWriter(delta=self.save_format == 'delta')
         for i in range(len(self.save_times)):
             if i == 0:
                 time_to_next_save = self.save_times[i]
@@ -462,6 +489,7 @@ class EcoliSim:
             time_elapsed = self.save_times[i]
             state = self.ecoli_experiment.state.get_value(
                 condition=not_a_process)
+            checkpoint = self.save_format in ('checkpoint', 'delta')
             if self.divide:
                 for agent_state in state['agents'].values():
                     # Will be set to true when starting sim
@@ -471,25 +499,28 @@ class EcoliSim:
                     del agent_state['environment']
                     # Processes can't be serialized
                     del agent_state['process']
-                    # Save bulk and unique dtypes
-                    agent_state['bulk_dtypes'] = str(agent_state['bulk'].dtype)
-                    agent_state['unique_dtypes'] = {}
-                    for name, mols in agent_state['unique'].items():
-                        agent_state['unique_dtypes'][name] = str(mols.dtype)
+                    # Save bulk and unique dtypes (checkpoints keep them)
+                    if not checkpoint:
+                        add_dtypes(agent_state)
             else:
                 del state['evolvers_ran']
                 del state['deriver_skips']
                 del state['environment']
                 del state['process']
-                state['bulk_dtypes'] = str(state['bulk'].dtype)
-                state['unique_dtypes'] = {}
-                for name, mols in state['unique'].items():
-                    state['unique_dtypes'][name] = str(mols.dtype)
-            write_json('data/vivecoli_t' + str(time_elapsed) + '.json', state)
-            print('Finished saving the state at t = ' + str(time_elapsed))
+                if not checkpoint:
+                    add_dtypes(state)
+            # Keep simulating while the state is written
+            message = 'Finished saving the state at t = ' + str(time_elapsed)
+            if checkpoint:
+                writer.save_checkpoint('data/vivecoli_t' + str(time_elapsed)
+                    + CHECKPOINT_SUFFIX, state, message)
+            else:
+                writer.save(write_json, 'data/vivecoli_t'
+                    + str(time_elapsed) + '.json', state, message)
         time_remaining = self.total_time - self.save_times[-1]
         if time_remaining:
             self.ecoli_experiment.update(time_remaining)
+        writer.close()
 
 
     def run(self):
@@ -511,7 +542,7 @@ class EcoliSim:
             'emit_topology': self.emit_topology,
             'emit_processes': self.emit_processes,
             'emit_config': self.emit_config,
-            'emitter': self.emitter,
+            'emitter': emitter_config,
         }
         if self.experiment_id:
             # Store backup of base experiment ID,
@@ -530,6 +561,14 @@ class EcoliSim:
         warnings.filterwarnings("ignore",
             message="Incompatible schema assignment at ")
         self.ecoli_experiment = Engine(**experiment_config)
+        # Flow is fixed so only sort Steps again if they change
+        use_step_plan(self.ecoli_experiment)
+        # Emit bulk counts as deltas and paths at their own intervals
+        # if specified
+        encode_bulk_deltas(self.ecoli_experiment.emitter,
+            self.config.get('bulk_keyframe_interval'))
+        use_emit_schedule(self.ecoli_experiment,
+            self.config.get('emit_intervals'))
 
         # Only emit designated stores if specified
         if self.config['emit_paths']:
@@ -0,0 +1,207 @@
+"""
+===================
+Bulk Delta Encoding
+===================
+
+Emitting the bulk molecule counts (see
+:py:class:`ecoli.library.schema.get_bulk_counts`) writes every count at
+every emit, but only a small fraction of counts change in a time step. With
+delta encoding, the full counts of each cell (a keyframe) are only emitted
+every ``bulk_keyframe_interval`` emits. In between, ``bulk`` is emitted as
+the indexes and changes of the counts that changed since the previous
+emit::
+
+    {'delta_indexes': [12, 3071], 'delta_values': [-1, 2]}
+
+Enable it with the ``bulk_keyframe_interval`` configuration option. Use
+:py:func:`encode_bulk_deltas` to enable it for an emitter, which also makes
+the emitter's ``get_data`` return dense counts again. Data read from a
+database (see :py:func:`ecoli.analysis.db.access`) is decoded with
+:py:func:`decode_bulk_deltas`. Decoding needs all emits since the last
+keyframe.
+"""
+
+import numpy as np
+
+
+BULK_KEY = 'bulk'
+DELTA_INDEXES = 'delta_indexes'
+DELTA_VALUES = 'delta_values'
+
+
+def is_bulk_delta(value):
+    return isinstance(value, dict) and DELTA_INDEXES in value
+
+
+class BulkDeltaEncoder:
+    """Replaces bulk counts in emitted data with the changes since the
+    previous emit of each cell, except for every ``keyframe_interval``-th
+    emit.
+
+    Args:
+        keyframe_interval: Number of emits from one keyframe to the next
+    """
+
+    def __init__(self, keyframe_interval):
+        self.keyframe_interval = keyframe_interval
+        # Counts and number of emits since the last keyframe, keyed by the
+        # path of each cell
+        self.previous = {}
+
+    def _encode(self, cell_path, counts):
+        counts = np.asarray(counts)
+        previous, n_emits = self.previous.get(cell_path, (None, 0))
+        if (previous is None or n_emits + 1 >= self.keyframe_interval
+            or previous.shape != counts.shape
+        ):
+            self.previous[cell_path] = (counts.copy(), 0)
+            return counts
+        changed = np.flatnonzero(counts != previous)
+        self.previous[cell_path] = (counts.copy(), n_emits + 1)
+        return {
+            DELTA_INDEXES: changed,
+            DELTA_VALUES: counts[changed] - previous[changed],
+        }
+
+    def encode(self, data):
+        """Get emitted data (optionally with cells under ``'agents'``)
+        with encoded bulk counts."""
+        data = dict(data)
+        if BULK_KEY in data:
+            data[BULK_KEY] = self._encode((), data[BULK_KEY])
+        agents = data.get('agents')
+        if isinstance(agents, dict):
+            data['agents'] = {
+                agent_id: dict(agent_data, **{BULK_KEY: self._encode(
+                    ('agents', agent_id), agent_data[BULK_KEY])})
+                if isinstance(agent_data, dict) and BULK_KEY in agent_data
+                else agent_data
+                for agent_id, agent_data in agents.items()}
+        return data
+
+
+def decode_bulk_timeseries(values):
+    """Rebuild dense bulk counts from a timeseries of encoded counts.
+
+    Args:
+        values: List of dense counts (keyframes) and deltas, in time order
+
+    Returns:
+        2D array of counts (time x molecule)
+    """
+    keyframes = [i for i, value in enumerate(values)
+        if not is_bulk_delta(value)]
+    if not keyframes or keyframes[0] != 0:
+        raise ValueError('Bulk count deltas must follow a keyframe. Read '
+            'all emits since the last keyframe (e.g. no sampling_rate).')
+    first = np.asarray(values[0])
+    counts = np.zeros((len(values), first.size), dtype=first.dtype)
+    for start, end in zip(keyframes, keyframes[1:] + [len(values)]):
+        # Changes since the keyframe are the cumulative sum of deltas
+        block = counts[start:end]
+        block[0] = values[start]
+        for i in range(1, end - start):
+            delta = values[start + i]
+            block[i, np.asarray(delta[DELTA_INDEXES], dtype=np.int64)] = \
+                delta[DELTA_VALUES]
+        np.cumsum(block, axis=0, out=block)
+    return counts
+
+
+def decode_bulk_deltas(data):
+    """Replace bulk count deltas in :term:`raw data` with dense counts.
+
+    Args:
+        data: Dictionary from time to emitted data
+
+    Returns:
+        Dictionary from time to emitted data with dense bulk counts (emits
+        of cells with deltas are copied, the rest are shared with ``data``)
+    """
+    # Times and encoded bulk counts of each cell in time order
+    cells = {}
+    for time in sorted(data):
+        data_at_time = data[time]
+        if not isinstance(data_at_time, dict):
+            continue
+        if BULK_KEY in data_at_time:
+            cells.setdefault((), []).append(
+                (time, data_at_time[BULK_KEY]))
+        for agent_id, agent_data in data_at_time.get('agents', {}).items():
+            if isinstance(agent_data, dict) and BULK_KEY in agent_data:
+                cells.setdefault(('agents', agent_id), []).append(
+                    (time, agent_data[BULK_KEY]))
+    decoded = dict(data)
+    for cell_path, cell_data in cells.items():
+        values = [value for _, value in cell_data]
+        if not any(is_bulk_delta(value) for value in values):
+            continue
+        counts = decode_bulk_timeseries(values)
+        for (time, _), row in zip(cell_data, counts):
+            data_at_time = decoded[time] = dict(decoded[time])
+            if cell_path:
+                agents = data_at_time['agents'] = dict(data_at_time['agents'])
+                agents[cell_path[1]] = dict(agents[cell_path[1]])
+                agents[cell_path[1]][BULK_KEY] = row
+            else:
+                data_at_time[BULK_KEY] = row
+    return decoded
+
+
+def encode_bulk_deltas(emitter, keyframe_interval):
+    """Make an emitter emit bulk counts as deltas between keyframes.
+
+    Args:
+        emitter: :py:class:`vivarium.core.emitter.Emitter` to modify in
+            place
+        keyframe_interval: Number of emits from one keyframe to the next
+            (delta encoding is disabled if this is falsy or 1)
+    """
+    if not keyframe_interval or keyframe_interval <= 1:
+        return emitter
+    encoder = BulkDeltaEncoder(keyframe_interval)
+    emit = emitter.emit
+    get_data = emitter.get_data
+
+    def encoded_emit(data):
+        if data['table'] == 'history':
+            data = dict(data, data=encoder.encode(data['data']))
+        emit(data)
+
+    def decoded_get_data(query=None):
+        return decode_bulk_deltas(get_data(query))
+
+    emitter.emit = encoded_emit
+    emitter.get_data = decoded_get_data
+    return emitter
+
+
+def test_bulk_encoding():
+    random_state = np.random.RandomState(0)
+    counts = random_state.randint(0, 100, size=(9, 20))
+    # Only a few counts change at a time
+    counts[1:, 5:] = counts[0, 5:]
+    encoder = BulkDeltaEncoder(keyframe_interval=4)
+    data = {}
+    for time, row in enumerate(counts):
+        data[float(time)] = encoder.encode({
+            'time': float(time),
+            'bulk': row,
+            'agents': {'0': {'bulk': row * 2}, '1': {'listeners': {}}},
+        })
+    assert [not is_bulk_delta(value['bulk']) for value in data.values()] == [
+        True, False, False, False, True, False, False, False, True]
+    assert len(data[1.0]['bulk'][DELTA_INDEXES]) <= 5
+    decoded = decode_bulk_deltas(data)
+    np.testing.assert_array_equal(
+        np.array([value['bulk'] for value in decoded.values()]), counts)
+    np.testing.assert_array_equal(np.array([
+        value['agents']['0']['bulk'] for value in decoded.values()]),
+        counts * 2)
+    try:
+        decode_bulk_timeseries([data[0.0]['bulk'], {
+            DELTA_INDEXES: [], DELTA_VALUES: []}][::-1])
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('Deltas without a keyframe were decoded.')
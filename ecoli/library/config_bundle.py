@@ -0,0 +1,277 @@
+"""
+======================
+Process Config Bundles
+======================
+
+Building process configs with :py:class:`ecoli.library.sim_data.LoadSimData`
+(including the ``mar_regulon``, ``amp_lysis`` and RNAi changes to sim_data)
+takes much longer than running a short simulation. A config bundle stores the
+configs of a list of processes for one sim_data file and set of sim_data
+options. Bundles do not depend on the simulation seed: the seed of each
+config is recomputed when the bundle is loaded exactly like
+:py:class:`ecoli.library.sim_data.LoadSimData` would compute it.
+
+Bundles are stored next to the sim_data cache
+(``<sim_data_path>.cache/<sha256>-configs-<options hash>``) in the same
+format (see :py:mod:`ecoli.library.sim_data_cache`). The options hash also
+covers :py:data:`BUNDLE_VERSION` and the source code of
+:py:mod:`ecoli.library.sim_data` and this module, so bundles are rebuilt
+when the code that builds configs changes. Bump :py:data:`BUNDLE_VERSION`
+for changes elsewhere (e.g. in ``reconstruction``) that change configs. Build one for a
+simulation configuration with::
+
+    python ecoli/library/config_bundle.py --config path/to/config.json
+
+:py:class:`ecoli.composites.ecoli_master.Ecoli` loads a matching bundle
+instead of sim_data if one exists.
+"""
+
+import argparse
+import functools
+import hashlib
+import json
+import os
+
+import numpy as np
+
+import ecoli.library.sim_data as sim_data_module
+from ecoli.library.sim_data import LoadSimData, RAND_MAX, seed_from_name
+from ecoli.library.sim_data_cache import (get_sim_data_hash,
+    write_buffer_cache, read_buffer_cache, load_buffer_cache)
+
+
+# Version of the bundle contents (bump to invalidate existing bundles)
+BUNDLE_VERSION = 1
+# Bundle files, keyed by path prefix (sim_data path and hash, options hash)
+_BUNDLE_CACHE = {}
+
+
+@functools.lru_cache(maxsize=None)
+def get_source_hash():
+    """Hash the source code of the modules that build process configs."""
+    sha = hashlib.sha256()
+    for path in sorted({os.path.abspath(sim_data_module.__file__),
+        os.path.abspath(__file__)}
+    ):
+        with open(path, 'rb') as f:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+
+def get_options_hash(mar_regulon=False, rnai_data=None, amp_lysis=False):
+    """Hash the LoadSimData options that change process configs (and the
+    bundle version and source code that build them)."""
+    options = {
+        'mar_regulon': mar_regulon,
+        'rnai_data': rnai_data,
+        'amp_lysis': amp_lysis,
+        'version': BUNDLE_VERSION,
+        'source': get_source_hash(),
+    }
+    return hashlib.sha256(json.dumps(
+        options, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+def get_bundle_prefix(sim_data_path, mar_regulon=False, rnai_data=None,
+    amp_lysis=False
+):
+    path = os.path.abspath(sim_data_path)
+    options_hash = get_options_hash(mar_regulon, rnai_data, amp_lysis)
+    return os.path.join(f'{path}.cache',
+        f'{get_sim_data_hash(path)}-configs-{options_hash}')
+
+
+class ConfigBundle:
+    """Process configs loaded from a bundle. Provides the methods of
+    :py:class:`ecoli.library.sim_data.LoadSimData` used by composers.
+
+    Args:
+        bundle: Dictionary written by :py:func:`build_config_bundle`
+        seed: Simulation seed
+    """
+
+    def __init__(self, bundle, seed=0):
+        self.configs = bundle['configs']
+        self.seed_sources = bundle['seed_sources']
+        self.unknown = bundle['unknown']
+        self.allocator_config = bundle['allocator']
+        self.dry_mass_inc_dict = bundle['dry_mass_inc_dict']
+        self.seed = seed
+        self.random_state = np.random.RandomState(seed=seed)
+
+    def _get_seed(self, source):
+        if source is None:
+            return self.random_state.randint(RAND_MAX)
+        return seed_from_name(source, self.seed)
+
+    def get_config_by_name(self, name, time_step=2, parallel=False):
+        if name not in self.configs:
+            raise KeyError(
+                f"Process of name {name} is not known to LoadSimData.get_config_by_name")
+        config = dict(self.configs[name])
+        config['time_step'] = time_step
+        config['_parallel'] = parallel
+        if name in self.seed_sources:
+            config['seed'] = self._get_seed(self.seed_sources[name])
+        return config
+
+    def get_allocator_config(self, time_step=2, parallel=False,
+        process_names=None
+    ):
+        config = dict(self.allocator_config)
+        config['time_step'] = time_step
+        config['_parallel'] = parallel
+        config['seed'] = self._get_seed(self.seed_sources['allocator'])
+        config['process_names'] = process_names or []
+        return config
+
+    def get_dry_mass_inc_dict(self):
+        return self.dry_mass_inc_dict
+
+    def covers(self, process_names):
+        """Check whether this bundle can stand in for LoadSimData for all
+        processes in a list."""
+        return all(name in self.configs or name in self.unknown
+            for name in process_names)
+
+
+def build_config_bundle(sim_data_path, process_names, mar_regulon=False,
+    rnai_data=None, amp_lysis=False
+):
+    """Build the configs of a list of processes and save them as a bundle.
+
+    Args:
+        sim_data_path: Path to pickled sim_data
+        process_names: Names of processes to include (the allocator config
+            is always included)
+        mar_regulon, rnai_data, amp_lysis: LoadSimData options
+
+    Returns:
+        Path prefix of the bundle files
+    """
+    load_sim_data = LoadSimData(
+        sim_data_path=sim_data_path,
+        mar_regulon=mar_regulon,
+        rnai_data=rnai_data,
+        amp_lysis=amp_lysis)
+    bundle = {
+        'configs': {},
+        'seed_sources': {},
+        'unknown': [],
+        'allocator': load_sim_data.get_allocator_config(),
+        'dry_mass_inc_dict': load_sim_data.get_dry_mass_inc_dict(),
+    }
+    bundle['seed_sources']['allocator'] = load_sim_data.seed_source
+    for name in process_names:
+        try:
+            config = load_sim_data.get_config_by_name(name)
+        except KeyError:
+            bundle['unknown'].append(name)
+            continue
+        bundle['configs'][name] = config
+        if 'seed' in config:
+            bundle['seed_sources'][name] = load_sim_data.seed_source
+
+    bundle_prefix = get_bundle_prefix(
+        sim_data_path, mar_regulon, rnai_data, amp_lysis)
+    write_buffer_cache(bundle, bundle_prefix)
+    _BUNDLE_CACHE.pop(bundle_prefix, None)
+    return bundle_prefix
+
+
+def load_config_bundle(sim_data_path, seed=0, process_names=(),
+    mar_regulon=False, rnai_data=None, amp_lysis=False
+):
+    """Load the bundle matching a sim_data file and set of options.
+
+    Args:
+        sim_data_path: Path to pickled sim_data
+        seed: Simulation seed
+        process_names: Names of processes that must be in the bundle
+        mar_regulon, rnai_data, amp_lysis: LoadSimData options
+
+    Returns:
+        New :py:class:`ConfigBundle` or None if there is no bundle that
+        covers all processes
+    """
+    try:
+        bundle_prefix = get_bundle_prefix(
+            sim_data_path, mar_regulon, rnai_data, amp_lysis)
+        if bundle_prefix not in _BUNDLE_CACHE:
+            if not os.path.exists(f'{bundle_prefix}.json'):
+                return None
+            _BUNDLE_CACHE[bundle_prefix] = read_buffer_cache(bundle_prefix)
+    except OSError:
+        return None
+    bundle = ConfigBundle(
+        load_buffer_cache(*_BUNDLE_CACHE[bundle_prefix]), seed)
+    if not bundle.covers(process_names):
+        return None
+    return bundle
+
+
+def test_config_bundle():
+    bundle = ConfigBundle({
+        'configs': {
+            'named': {'time_step': 2, 'seed': 0, 'ids': np.arange(3)},
+            'random': {'time_step': 2, 'seed': 0},
+            'no-seed': {'time_step': 2},
+        },
+        'seed_sources': {
+            'named': 'Named', 'random': None, 'allocator': 'BulkMolecules'},
+        'unknown': ['custom'],
+        'allocator': {'time_step': 2, 'seed': 0, 'process_names': []},
+        'dry_mass_inc_dict': {},
+    }, seed=5)
+    random_state = np.random.RandomState(seed=5)
+    assert bundle.get_config_by_name('named')['seed'] == seed_from_name(
+        'Named', 5)
+    assert bundle.get_config_by_name('random')['seed'] == \
+        random_state.randint(RAND_MAX)
+    assert 'seed' not in bundle.get_config_by_name('no-seed', time_step=1)
+    allocator_config = bundle.get_allocator_config(process_names=['named'])
+    assert allocator_config['process_names'] == ['named']
+    assert allocator_config['seed'] == seed_from_name('BulkMolecules', 5)
+    assert bundle.covers(['named', 'custom'])
+    assert not bundle.covers(['other'])
+
+    # Bundles built by other versions of the code are not loaded
+    global BUNDLE_VERSION
+    options_hash = get_options_hash(mar_regulon=True)
+    assert get_options_hash(mar_regulon=False) != options_hash
+    BUNDLE_VERSION += 1
+    try:
+        assert get_options_hash(mar_regulon=True) != options_hash
+    finally:
+        BUNDLE_VERSION -= 1
+    assert get_options_hash(mar_regulon=True) == options_hash
+
+
+def main():
+    from ecoli.composites.ecoli_configs import CONFIG_DIR_PATH
+    from ecoli.experiments.ecoli_master_sim import EcoliSim
+
+    parser = argparse.ArgumentParser(
+        description='Build the process config bundle for a simulation '
+            'configuration.')
+    parser.add_argument(
+        '--config', '-c',
+        default=os.path.join(CONFIG_DIR_PATH, 'default.json'),
+        help='Path to simulation configuration file.')
+    args = parser.parse_args()
+    sim = EcoliSim.from_file(args.config)
+    processes = sim._retrieve_processes(sim.processes, sim.add_processes,
+        sim.exclude_processes, sim.swap_processes)
+    process_configs = sim._retrieve_process_configs(
+        sim.process_configs, processes)
+    bundle_prefix = build_config_bundle(
+        sim.sim_data_path,
+        list(processes),
+        mar_regulon=sim.config.get('mar_regulon', False),
+        rnai_data=process_configs.get('ecoli-rna-interference'),
+        amp_lysis=sim.config.get('amp_lysis', False))
+    print(f'Wrote config bundle to {bundle_prefix}.*')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+==============
+Emit Schedules
+==============
+
+By default, every emitted store is emitted at every time step. An emit
+schedule gives paths in each cell their own emit interval in seconds, e.g.
+to emit bulk counts every minute but mass listeners every other second::
+
+    "emit_intervals": {
+        "listeners/mass": 2,
+        "listeners/ribosome_data": 10,
+        "bulk": 60
+    }
+
+Paths are relative to each cell (also in colonies) and the most specific
+path applies, so ``{"listeners": 10, "listeners/mass": 2}`` emits the mass
+listener every 2 seconds and all other listeners every 10 seconds. Paths
+without an interval are emitted at every time step.
+
+Use :py:func:`use_emit_schedule` to install a schedule in an Engine and
+:py:func:`schedule_emitter` for emitters that are called directly (e.g. by
+:py:class:`ecoli.processes.engine_process.EngineProcess`).
+"""
+
+import numpy as np
+
+
+# Fraction of an interval by which an emit can be early (e.g. due to
+# rounding of time steps) and still count
+INTERVAL_TOLERANCE = 1e-6
+# Returned by EmitSchedule._prune for values that are not emitted
+_SKIP = object()
+
+
+def _parse_path(path):
+    if isinstance(path, str):
+        return tuple(key for key in path.split('/') if key)
+    return tuple(path)
+
+
+class EmitSchedule:
+    """Removes paths from emitted data until their interval has passed.
+
+    Args:
+        intervals: Dictionary from path in each cell (``'/'``-separated
+            string or tuple) to emit interval in seconds
+        start_time: Time at which all paths were last emitted (None to
+            emit all paths the first time each cell is emitted)
+    """
+
+    def __init__(self, intervals, start_time=None):
+        self.intervals = {
+            _parse_path(path): interval
+            for path, interval in intervals.items()}
+        self.prefixes = {path[:i] for path in self.intervals
+            for i in range(len(path))}
+        self.start_time = start_time
+        # Time of last emit, keyed by (cell path, path)
+        self.last_emit = {}
+
+    def _get_due(self, cell_path, time):
+        due = {}
+        for path, interval in self.intervals.items():
+            last_emit = self.last_emit.get((cell_path, path), self.start_time)
+            due[path] = last_emit is None or (
+                time >= last_emit + interval * (1 - INTERVAL_TOLERANCE))
+            if due[path]:
+                self.last_emit[(cell_path, path)] = time
+        return due
+
+    def _prune(self, value, path, due, parent_due):
+        path_due = due.get(path, parent_due)
+        if path not in self.prefixes or not isinstance(value, dict):
+            return value if path_due else _SKIP
+        pruned = {}
+        for key, subvalue in value.items():
+            subvalue = self._prune(subvalue, path + (key,), due, path_due)
+            if subvalue is not _SKIP:
+                pruned[key] = subvalue
+        if not pruned and not path_due:
+            return _SKIP
+        return pruned
+
+    def filter(self, data):
+        """Get the emitted data (with ``'time'`` key, optionally with
+        cells under ``'agents'``) that is due for emit."""
+        time = data.get('time')
+        if time is None or not self.intervals:
+            return data
+        filtered = self._prune(data, (), self._get_due((), time), True)
+        if filtered is _SKIP:
+            filtered = {}
+        agents = data.get('agents')
+        if isinstance(agents, dict):
+            filtered['agents'] = {}
+            for agent_id, agent_data in agents.items():
+                cell_path = ('agents', agent_id)
+                agent_data = self._prune(agent_data, (),
+                    self._get_due(cell_path, time), True)
+                if agent_data is not _SKIP:
+                    filtered['agents'][agent_id] = agent_data
+        filtered['time'] = time
+        return filtered
+
+
+def schedule_emitter(emitter, intervals, start_time=None):
+    """Make an emitter skip paths until their emit interval has passed.
+
+    Args:
+        emitter: :py:class:`vivarium.core.emitter.Emitter` to modify in
+            place
+        intervals: Dictionary from path in each cell to emit interval in
+            seconds (see :py:class:`EmitSchedule`)
+        start_time: Time at which all paths were last emitted
+    """
+    if not intervals:
+        return emitter
+    schedule = EmitSchedule(intervals, start_time)
+    emit = emitter.emit
+
+    def scheduled_emit(data):
+        if data['table'] == 'history':
+            data = dict(data, data=schedule.filter(data['data']))
+        emit(data)
+
+    emitter.emit = scheduled_emit
+    return emitter
+
+
+def use_emit_schedule(engine, intervals):
+    """Make an Engine emit paths at their own intervals. The Engine emits
+    all paths when it is created, so intervals start at its current time.
+
+    Args:
+        engine: :py:class:`vivarium.core.engine.Engine` to modify in place
+        intervals: Dictionary from path in each cell to emit interval in
+            seconds (see :py:class:`EmitSchedule`)
+    """
+    schedule_emitter(engine.emitter, intervals, engine.global_time)
+
+
+def test_emit_schedule():
+    schedule = EmitSchedule({
+        'listeners': 4,
+        'listeners/mass': 2,
+        ('bulk',): 6,
+    })
+    emitted = {}
+    for time in np.arange(0, 13, 1.0):
+        data = schedule.filter({
+            'time': time,
+            'bulk': np.zeros(2),
+            'listeners': {'mass': {'dry_mass': time}, 'rnap_data': {}},
+            'agents': {'0': {'listeners': {'mass': {'dry_mass': time}}}},
+        })
+        emitted[time] = data
+    assert [time for time, data in emitted.items() if 'bulk' in data] == [
+        0, 6, 12]
+    assert [time for time, data in emitted.items()
+        if 'mass' in data.get('listeners', {})] == list(range(0, 13, 2))
+    assert [time for time, data in emitted.items()
+        if 'rnap_data' in data.get('listeners', {})] == [0, 4, 8, 12]
+    assert [time for time, data in emitted.items()
+        if data['agents']['0']] == list(range(0, 13, 2))
+    assert all('time' in data for data in emitted.values())
+
+    # Engines emit everything when they are created
+    schedule = EmitSchedule({'bulk': 6}, start_time=0)
+    assert 'bulk' not in schedule.filter({'time': 2, 'bulk': 1})
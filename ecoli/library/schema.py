@@ -1,4 +1,6 @@
+import copy
 from typing import List
+import weakref
 
 import numpy as np
 from vivarium.core.store import Store
@@ -95,13 +97,78 @@ def not_a_process(value):
 
 def counts(states, idx):
     # Helper function to pull out counts at given indices
+    if isinstance(states, BulkOverlay):
+        return states.counts(idx)
+    if isinstance(states, tuple):
+        # evolve_state reads from ('allocate', process_name, 'bulk')
+        # which only has counts for the requested molecules
+        return allocated_counts(states, idx)
     if len(states.dtype) > 1:
         return states['count'][idx]
-    # evolve_state reads from ('allocate', process_name, 'bulk')
-    # which is a simple Numpy array (not structured)
     return states[idx]
 
 
+def allocated_counts(allocation, idx):
+    """Get counts at given bulk indices from a sparse allocation.
+
+    Args:
+        allocation: Tuple of sorted bulk indices and the counts allocated
+            for each of them
+        idx: Bulk index or array of bulk indices
+
+    Returns:
+        Allocated counts for each index (zero if not requested)
+    """
+    allocated_idx, allocated = allocation
+    if len(allocated_idx) == 0:
+        return np.zeros(np.shape(idx), dtype=int)[()]
+    positions = np.searchsorted(allocated_idx, idx).clip(
+        max=len(allocated_idx) - 1)
+    return np.where(allocated_idx[positions] == idx,
+        allocated[positions], 0)[()]
+
+
+class BulkOverlay:
+    """Read-only view of the bulk store with the counts at some indices
+    replaced (e.g. by a process's requests when running without partitioning).
+    Reads at all other indices go through to the underlying bulk array, so
+    the full structured array is never copied.
+
+    Args:
+        bulk: Structured bulk array (fields 'id' and 'count')
+        overlays: List of tuples, where the first value in each tuple is an
+            index, array of indices, or boolean mask and the second value is
+            the count(s) to read at those indices. Later tuples take
+            precedence for repeated indices.
+    """
+
+    def __init__(self, bulk, overlays):
+        self.bulk = bulk
+        all_idx, all_values = flatten_bulk_updates(overlays)
+        # Keep the last value given for each index
+        reverse_idx, first_in_reverse = np.unique(
+            all_idx[::-1], return_index=True)
+        self.overlay_idx = reverse_idx
+        self.overlay_counts = all_values[::-1][first_in_reverse]
+
+    def counts(self, idx):
+        base = self.bulk['count'][idx]
+        if len(self.overlay_idx) == 0:
+            return base
+        positions = np.searchsorted(self.overlay_idx, idx).clip(
+            max=len(self.overlay_idx) - 1)
+        return np.where(self.overlay_idx[positions] == idx,
+            self.overlay_counts[positions], base)[()]
+
+    def __getitem__(self, field):
+        # Only materialize the count column if explicitly requested
+        if field == 'count':
+            bulk_counts = self.bulk['count'].copy()
+            bulk_counts[self.overlay_idx] = self.overlay_counts
+            return bulk_counts
+        return self.bulk[field]
+
+
 class get_bulk_counts():
     # orjson requires contiguous arrays for serialization
     def serialize(bulk):
@@ -123,7 +190,9 @@ def numpy_schema(name, partition=True, divider=None):
     if name == 'bulk':
         if partition:
             schema['_properties'] = {'bulk': True}
-        schema['_updater'] = bulk_numpy_updater
+        # All processes must share the same updater (vivarium-core keeps
+        # the first one and warns about the rest)
+        schema['_updater'] = bulk_numpy_updater.updater
         # Only pull out counts to be serialized (save space and time)
         schema['_serializer'] = get_bulk_counts
         schema['_divider'] = 'bulk_binomial'
@@ -153,17 +222,95 @@ def bulk_name_to_idx(names, bulk_names):
         return np.where(bulk_names == names)[0][0]
 
 
-def bulk_numpy_updater(current, update):
-    # Bulk updates are lists of tuples, where first value
-    # in each tuple is an array of indices to update and
-    # second value is array of updates to apply
-    result = current
-    # Numpy arrays are read-only outside of updater
-    result.flags.writeable = True
-    for (idx, value) in update:
-        result['count'][idx] += value
-    result.flags.writeable = False
-    return result
+def flatten_bulk_updates(updates):
+    """Concatenate bulk updates into flat arrays of indices and values.
+
+    Args:
+        updates: List of tuples, where the first value in each tuple is an
+            index, array of indices, or boolean mask of rows to update and
+            the second value is the (broadcastable) value for those rows.
+
+    Returns:
+        Tuple of 1D arrays of indices and their values, in update order.
+    """
+    all_idx = []
+    all_values = []
+    for idx, value in updates:
+        idx = np.asarray(idx)
+        if idx.dtype == np.bool_:
+            idx = np.nonzero(idx)[0]
+        idx, value = np.broadcast_arrays(idx, value)
+        all_idx.append(idx.ravel())
+        all_values.append(value.ravel())
+    return np.concatenate(all_idx), np.concatenate(all_values)
+
+
+def coalesce_bulk_updates(updates):
+    """Merge bulk updates into a single update with unique indices.
+
+    Args:
+        updates: List of tuples, where the first value in each tuple is an
+            index, array of indices, or boolean mask of rows to update and
+            the second value is the (broadcastable) delta to apply.
+
+    Returns:
+        Tuple of sorted unique indices and the summed deltas for each. Unlike
+        ``counts[idx] += value``, repeated indices are all accounted for.
+    """
+    all_idx, all_values = flatten_bulk_updates(updates)
+    unique_idx, inverse = np.unique(all_idx, return_inverse=True)
+    deltas = np.zeros(len(unique_idx), dtype=all_values.dtype)
+    np.add.at(deltas, inverse.ravel(), all_values)
+    return unique_idx, deltas
+
+
+class BulkNumpyUpdater:
+    """Updater for bulk molecule arrays that applies each update with a
+    single scatter-add (see :py:func:`coalesce_bulk_updates`).
+
+    Updates of the form ``{'queue': [...]}`` are stored until a
+    :py:class:`ecoli.processes.unique_update.UniqueUpdate` Step signals for
+    them to be applied with ``{'update': True}``, so that the updates of all
+    Evolvers in a timestep are applied in one pass. Queues are kept per bulk
+    array (which this updater modifies in place), so cells in a colony do
+    not share them. Only Evolvers queue their updates: Steps run one after
+    another and read the bulk updates of the Steps before them, so their
+    updates are applied immediately.
+
+    Use the module-level :py:data:`bulk_numpy_updater` instance, which
+    :py:func:`numpy_schema` gives every process wired to a bulk store.
+    """
+    def __init__(self):
+        # Queued updates keyed by bulk array
+        self._queues = _ArrayRegistry()
+
+    def __deepcopy__(self, memo):
+        # Schemas are deep-copied, which must not create a new updater
+        return self
+
+    def updater(self, current, update):
+        # Bulk updates are lists of tuples, where first value
+        # in each tuple is an array of indices to update and
+        # second value is array of updates to apply
+        if isinstance(update, dict):
+            queued_updates = self._queues.get(current)
+            if queued_updates is None:
+                queued_updates = []
+                self._queues.set(current, queued_updates)
+            queued_updates.extend(update.get('queue', []))
+            if not update.get('update', False):
+                return current
+            update = self._queues.pop(current)
+        if len(update) == 0:
+            return current
+
+        result = current
+        idx, deltas = coalesce_bulk_updates(update)
+        # Numpy arrays are read-only outside of updater
+        result.flags.writeable = True
+        result['count'][idx] += deltas
+        result.flags.writeable = False
+        return result
 
 
 def attrs(states, attributes):
@@ -174,30 +321,210 @@ def attrs(states, attributes):
     return [states[attribute][mol_mask] for attribute in attributes]
 
 
-def get_free_indices(result, n_objects):
-    # Find inactive rows for new molecules and expand array
-    # by at least 10% to create more rows when necessary
-    free_indices = np.where(result['_entryState'] == 0)[0]
-    n_free_indices = free_indices.size
+# Unique molecule arrays grow by this factor when they run out of free rows
+UNIQUE_GROWTH_FACTOR = 1.5
+# Arrays with at least this many rows are compacted when less than this
+# fraction of their rows are active
+UNIQUE_COMPACTION_MIN_ROWS = 1000
+UNIQUE_COMPACTION_OCCUPANCY = 0.25
+# Compacted arrays keep at least this many rows so that arrays whose
+# molecules were all deleted do not have to grow again from zero
+UNIQUE_MIN_CAPACITY = 100
+
 
-    if n_free_indices < n_objects:
+class _ArrayRegistry:
+    """Data associated with unique molecule arrays, keyed by array identity.
+    Entries are removed when their array is garbage collected."""
+
+    def __init__(self):
+        self._entries = {}
+
+    def get(self, array):
+        array_ref, value = self._entries.get(id(array), (None, None))
+        if array_ref is not None and array_ref() is array:
+            return value
+        return None
+
+    def set(self, array, value):
+        key = id(array)
+        entries = self._entries
+        def remove(array_ref):
+            if entries.get(key, (None,))[0] is array_ref:
+                del entries[key]
+        entries[key] = (weakref.ref(array, remove), value)
+
+    def pop(self, array):
+        value = self.get(array)
+        self._entries.pop(id(array), None)
+        return value
+
+
+# Lookup tables (see UniqueIndex) and sorted inactive rows of unique arrays
+_UNIQUE_INDEXES = _ArrayRegistry()
+_FREE_ROWS = _ArrayRegistry()
+
+# Shared by all bulk stores (see BulkNumpyUpdater)
+bulk_numpy_updater = BulkNumpyUpdater()
+
+
+def get_free_indices(result, n_objects, free_rows=None):
+    """Get rows for new molecules, growing the array if necessary.
+
+    Args:
+        result: Unique molecule array
+        n_objects: Number of new molecules
+        free_rows: Sorted inactive rows of ``result`` (found by scanning
+            ``_entryState`` if None)
+
+    Returns:
+        Tuple of the (possibly reallocated) array, the rows for the new
+        molecules, and the rows that are still free afterwards
+    """
+    if free_rows is None:
+        free_rows = np.flatnonzero(result['_entryState'] == 0)
+    n_free_rows = free_rows.size
+
+    if n_free_rows < n_objects:
+        # Grow geometrically so that repeated additions do not
+        # reallocate and copy the array every time
         old_size = result.size
-        n_new_entries = max(
-            np.int64(old_size * 0.1),
-            n_objects - n_free_indices
-            )
+        new_size = max(int(old_size * UNIQUE_GROWTH_FACTOR),
+            old_size + n_objects - n_free_rows)
+        grown = np.zeros(new_size, dtype=result.dtype)
+        grown[:old_size] = result
+        result = grown
+        free_rows = np.concatenate((free_rows,
+            np.arange(old_size, new_size)))
+
+    return result, free_rows[:n_objects], free_rows[n_objects:]
+
+
+def compact_unique_array(unique_array):
+    """Move the active molecules of a unique array to the front (keeping
+    their order, so :py:func:`attrs` is unchanged) and shrink the array
+    (to no less than ``UNIQUE_MIN_CAPACITY`` rows).
+
+    Returns:
+        Tuple of the compacted array and an array mapping each active row
+        of ``unique_array`` to its row in the compacted array
+    """
+    active_mask = unique_array['_entryState'].view(np.bool_)
+    n_active = np.count_nonzero(active_mask)
+    capacity = max(int(np.ceil(n_active * UNIQUE_GROWTH_FACTOR)),
+        UNIQUE_MIN_CAPACITY)
+    compacted = np.zeros(capacity, dtype=unique_array.dtype)
+    compacted[:n_active] = unique_array[active_mask]
+    new_rows = np.cumsum(active_mask) - 1
+    return compacted, new_rows
 
-        result = np.append(
-            result,
-            np.zeros(int(n_new_entries), dtype=result.dtype)
-        )
 
-        free_indices = np.concatenate((
-            free_indices,
-            old_size + np.arange(n_new_entries)
-        ))
+def get_unique_array_stats(unique_array):
+    """Get occupancy and fragmentation of a unique molecule array.
+
+    Returns:
+        Dictionary with the number of rows (``capacity``), the number of
+        active molecules (``active``), the fraction of rows that are active
+        (``occupancy``), and the fraction of inactive rows that are holes
+        between active rows that every :py:func:`attrs` call scans over
+        (``fragmentation``). See
+    :py:class:`ecoli.processes.listeners.unique_array_stats.UniqueArrayStats`
+    to emit them.
+    """
+    capacity = len(unique_array)
+    active_rows = np.flatnonzero(unique_array['_entryState'])
+    n_active = len(active_rows)
+    n_free = capacity - n_active
+    n_holes = active_rows[-1] + 1 - n_active if n_active else 0
+    return {
+        'capacity': capacity,
+        'active': n_active,
+        'occupancy': n_active / capacity if capacity else 0.0,
+        'fragmentation': n_holes / n_free if n_free else 0.0,
+    }
+
+
+class UniqueIndex:
+    """Sorted lookup table from ``unique_index`` to row for the active
+    molecules in a unique molecule array. Use :py:func:`get_unique_index`
+    to get the index of an array, which :py:class:`UniqueNumpyUpdater` keeps
+    up to date as molecules are added and deleted."""
+
+    def __init__(self, unique_array):
+        active_rows = np.flatnonzero(unique_array['_entryState'])
+        keys = unique_array['unique_index'][active_rows]
+        order = np.argsort(keys)
+        self.keys = keys[order]
+        self.rows = active_rows[order]
+
+    def add(self, keys, rows):
+        order = np.argsort(keys)
+        positions = np.searchsorted(self.keys, keys[order])
+        self.keys = np.insert(self.keys, positions, keys[order])
+        self.rows = np.insert(self.rows, positions, rows[order])
+
+    def delete(self, keys):
+        if len(self.keys) == 0:
+            return
+        positions = np.searchsorted(self.keys, keys).clip(
+            max=len(self.keys) - 1)
+        # Ignore molecules that were already deleted
+        positions = positions[self.keys[positions] == keys]
+        self.keys = np.delete(self.keys, positions)
+        self.rows = np.delete(self.rows, positions)
+
+    def get_rows(self, keys):
+        """Get the rows of molecules with the given unique indices.
+
+        Args:
+            keys: Unique index or array of unique indices
+
+        Returns:
+            Row (or array of rows) of each molecule, -1 if not active
+        """
+        if len(self.keys) == 0:
+            return np.full(np.shape(keys), -1)[()]
+        positions = np.searchsorted(self.keys, keys).clip(
+            max=len(self.keys) - 1)
+        return np.where(self.keys[positions] == keys,
+            self.rows[positions], -1)[()]
+
+
+def get_unique_index(unique_array):
+    """Get the :py:class:`UniqueIndex` of a unique molecule array, building
+    it if it does not exist yet."""
+    index = _UNIQUE_INDEXES.get(unique_array)
+    if index is None:
+        index = UniqueIndex(unique_array)
+        _UNIQUE_INDEXES.set(unique_array, index)
+    return index
+
+
+def unique_isin(unique_indexes, unique_array, subset=None):
+    """Check which unique indices belong to active molecules in an array.
+
+    Equivalent to ``np.isin(unique_indexes, attrs(unique_array,
+    ['unique_index'])[0][subset])`` but looks up each unique index in the
+    incrementally maintained :py:class:`UniqueIndex` instead of sorting.
+
+    Args:
+        unique_indexes: Array of unique indices (e.g. the ``RNAP_index``
+            attribute of RNAs) to look for in ``unique_array``
+        unique_array: Unique molecule array (e.g. active RNAPs)
+        subset: Optional boolean mask or indices into the active molecules
+            of ``unique_array`` (same order as :py:func:`attrs`). If given,
+            only these molecules are considered.
+
+    Returns:
+        Boolean mask with the same shape as ``unique_indexes``
+    """
+    rows = get_unique_index(unique_array).get_rows(unique_indexes)
+    found = rows >= 0
+    if subset is None:
+        return found
+    selected = np.zeros(len(unique_array), dtype=np.bool_)
+    selected[np.flatnonzero(unique_array['_entryState'])[subset]] = True
+    return found & selected[rows]
 
-    return result, free_indices[:n_objects]
 
 class UniqueNumpyUpdater:
     def __init__(self):
@@ -223,8 +550,17 @@ class UniqueNumpyUpdater:
         
         if not update.get('update', False):
             return current
+        # Nothing queued since the last time updates were applied
+        if not (self.add_updates or self.set_updates or self.delete_updates):
+            return current
 
         result = current
+        # Keep the unique index lookup table (if built) up to date
+        index = _UNIQUE_INDEXES.pop(current)
+        free_rows = _FREE_ROWS.pop(current)
+        if index is not None and any('unique_index' in set_update
+            for set_update in self.set_updates):
+            index = None
         # Numpy arrays are read-only outside of updater
         result.flags.writeable = True
         active_mask = result['_entryState'].view(np.bool_)
@@ -242,19 +578,42 @@ class UniqueNumpyUpdater:
             # each value is an array. The nth element of each array is the value
             # for the corresponding column of the nth new molecule to be added.
             n_new_molecules = len(next(iter(add_update.values())))
-            result, free_indices = get_free_indices(result, n_new_molecules)
+            result, free_indices, free_rows = get_free_indices(
+                result, n_new_molecules, free_rows)
             for col, col_values in add_update.items():
                 result[col][free_indices] = col_values
             result['_entryState'][free_indices] = 1
+            if 'unique_index' not in add_update:
+                index = None
+            elif index is not None:
+                index.add(result['unique_index'][free_indices], free_indices)
         for delete_indices in self.delete_updates:
             # Delete updates are arrays of active row indices to delete
             rows_to_delete = initially_active_idx[delete_indices]
+            if index is not None:
+                index.delete(result['unique_index'][rows_to_delete])
             result[rows_to_delete] = np.zeros(1, dtype=result.dtype)
+            if free_rows is not None:
+                free_rows = np.union1d(free_rows, rows_to_delete)
+
+        # Compact arrays that are mostly inactive rows
+        if (len(result) >= UNIQUE_COMPACTION_MIN_ROWS
+            and np.count_nonzero(result['_entryState'])
+                < UNIQUE_COMPACTION_OCCUPANCY * len(result)
+        ):
+            result, new_rows = compact_unique_array(result)
+            free_rows = np.flatnonzero(result['_entryState'] == 0)
+            if index is not None:
+                index.rows = new_rows[index.rows]
         
         self.add_updates = []
         self.delete_updates = []
         self.set_updates = []
         result.flags.writeable = False
+        if index is not None:
+            _UNIQUE_INDEXES.set(result, index)
+        if free_rows is not None:
+            _FREE_ROWS.set(result, free_rows)
         return result
 
 def listener_schema(elements):
@@ -304,9 +663,10 @@ def divide_ribosomes_by_RNA(values, state):
     n_molecules = len(mRNA_index)
     if n_molecules > 0:
         # Divide ribosomes based on their mRNA index
-        d1_rnas, d2_rnas = divide_RNAs_by_domain(state['RNA'], state)
-        d1_bool = np.isin(mRNA_index, d1_rnas['unique_index'])
-        d2_bool = np.isin(mRNA_index, d2_rnas['unique_index'])
+        d1_rna_bool, d2_rna_bool = divide_RNAs_by_domain_masks(
+            state['RNA'], state)
+        d1_bool = unique_isin(mRNA_index, state['RNA'], d1_rna_bool)
+        d2_bool = unique_isin(mRNA_index, state['RNA'], d2_rna_bool)
 
         # Binomially divide indexes of mRNAs that are degraded but still
         # has bound ribosomes. This happens because mRNA degradation does
@@ -397,6 +757,13 @@ def divide_by_domain(values, state):
 
 
 def divide_RNAs_by_domain(values, state):
+    d1_bool, d2_bool = divide_RNAs_by_domain_masks(values, state)
+    rnas = values[values['_entryState'].view(np.bool_)]
+    return [rnas[d1_bool], rnas[d2_bool]]
+
+
+def divide_RNAs_by_domain_masks(values, state):
+    # Get masks of active RNAs that go to each daughter cell
     is_full_transcript, RNAP_index = attrs(values,
         ["is_full_transcript", "RNAP_index"])
 
@@ -405,14 +772,11 @@ def divide_RNAs_by_domain(values, state):
     if n_molecules > 0:
         # Figure out which RNAPs went to each daughter cell
         domain_division = divide_domains(state)
-        rnaps = state['active_RNAP']
-        rnaps = rnaps[rnaps['_entryState'].view(np.bool_)]
-        d1_rnap_bool = np.isin(rnaps['domain_index'],
+        rnap_domain_index, = attrs(state['active_RNAP'], ['domain_index'])
+        d1_rnap_bool = np.isin(rnap_domain_index,
             domain_division['d1_all_domain_indexes'])
-        d2_rnap_bool = np.isin(rnaps['domain_index'],
+        d2_rnap_bool = np.isin(rnap_domain_index,
             domain_division['d2_all_domain_indexes'])
-        d1_rnap_indexes = rnaps['unique_index'][d1_rnap_bool]
-        d2_rnap_indexes = rnaps['unique_index'][d2_rnap_bool]
 
         d1_bool = np.zeros(n_molecules, dtype=np.bool_)
         d2_bool = np.zeros(n_molecules, dtype=np.bool_)
@@ -440,10 +804,12 @@ def divide_RNAs_by_domain(values, state):
         RNAP_index_partial_transcripts = RNAP_index[
             partial_transcript_indexes]
 
-        partial_d1_indexes = partial_transcript_indexes[
-            np.isin(RNAP_index_partial_transcripts, d1_rnap_indexes)]
-        partial_d2_indexes = partial_transcript_indexes[
-            np.isin(RNAP_index_partial_transcripts, d2_rnap_indexes)]
+        partial_d1_indexes = partial_transcript_indexes[unique_isin(
+            RNAP_index_partial_transcripts, state['active_RNAP'],
+            d1_rnap_bool)]
+        partial_d2_indexes = partial_transcript_indexes[unique_isin(
+            RNAP_index_partial_transcripts, state['active_RNAP'],
+            d2_rnap_bool)]
 
         d1_bool[partial_d1_indexes] = True
         d2_bool[partial_d2_indexes] = True
@@ -454,10 +820,9 @@ def divide_RNAs_by_domain(values, state):
         assert n_molecules == n_d1 + n_d2
         assert np.count_nonzero(np.logical_and(d1_bool, d2_bool)) == 0
 
-        rnas = values[values['_entryState'].view(np.bool_)]
-        return [rnas[d1_bool], rnas[d2_bool]]
-    
-    return [np.zeros(0, dtype=values.dtype), np.zeros(0, dtype=values.dtype)]
+        return d1_bool, d2_bool
+
+    return np.zeros(0, dtype=np.bool_), np.zeros(0, dtype=np.bool_)
 
 
 def empty_dict_divider(values):
@@ -515,3 +880,122 @@ def get_descendent_domains(root_domains, domain_index, child_domains, place_hold
     return np.array(flatten([
         follow_domain_tree(root_domain, domain_index, child_domains, place_holder)
         for root_domain in root_domains]))
+
+
+def test_bulk_overlay():
+    bulk = np.zeros(5, dtype=[('id', 'U10'), ('count', int)])
+    bulk['count'] = [1, 2, 3, 4, 5]
+    overlay = BulkOverlay(bulk, [(np.array([1, 3]), 0), (3, 7)])
+    assert counts(overlay, np.arange(5)).tolist() == [1, 0, 3, 7, 5]
+    assert counts(overlay, 3) == 7
+    assert overlay['count'].tolist() == [1, 0, 3, 7, 5]
+    assert bulk['count'].tolist() == [1, 2, 3, 4, 5]
+
+
+def test_allocated_counts():
+    allocation = (np.array([1, 4, 7]), np.array([10, 0, 30]))
+    assert allocated_counts(allocation, np.array([0, 1, 4, 7, 9])).tolist() == [
+        0, 10, 0, 30, 0]
+    assert allocated_counts(allocation, 7) == 30
+    assert allocated_counts(allocation, 8) == 0
+    assert counts(allocation, np.array([7, 1])).tolist() == [30, 10]
+    # Processes that requested nothing are allocated nothing
+    empty = (np.zeros(0, dtype=int), np.zeros(0, dtype=int))
+    assert allocated_counts(empty, np.arange(3)).tolist() == [0, 0, 0]
+    assert allocated_counts(empty, 2) == 0
+
+
+def test_bulk_numpy_updater():
+    bulk = np.zeros(5, dtype=[('id', 'U10'), ('count', int)])
+    bulk.flags.writeable = False
+    updater = bulk_numpy_updater.updater
+    # Repeated indices are summed instead of overwritten
+    bulk = updater(bulk, [(np.array([0, 0, 1]), np.array([1, 2, 3])),
+        (np.array([True, False, False, False, True]), 4)])
+    assert bulk['count'].tolist() == [7, 3, 0, 0, 4]
+    # Queued updates are only applied when signalled
+    bulk = updater(bulk, {'queue': [(2, 5)]})
+    bulk = updater(bulk, {'queue': [(np.array([2, 3]), -1)]})
+    assert bulk['count'].tolist() == [7, 3, 0, 0, 4]
+    # Each bulk array has its own queue
+    other_bulk = np.zeros(5, dtype=bulk.dtype)
+    other_bulk = updater(other_bulk, {'queue': [(0, 1)]})
+    bulk = updater(bulk, {'update': True})
+    assert bulk['count'].tolist() == [7, 3, 4, -1, 4]
+    assert not bulk.flags.writeable
+    other_bulk = updater(other_bulk, {'update': True})
+    assert other_bulk['count'].tolist() == [1, 0, 0, 0, 0]
+    assert updater(bulk, {'update': True}) is bulk
+    # Every bulk schema shares the updater (no incompatible schemas)
+    assert numpy_schema('bulk')['_updater'] == copy.deepcopy(
+        numpy_schema('bulk'))['_updater']
+
+
+def test_unique_index():
+    rng = np.random.default_rng(0)
+    unique = np.zeros(10, dtype=[('_entryState', np.int8),
+        ('unique_index', int), ('RNAP_index', int)])
+    unique['_entryState'][:8] = 1
+    unique['unique_index'][:8] = rng.permutation(100)[:8]
+    unique.flags.writeable = False
+    updater = UniqueNumpyUpdater().updater
+    queries = np.arange(200)
+    new_unique_indexes = 100 + rng.permutation(100)
+    for i in range(5):
+        subset = rng.random(unique['_entryState'].sum()) < 0.5
+        active_indexes, = attrs(unique, ['unique_index'])
+        assert np.array_equal(unique_isin(queries, unique),
+            np.isin(queries, active_indexes))
+        assert np.array_equal(unique_isin(queries, unique, subset),
+            np.isin(queries, active_indexes[subset]))
+        # Index is kept up to date by the updater (including when the
+        # array grows to fit new molecules)
+        n_active = len(active_indexes)
+        updater(unique, {'delete': rng.choice(n_active, 3, replace=False)})
+        new_indexes = new_unique_indexes[i * 6:(i + 1) * 6]
+        updater(unique, {'add': {'unique_index': new_indexes,
+            'RNAP_index': np.zeros(6, dtype=int)}})
+        unique = updater(unique, {'update': True})
+        rows = get_unique_index(unique).get_rows(new_indexes)
+        assert np.array_equal(unique['unique_index'][rows], new_indexes)
+
+
+def test_unique_compaction():
+    unique = np.zeros(UNIQUE_COMPACTION_MIN_ROWS, dtype=[
+        ('_entryState', np.int8), ('unique_index', int)])
+    unique['_entryState'] = 1
+    unique['unique_index'] = np.arange(len(unique))
+    unique.flags.writeable = False
+    updater = UniqueNumpyUpdater().updater
+    # Index is remapped when array is compacted
+    get_unique_index(unique)
+    n_keep = 100
+    updater(unique, {'delete': np.arange(n_keep, len(unique))})
+    updater(unique, {'delete': np.arange(0, n_keep, 2)})
+    stats = get_unique_array_stats(unique)
+    unique = updater(unique, {'update': True})
+    assert stats['occupancy'] == 1
+    stats = get_unique_array_stats(unique)
+    assert stats['capacity'] == max(
+        int(n_keep / 2 * UNIQUE_GROWTH_FACTOR), UNIQUE_MIN_CAPACITY)
+    assert stats['active'] == n_keep / 2
+    assert stats['fragmentation'] == 0
+    remaining, = attrs(unique, ['unique_index'])
+    assert np.array_equal(remaining, np.arange(1, n_keep, 2))
+    assert np.array_equal(unique_isin(np.arange(n_keep), unique),
+        np.arange(n_keep) % 2 == 1)
+    # Free rows are reused before growing the array
+    unique = updater(unique, {'add': {'unique_index': np.array([-1])},
+        'update': True})
+    assert len(unique) == stats['capacity']
+    assert unique['unique_index'][n_keep // 2] == -1
+    # Arrays keep a minimum capacity when all molecules are deleted
+    empty = np.zeros(UNIQUE_COMPACTION_MIN_ROWS, dtype=unique.dtype)
+    empty.flags.writeable = False
+    updater(empty, {'delete': np.array([], int)})
+    empty = updater(empty, {'update': True})
+    assert len(empty) == UNIQUE_MIN_CAPACITY
+    empty = updater(empty, {'add': {'unique_index': np.array([-2])},
+        'update': True})
+    assert len(empty) == UNIQUE_MIN_CAPACITY
+    assert np.array_equal(attrs(empty, ['unique_index'])[0], [-2])
@@ -1,17 +1,24 @@
 import re
 import binascii
 import numpy as np
-from six.moves import cPickle
 from wholecell.utils import units
 from wholecell.utils.unit_struct_array import UnitStructArray
 from wholecell.utils.fitting import normalize
 
 from ecoli.processes.polypeptide_elongation import MICROMOLAR_UNITS
 from ecoli.library.parameters import param_store
+from ecoli.library.sim_data_cache import load_sim_data
 
 RAND_MAX = 2**31
 SIM_DATA_PATH = 'reconstruction/sim_data/kb/simData.cPickle'
 
+
+def seed_from_name(name, seed):
+    """Derive the random seed of a process from its name and the
+    simulation seed."""
+    return binascii.crc32(name.encode('utf-8'), seed) & 0xffffffff
+
+
 class LoadSimData:
 
     def __init__(
@@ -27,6 +34,9 @@ class LoadSimData:
 
         self.seed = seed
         self.random_state = np.random.RandomState(seed = seed)
+        # Name passed to _seedFromName (None for seeds drawn from
+        # random_state) by the last config method that set a seed
+        self.seed_source = None
 
         self.trna_charging = trna_charging
         self.ppgpp_regulation = ppgpp_regulation
@@ -35,9 +45,9 @@ class LoadSimData:
         # when calculating degradation
         self.degrade_misc = False
 
-        # load sim_data
-        with open(sim_data_path, 'rb') as sim_data_file:
-            self.sim_data = cPickle.load(sim_data_file)
+        # load sim_data (arrays are shared with other LoadSimData instances
+        # in this process and forked processes until they are modified)
+        self.sim_data = load_sim_data(sim_data_path)
 
         self.submass_indexes = {
             f'massDiff_{submass}': idx
@@ -298,7 +308,12 @@ class LoadSimData:
         return [int(np.where(rna_ids==name)[0][0]) for name in names]
             
     def _seedFromName(self, name):
-        return binascii.crc32(name.encode('utf-8'), self.seed) & 0xffffffff
+        self.seed_source = name
+        return seed_from_name(name, self.seed)
+
+    def _random_seed(self):
+        self.seed_source = None
+        return self.random_state.randint(RAND_MAX)
 
     def get_config_by_name(self, name, time_step=2, parallel=False):
         name_config_mapping = {
@@ -709,7 +724,7 @@ class LoadSimData:
             'dark_atp': self.sim_data.constants.darkATP,
             'non_growth_associated_maintenance': self.sim_data.constants.non_growth_associated_maintenance,
             'cell_dry_mass_fraction': self.sim_data.mass.cell_dry_mass_fraction,
-            'seed': self.random_state.randint(RAND_MAX),
+            'seed': self._random_seed(),
             'kinetic_constraint_reactions': self.sim_data.process.metabolism.kinetic_constraint_reactions,
             'doubling_time': self.sim_data.condition_to_doubling_time[self.sim_data.condition],
             'get_biomass_as_concentrations': self.sim_data.mass.getBiomassAsConcentrations,
@@ -923,6 +938,9 @@ class LoadSimData:
         }
         return allocator_config
 
+    def get_dry_mass_inc_dict(self):
+        return self.sim_data.expectedDryMassIncreaseDict
+
     def get_chromosome_structure_config(self, time_step=2, parallel=False, deriver_mode=False):
         chromosome_structure_config = {
             'time_step': time_step,
@@ -974,7 +992,7 @@ class LoadSimData:
             'ribosome30S': self.sim_data.molecule_ids.s30_full_complex,
             'ribosome50S': self.sim_data.molecule_ids.s50_full_complex,
             
-            'seed': self.random_state.randint(RAND_MAX)
+            'seed': self._random_seed()
         }
         return rna_interference_config
 
@@ -986,6 +1004,6 @@ class LoadSimData:
             '_parallel': parallel,
             'trna_ids': rna_ids[is_trna],
             # Ensure that a new seed is set upon division
-            'seed': self.random_state.randint(RAND_MAX)
+            'seed': self._random_seed()
         }
         return tetracycline_ribosome_equilibrium_config
@@ -0,0 +1,173 @@
+"""
+==============
+Sim Data Cache
+==============
+
+Unpickling ``simData.cPickle`` takes several seconds and creates a full copy
+of every parameter array, which adds up when a composer is built for every
+cell (e.g. on division or in a colony). :py:func:`load_sim_data` loads a
+sim_data file once per process and splits it into:
+
+* a pickle of the object graph, kept in memory, and
+* the large NumPy arrays, stored in a side file next to the sim_data file
+  (``<sim_data_path>.cache/<sha256>.buffers``) using pickle protocol 5
+  out-of-band buffers.
+
+Every call returns a new sim_data object whose arrays are views of a
+copy-on-write memory map of the side file. All composers, daughter cells and
+forked agent processes therefore share the same physical pages until an
+array is modified, and modifying a sim_data object (e.g. in
+:py:class:`ecoli.library.sim_data.LoadSimData`) never affects other copies.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+import numpy as np
+
+
+# Out-of-band buffers are aligned to this many bytes in the side file
+BUFFER_ALIGNMENT = 64
+
+# Content hash of each sim_data file, keyed by (path, size, modified time)
+_SIM_DATA_HASHES = {}
+# Loaded sim_data, keyed by (path, content hash)
+_SIM_DATA_CACHE = {}
+
+
+def get_sim_data_hash(sim_data_path):
+    """Get the SHA-256 hash of a sim_data file (computed once per process
+    unless the file changes)."""
+    path = os.path.abspath(sim_data_path)
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    if key not in _SIM_DATA_HASHES:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(2**24), b''):
+                sha.update(chunk)
+        _SIM_DATA_HASHES[key] = sha.hexdigest()
+    return _SIM_DATA_HASHES[key]
+
+
+def write_buffer_cache(obj, cache_prefix):
+    """Split an object into an object pickle and a buffer file.
+
+    Args:
+        obj: Object to pickle
+        cache_prefix: Path prefix of cache files (``.pkl``, ``.buffers``
+            and ``.json``, the last of which marks the cache as complete)
+    """
+    buffers = []
+    objects = pickle.dumps(obj, protocol=5,
+        buffer_callback=buffers.append)
+
+    layout = []
+    cache_dir = os.path.dirname(cache_prefix)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write to temporary files first so that processes creating the same
+    # cache at the same time never read a partially written file
+    with tempfile.NamedTemporaryFile(dir=cache_dir, delete=False) as f:
+        offset = 0
+        for buffer in buffers:
+            raw = buffer.raw()
+            padding = -offset % BUFFER_ALIGNMENT
+            f.write(b'\0' * padding)
+            offset += padding
+            f.write(raw)
+            layout.append((offset, raw.nbytes))
+            offset += raw.nbytes
+        buffers_tmp = f.name
+    with tempfile.NamedTemporaryFile(dir=cache_dir, delete=False) as f:
+        f.write(objects)
+        objects_tmp = f.name
+    with tempfile.NamedTemporaryFile('w', dir=cache_dir, delete=False) as f:
+        json.dump(layout, f)
+        layout_tmp = f.name
+    os.replace(buffers_tmp, f'{cache_prefix}.buffers')
+    os.replace(objects_tmp, f'{cache_prefix}.pkl')
+    # Written last, marks the cache as complete
+    os.replace(layout_tmp, f'{cache_prefix}.json')
+
+
+def read_buffer_cache(cache_prefix):
+    """Read the cache files written by :py:func:`write_buffer_cache`.
+
+    Returns:
+        Tuple of object pickle, buffer layout and buffer file path to pass
+        to :py:func:`load_buffer_cache`
+    """
+    with open(f'{cache_prefix}.json', 'r') as f:
+        layout = [tuple(entry) for entry in json.load(f)]
+    with open(f'{cache_prefix}.pkl', 'rb') as f:
+        objects = f.read()
+    return objects, layout, f'{cache_prefix}.buffers'
+
+
+def load_buffer_cache(objects, layout, buffers_path):
+    """Unpickle a new copy of a cached object."""
+    buffers = []
+    if layout:
+        # Copy-on-write: pages are shared until an array is modified
+        memory_map = np.memmap(buffers_path, dtype=np.uint8, mode='c')
+        buffers = [memory_map[offset:offset + size]
+            for offset, size in layout]
+    return pickle.loads(objects, buffers=buffers)
+
+
+def load_sim_data(sim_data_path):
+    """Load a sim_data object, sharing its arrays with other loads.
+
+    Falls back to unpickling the file directly if the cache cannot be
+    written (e.g. read-only file system).
+
+    Args:
+        sim_data_path: Path to pickled sim_data
+
+    Returns:
+        New sim_data object that can safely be modified
+    """
+    path = os.path.abspath(sim_data_path)
+    key = (path, get_sim_data_hash(path))
+    if key not in _SIM_DATA_CACHE:
+        cache_prefix = os.path.join(f'{path}.cache', key[1])
+        try:
+            if not os.path.exists(f'{cache_prefix}.json'):
+                with open(path, 'rb') as f:
+                    write_buffer_cache(pickle.load(f), cache_prefix)
+            _SIM_DATA_CACHE[key] = read_buffer_cache(cache_prefix)
+        except OSError:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+    return load_buffer_cache(*_SIM_DATA_CACHE[key])
+
+
+def test_load_sim_data():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sim_data_path = os.path.join(tmp_dir, 'simData.cPickle')
+        sim_data = {
+            'ids': np.array(['a', 'b', 'c']),
+            'matrix': np.arange(12, dtype=np.float64).reshape(3, 4),
+            'nested': {'fortran': np.asfortranarray(np.ones((5, 3)))},
+            'name': 'test',
+        }
+        with open(sim_data_path, 'wb') as f:
+            pickle.dump(sim_data, f)
+
+        first = load_sim_data(sim_data_path)
+        second = load_sim_data(sim_data_path)
+        assert os.path.exists(os.path.join(f'{sim_data_path}.cache',
+            f'{get_sim_data_hash(sim_data_path)}.buffers'))
+        for loaded in (first, second):
+            assert loaded['name'] == 'test'
+            np.testing.assert_array_equal(loaded['ids'], sim_data['ids'])
+            np.testing.assert_array_equal(
+                loaded['matrix'], sim_data['matrix'])
+            assert loaded['nested']['fortran'].flags.f_contiguous
+        # Modifying one copy does not affect the other
+        first['matrix'][0, 0] = -1
+        assert second['matrix'][0, 0] == 0
+        assert load_sim_data(sim_data_path)['matrix'][0, 0] == 0
@@ -0,0 +1,202 @@
+"""
+===================
+Step Execution Plan
+===================
+
+The Step flow of a composite (e.g. the one built by
+:py:class:`ecoli.composites.ecoli_master.Ecoli`) does not change unless Steps
+are added or removed (e.g. on division). However, the vivarium-core Engine
+topologically sorts the Step dependency graph every time it runs Steps.
+:py:class:`StepPlan` computes the execution layers once and reuses them
+until the graph changes (it memoizes ``get_execution_layers()``). Use
+:py:func:`use_step_plan` to install it in an Engine.
+
+``StepPlan`` extends the private ``_StepGraph`` class of vivarium-core (as
+pinned in ``requirements.txt``). With versions of vivarium-core that lack
+it, :py:func:`use_step_plan` leaves the Engine's own Step graph in place.
+
+This module can also be run to print the execution plan of the Ecoli
+composite for a configuration and flag redundant dependencies::
+
+    python ecoli/library/step_plan.py --config path/to/config.json
+"""
+
+import argparse
+import os
+import warnings
+
+import networkx as nx
+try:
+    from vivarium.core.engine import _StepGraph
+except ImportError:
+    _StepGraph = None
+
+
+if _StepGraph is not None:
+    class StepPlan(_StepGraph):
+        """Step dependency graph that caches its execution layers."""
+
+        def __init__(self, graph=None, sequential_steps=None):
+            super().__init__(graph, sequential_steps)
+            self._layers = None
+
+        def add(self, path, dependencies):
+            self._layers = None
+            super().add(path, dependencies)
+
+        def add_sequential(self, path):
+            self._layers = None
+            super().add_sequential(path)
+
+        def remove(self, path):
+            self._layers = None
+            super().remove(path)
+
+        def get_execution_layers(self):
+            if self._layers is None:
+                self._layers = super().get_execution_layers()
+            return self._layers
+else:
+    StepPlan = None
+
+
+def use_step_plan(engine):
+    """Make an Engine reuse its Step execution layers between time steps.
+
+    Does nothing (with a warning) if the installed vivarium-core does not
+    have the Step graph that :py:class:`StepPlan` extends.
+
+    Args:
+        engine: :py:class:`vivarium.core.engine.Engine` to modify in place
+
+    Returns:
+        Whether the Engine now uses a :py:class:`StepPlan`
+    """
+    step_graph = getattr(engine, '_step_graph', None)
+    if (StepPlan is None or not isinstance(step_graph, _StepGraph)
+        or not hasattr(step_graph, '_graph')
+        or not hasattr(step_graph, '_sequential_steps')
+    ):
+        warnings.warn('This version of vivarium-core does not support '
+            'StepPlan, so Step execution layers are not cached.')
+        return False
+    engine._step_graph = StepPlan(
+        step_graph._graph, step_graph._sequential_steps)
+    return True
+
+
+def get_flow_graph(flow):
+    """Build a Step dependency graph from a flow.
+
+    Args:
+        flow: Step dependency dictionary (name: list of dependency paths)
+
+    Returns:
+        NetworkX DiGraph with an edge from each dependency to its dependent
+    """
+    graph = nx.DiGraph()
+    for name, dependencies in flow.items():
+        graph.add_node((name,))
+        for dependency in dependencies:
+            graph.add_edge(tuple(dependency), (name,))
+    return graph
+
+
+def get_execution_plan(flow):
+    """Get the order in which the Engine runs the Steps in a flow.
+
+    Args:
+        flow: Step dependency dictionary (name: list of dependency paths)
+
+    Returns:
+        List of execution layers, each a sorted list of Step paths. All
+        Steps in a layer can run at the same time once the Steps in the
+        preceding layers have run.
+    """
+    return [sorted(layer) for layer in nx.topological_generations(
+        get_flow_graph(flow))]
+
+
+def get_redundant_dependencies(flow):
+    """Find dependencies that are already implied by other dependencies.
+
+    Args:
+        flow: Step dependency dictionary (name: list of dependency paths)
+
+    Returns:
+        Sorted list of (dependency path, Step path) tuples that can be
+        removed from the flow without changing the order of execution
+    """
+    graph = get_flow_graph(flow)
+    reduced = nx.transitive_reduction(graph)
+    return sorted(set(graph.edges) - set(reduced.edges))
+
+
+def print_execution_plan(flow):
+    layers = get_execution_plan(flow)
+    print(f'{sum(len(layer) for layer in layers)} Steps in '
+        f'{len(layers)} layers:')
+    for i, layer in enumerate(layers):
+        print(f'  {i}: ' + ', '.join('>'.join(path) for path in layer))
+    redundant = get_redundant_dependencies(flow)
+    if redundant:
+        print(f'{len(redundant)} redundant dependencies:')
+        for dependency, step in redundant:
+            print(f'  {">".join(step)} on {">".join(dependency)}')
+    else:
+        print('No redundant dependencies.')
+
+
+def test_step_plan():
+    flow = {
+        'a': [],
+        'b': [('a',)],
+        'c': [('a',), ('b',)],
+        'd': [('a',)],
+    }
+    assert get_execution_plan(flow) == [
+        [('a',)], [('b',), ('d',)], [('c',)]]
+    assert get_redundant_dependencies(flow) == [(('a',), ('c',))]
+
+    if StepPlan is None:
+        return
+    plan = StepPlan()
+    for name, dependencies in flow.items():
+        plan.add((name,), dependencies)
+    layers = plan.get_execution_layers()
+    assert plan.get_execution_layers() is layers
+    plan.add(('e',), [('c',)])
+    assert plan.get_execution_layers()[-1] == [('e',)]
+
+    class Engine:
+        _step_graph = plan
+    engine = Engine()
+    assert use_step_plan(engine)
+    assert engine._step_graph.get_execution_layers()[-1] == [('e',)]
+    # Engines without a supported Step graph keep their own
+    engine._step_graph = object()
+    step_graph = engine._step_graph
+    with warnings.catch_warnings(record=True):
+        warnings.simplefilter('always')
+        assert not use_step_plan(engine)
+    assert engine._step_graph is step_graph
+
+
+def main():
+    from ecoli.composites.ecoli_configs import CONFIG_DIR_PATH
+    from ecoli.experiments.ecoli_master_sim import EcoliSim
+
+    parser = argparse.ArgumentParser(
+        description='Print the Step execution plan of the Ecoli composite.')
+    parser.add_argument(
+        '--config', '-c',
+        default=os.path.join(CONFIG_DIR_PATH, 'default.json'),
+        help='Path to simulation configuration file.')
+    args = parser.parse_args()
+    sim = EcoliSim.from_file(args.config)
+    sim.build_ecoli()
+    print_execution_plan(sim.ecoli.flow)
+
+
+if __name__ == '__main__':
+    main()
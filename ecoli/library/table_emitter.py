@@ -0,0 +1,596 @@
+"""
+=============
+Table Emitter
+=============
+
+Writes emitted data to local compressed column files with
+:py:class:`wholecell.io.tablewriter.TableWriter` instead of MongoDB. Select
+it with ``"emitter": "table"`` (or ``--emitter table``) and set the output
+directory with the ``out_dir`` emitter argument (default: ``out/tables``)::
+
+    python ecoli/experiments/ecoli_master_sim.py --emitter table \\
+        --emitter_arg out_dir=out/tables
+
+Every emitted listener value becomes a column (e.g.
+``listeners.mass.dry_mass``) and the bulk molecule array is saved as its
+counts (the molecule IDs are saved once in the ``bulk_ids`` attribute).
+Bulk count deltas (see :py:mod:`ecoli.library.bulk_encoding`) are saved in
+the variable-length columns ``bulk.delta_indexes`` and
+``bulk.delta_values``. Values that are not numeric (strings, units, unique
+molecule arrays) are not saved.
+
+Each cell has its own tables, so agents in a colony (and the inner
+emitters of :py:class:`ecoli.processes.engine_process.EngineProcess`)
+never write to the same files::
+
+    <out_dir>/<experiment_id>/table_<n>                (outside of agents)
+    <out_dir>/<experiment_id>/agents/<agent_id>/table_<n>
+
+Emits that leave out some columns of a table (e.g. with an emit schedule,
+see :py:mod:`ecoli.library.emit_schedule`, or bulk keyframes between count
+deltas) are written to the same table, and the ``_missing`` column lists
+the columns that were not emitted in each row. A new table, with the
+columns of the previous table and the new ones, is only started when a
+column is emitted for the first time or its dtype or shape changes (e.g.
+after the first time step, when some listeners still hold their defaults).
+Columns whose lengths keep changing are saved as variable-length columns.
+
+Read the data back with :py:func:`read_columns` (one array per column) or
+with :py:meth:`TableEmitter.get_data`, which returns the same :term:`raw
+data` format as the other emitters for use in existing analyses.
+"""
+
+import os
+import re
+
+import numpy as np
+from vivarium.core.emitter import Emitter
+from vivarium.library.topology import assoc_path
+
+from ecoli.library.bulk_encoding import (
+    DELTA_INDEXES, DELTA_VALUES, is_bulk_delta)
+from wholecell.io.tablereader import TableReader
+from wholecell.io.tablewriter import (TableWriter, COMPRESSION_TYPE_ZLIB,
+    get_compression_type)
+
+
+DEFAULT_OUT_DIR = os.path.join('out', 'tables')
+TABLE_PREFIX = 'table_'
+TIME_COLUMN = 'time'
+# Indexes (into the column_names attribute) of the columns that were not
+# emitted in each row
+MISSING_COLUMN = '_missing'
+BULK_PATH = ('bulk',)
+BULK_DELTA_PATHS = (BULK_PATH + (DELTA_INDEXES,), BULK_PATH + (DELTA_VALUES,))
+
+
+def _column_name(path):
+    return '.'.join(str(key).replace(os.sep, '_') for key in path)
+
+
+def _get_columns(value, path=(), columns=None):
+    """Flatten emitted data into a dictionary of numeric arrays keyed by
+    path. The bulk molecule array is replaced by its counts."""
+    if columns is None:
+        columns = {}
+    if is_bulk_delta(value):
+        # Empty deltas (no counts changed) are saved too, so that every
+        # emit of bulk counts has a row
+        for key in (DELTA_INDEXES, DELTA_VALUES):
+            columns[path + (key,)] = np.asarray(value[key], dtype=np.int64)
+    elif isinstance(value, dict):
+        for key, subvalue in value.items():
+            _get_columns(subvalue, path + (key,), columns)
+    elif isinstance(value, np.ndarray) and value.dtype.names:
+        if path == BULK_PATH:
+            columns[path] = value['count']
+    else:
+        try:
+            array = np.asarray(value)
+        except ValueError:
+            # Ragged nested lists
+            return columns
+        # Empty values (e.g. listener defaults) are not saved
+        if array.dtype.kind in 'biuf' and array.size:
+            columns[path] = array
+    return columns
+
+
+class _Table:
+    """Table that is being written for one cell.
+
+    Args:
+        path: Table directory
+        columns: Dictionary from path to an example value of each column
+            (the columns of an emit can be any subset of these)
+        variable_length: Paths of the variable-length columns
+    """
+
+    def __init__(self, path, columns, variable_length, bulk_ids=None,
+        compression_type=COMPRESSION_TYPE_ZLIB, threads=0
+    ):
+        self.writer = TableWriter(path, compression_type, threads)
+        self.paths = list(columns)
+        self.names = {path: _column_name(path) for path in columns}
+        self.signature = _get_signature(columns, variable_length)
+        self.sizes = {path: array.size for path, array in columns.items()}
+        # Values written for columns that are not emitted in a row
+        self.fill = {path: np.zeros(
+            0 if path in variable_length else array.shape, array.dtype)
+            for path, array in columns.items()}
+        self.rows = 0
+        self.writer.writeAttributes(
+            paths={name: list(path) for path, name in self.names.items()},
+            column_names=[self.names[path] for path in self.paths],
+            shapes={self.names[path]: list(array.shape)
+                for path, array in columns.items()
+                if path not in variable_length})
+        if bulk_ids is not None:
+            self.writer.writeAttributes(bulk_ids=bulk_ids)
+        self.writer.set_variable_length_columns(MISSING_COLUMN, *(
+            self.names[path] for path in columns if path in variable_length))
+
+    def accepts(self, columns, variable_length):
+        """Whether a row with these columns (and possibly fewer) can be
+        appended."""
+        return all(self.signature.get(path) == signature
+            for path, signature in _get_signature(
+                columns, variable_length).items())
+
+    def append(self, time, columns):
+        missing = [i for i, path in enumerate(self.paths)
+            if path not in columns]
+        self.writer.append(**{
+            TIME_COLUMN: time,
+            MISSING_COLUMN: np.array(missing, dtype=np.int64),
+        }, **{
+            self.names[path]: columns.get(path, self.fill[path])
+            for path in self.paths})
+        self.rows += 1
+
+
+def _get_signature(columns, variable_length):
+    return {
+        path: (array.dtype.str,
+            None if path in variable_length else array.shape)
+        for path, array in columns.items()}
+
+
+class TableEmitter(Emitter):
+    """Emitter that writes listener data and bulk counts of each cell to
+    :py:class:`wholecell.io.tablewriter.TableWriter` tables.
+
+    Args:
+        config: Emitter configuration with the keys ``experiment_id``,
+            ``out_dir`` (default: ``out/tables``) and ``embed_path`` (path
+            at which emitted data is placed, set by
+            :py:class:`ecoli.processes.engine_process.EngineProcess`),
+            ``compression`` (``'zlib'`` (default), ``'lz4'``, ``'zstd'`` or
+            ``'none'``) and ``compression_threads`` (number of threads to
+            compress each table on, default: 0 to compress on the calling
+            thread)
+    """
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.embed_path = tuple(config.get('embed_path', ()))
+        self.experiment_dir = os.path.join(
+            config.get('out_dir', DEFAULT_OUT_DIR),
+            str(config.get('experiment_id', 'experiment')))
+        self.compression_type = get_compression_type(
+            config.get('compression', 'zlib'))
+        self.compression_threads = config.get('compression_threads', 0)
+        self.tables = {}
+        self.resized = {}
+        self.variable_length = {}
+
+    def emit(self, data):
+        if data['table'] != 'history':
+            return
+        emit_data = data['data'].copy()
+        time = emit_data.pop('time', None)
+        emit_data = assoc_path({}, self.embed_path, emit_data)
+        agents = emit_data.pop('agents', {})
+        self._append((), time, emit_data)
+        for agent_id, agent_data in agents.items():
+            self._append(('agents', agent_id), time, agent_data)
+
+    def _append(self, table_path, time, data):
+        columns = _get_columns(data)
+        if not columns:
+            return
+        table = self.tables.get(table_path)
+        variable_length = self.variable_length.setdefault(table_path, set())
+        # Delta lengths change at every emit
+        variable_length.update(
+            path for path in BULK_DELTA_PATHS if path in columns)
+        resized = self.resized.setdefault(table_path, set())
+        if table is not None and not table.accepts(columns, variable_length):
+            table.writer.close()
+            # Columns that change size more than once (i.e. not just when
+            # a default value is replaced) keep changing
+            for path, array in columns.items():
+                if table.sizes.get(path, array.size) != array.size:
+                    if path in resized:
+                        variable_length.add(path)
+                    resized.add(path)
+            # Keep the columns that were not emitted this time, so that
+            # alternating sets of columns share one table
+            columns_with_previous = {path: table.fill[path]
+                for path in table.paths if path not in columns}
+            columns_with_previous.update(columns)
+            table = None
+        else:
+            columns_with_previous = columns
+        if table is None:
+            # Bulk counts are usually emitted without IDs (see
+            # ecoli.library.schema.get_bulk_counts)
+            bulk_ids = None
+            bulk = data.get('bulk')
+            if isinstance(bulk, np.ndarray) and bulk.dtype.names:
+                bulk_ids = bulk['id'].tolist()
+            table = _Table(self._new_table_dir(table_path),
+                columns_with_previous, variable_length, bulk_ids,
+                self.compression_type, self.compression_threads)
+            self.tables[table_path] = table
+        table.append(time, columns)
+
+    def _new_table_dir(self, table_path):
+        """Claim the next unused table directory of a cell (other emitters
+        can write tables for the same cell)."""
+        cell_dir = os.path.join(
+            self.experiment_dir, *(str(key) for key in table_path))
+        os.makedirs(cell_dir, exist_ok=True)
+        index = len(get_table_dirs(cell_dir))
+        while True:
+            path = os.path.join(cell_dir, f'{TABLE_PREFIX}{index}')
+            try:
+                os.mkdir(path)
+                return path
+            except FileExistsError:
+                index += 1
+
+    def close(self):
+        """Finish writing all tables. Later emits start new tables."""
+        for table in self.tables.values():
+            table.writer.close()
+        self.tables = {}
+
+    def get_data(self, query=None):
+        self.close()
+        return read_data(self.experiment_dir, query)
+
+
+def get_table_dirs(cell_dir):
+    """List the table directories of a cell in the order they were
+    written."""
+    if not os.path.isdir(cell_dir):
+        return []
+    tables = [name for name in os.listdir(cell_dir)
+        if re.fullmatch(f'{TABLE_PREFIX}[0-9]+', name)]
+    return [os.path.join(cell_dir, name) for name in sorted(
+        tables, key=lambda name: int(name[len(TABLE_PREFIX):]))]
+
+
+def get_cell_dirs(experiment_dir):
+    """Get the directories of all cells with tables, keyed by the path of
+    the cell in the simulation state (``()`` for data outside of agents)."""
+    cell_dirs = {}
+    if get_table_dirs(experiment_dir):
+        cell_dirs[()] = experiment_dir
+    agents_dir = os.path.join(experiment_dir, 'agents')
+    if os.path.isdir(agents_dir):
+        for agent_id in sorted(os.listdir(agents_dir)):
+            cell_dirs[('agents', agent_id)] = os.path.join(
+                agents_dir, agent_id)
+    return cell_dirs
+
+
+def _pad_rows(array, width):
+    padded = np.full((array.shape[0], width), np.nan)
+    padded[:, :array.shape[1]] = array
+    return padded
+
+
+def _get_present(reader, rows):
+    """Get a dictionary from column name to a mask of the rows (of the
+    selected rows) in which it was emitted, or None if it always was."""
+    if MISSING_COLUMN not in reader.columnNames():
+        return {}
+    missing = reader.readColumn(MISSING_COLUMN, squeeze=False, rows=rows)
+    missing_rows, positions = np.nonzero(~np.isnan(missing))
+    if not len(missing_rows):
+        return {}
+    column_names = reader.readAttribute('column_names')
+    present = np.ones((len(missing), len(column_names)), dtype=bool)
+    present[missing_rows, missing[missing_rows, positions].astype(int)] = False
+    return {name: present[:, i] for i, name in enumerate(column_names)
+        if not present[:, i].all()}
+
+
+def read_columns(cell_dir, query=None, time_range=None):
+    """Read all tables of a cell.
+
+    Args:
+        cell_dir: Directory of a cell (see :py:func:`get_cell_dirs`)
+        query: List of paths to read (relative to the cell). All columns
+            with a path that starts with one of these paths are read.
+        time_range: Tuple of the first and last time to read (None for
+            all times). Only the blocks of each column with these times
+            are read from disk.
+
+    Returns:
+        Dictionary from column path (``('time',)`` for the sorted emit
+        times) to an array with a row per time. Rows in which a column was
+        not emitted and missing elements of variable-length columns are
+        NaN.
+    """
+    return _read_columns(cell_dir, query, time_range)[0]
+
+
+def _read_columns(cell_dir, query=None, time_range=None):
+    """Read all tables of a cell (see :py:func:`read_columns`).
+
+    Returns:
+        The columns and a dictionary from column path to a mask of the
+        times at which the column was emitted
+    """
+    tables = []
+    for table_dir in get_table_dirs(cell_dir):
+        reader = TableReader(table_dir)
+        if TIME_COLUMN not in reader.columnNames():
+            continue
+        times = reader.readColumn(TIME_COLUMN, squeeze=False)
+        rows = None
+        if time_range is not None:
+            # Rows of a table are in time order
+            rows = slice(
+                np.searchsorted(times[:, 0], time_range[0], side='left'),
+                np.searchsorted(times[:, 0], time_range[1], side='right'))
+            if rows.start == rows.stop:
+                continue
+            times = times[rows]
+        columns = {(TIME_COLUMN,): times}
+        present = _get_present(reader, rows)
+        shapes = reader.readAttribute('shapes')
+        for name, path in reader.readAttribute('paths').items():
+            path = tuple(path)
+            if query and not any(
+                path[:len(query_path)] == tuple(query_path)
+                for query_path in query
+            ):
+                continue
+            column = reader.readColumn(name, squeeze=False, rows=rows)
+            shape = shapes.get(name)
+            if shape is not None and len(shape) > 1:
+                column = column.reshape(-1, *shape)
+            columns[path] = (column, present.get(name))
+        tables.append(columns)
+
+    if not tables:
+        return {}, {}
+    # Rows of all tables by time (other emitters can write tables for the
+    # same cell at the same times)
+    times, rows = np.unique(np.concatenate(
+        [columns[(TIME_COLUMN,)][:, 0] for columns in tables]),
+        return_inverse=True)
+    table_rows = np.split(rows, np.cumsum(
+        [len(columns[(TIME_COLUMN,)]) for columns in tables])[:-1])
+    paths = list(dict.fromkeys(path for columns in tables for path in columns))
+    result = {(TIME_COLUMN,): times}
+    result_present = {}
+    for path in paths[1:]:
+        arrays = []
+        for columns, table_row in zip(tables, table_rows):
+            if path in columns:
+                array, present = columns[path]
+                if present is not None:
+                    array, table_row = array[present], table_row[present]
+                arrays.append((array, table_row))
+        shape = arrays[0][0].shape[1:]
+        if any(array.shape[1:] != shape for array, _ in arrays):
+            shape = (max(array[0].size for array, _ in arrays),)
+            arrays = [(_pad_rows(array.reshape(len(array), -1), shape[0]),
+                table_row) for array, table_row in arrays]
+        if sum(len(table_row) for _, table_row in arrays) == len(times):
+            column = np.empty((len(times),) + shape,
+                np.result_type(*(array for array, _ in arrays)))
+        else:
+            column = np.full((len(times),) + shape, np.nan)
+        for array, table_row in arrays:
+            column[table_row] = array
+        if shape == (1,):
+            column = column[:, 0]
+        result[path] = column
+        result_present[path] = np.zeros(len(times), dtype=bool)
+        for _, table_row in arrays:
+            result_present[path][table_row] = True
+    return result, result_present
+
+
+def get_bulk_ids(cell_dir):
+    """Get the IDs of the bulk molecules whose counts a cell's tables
+    contain."""
+    for table_dir in get_table_dirs(cell_dir):
+        reader = TableReader(table_dir)
+        if 'bulk_ids' in reader.attributeNames():
+            return reader.readAttribute('bulk_ids')
+    return None
+
+
+def read_data(experiment_dir, query=None):
+    """Read the tables of an experiment as :term:`raw data`.
+
+    Args:
+        experiment_dir: Output directory of an experiment
+            (``<out_dir>/<experiment_id>``)
+        query: List of paths to read (from the root of the simulation
+            state, like the queries of the other emitters)
+
+    Returns:
+        Dictionary from time to emitted data. Bulk molecules are given as
+        a list of counts.
+    """
+    data = {}
+    for cell_path, cell_dir in get_cell_dirs(experiment_dir).items():
+        cell_query = None
+        if query:
+            cell_query = []
+            for path in query:
+                path = tuple(path)
+                if path[:len(cell_path)] == cell_path:
+                    cell_query.append(path[len(cell_path):] or ())
+                elif cell_path[:len(path)] == path:
+                    cell_query.append(())
+            if not cell_query:
+                continue
+        columns, present = _read_columns(cell_dir, cell_query)
+        if not columns:
+            continue
+        times = columns.pop((TIME_COLUMN,))
+        for i, time in enumerate(times.tolist()):
+            data_at_time = data.setdefault(time, {})
+            for path, array in columns.items():
+                if not present[path][i]:
+                    continue
+                value = array[i]
+                if value.dtype.kind == 'f' and value.ndim == 1:
+                    # Remove padding of variable-length columns
+                    valid = np.flatnonzero(~np.isnan(value))
+                    value = value[:valid[-1] + 1 if len(valid) else 0]
+                assoc_path(data_at_time, cell_path + path, value.tolist())
+    return dict(sorted(data.items()))
+
+
+def test_table_emitter():
+    import tempfile
+
+    bulk = np.array([('A[c]', 1), ('B[c]', 2)],
+        dtype=[('id', '<U10'), ('count', '<i8')])
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        emitter = TableEmitter({'experiment_id': 'test', 'out_dir': tmp_dir})
+        inner_emitter = TableEmitter({'experiment_id': 'test',
+            'out_dir': tmp_dir, 'embed_path': ('agents', '0'),
+            'compression': 'none', 'compression_threads': 2})
+        for time in range(4):
+            emitter.emit({'table': 'history', 'data': {
+                'time': float(time),
+                'fields': {'GLC': np.full((2, 2), time)},
+                'agents': {'0': {'boundary': {'volume': 1.0}}},
+            }})
+            # Listener defaults are replaced after the first time step
+            inner_emitter.emit({'table': 'history', 'data': {
+                'time': float(time),
+                'bulk': bulk,
+                'listeners': {
+                    'mass': {'dry_mass': 300.0 + time, 'media_id': 'x'},
+                    'fba_results': {
+                        'reaction_fluxes': np.arange(3) if time else [],
+                        'variable': np.arange(time),
+                    },
+                },
+            }})
+            bulk['count'] += 1
+        emitter.close()
+        inner_emitter.close()
+
+        experiment_dir = os.path.join(tmp_dir, 'test')
+        cell_dir = os.path.join(experiment_dir, 'agents', '0')
+        assert get_bulk_ids(cell_dir) == ['A[c]', 'B[c]']
+        columns = read_columns(cell_dir, [('listeners',), ('bulk',)])
+        np.testing.assert_array_equal(columns[('time',)], np.arange(4))
+        np.testing.assert_array_equal(columns[('bulk',)][:, 0], [1, 2, 3, 4])
+        np.testing.assert_array_equal(
+            columns[('listeners', 'mass', 'dry_mass')], 300 + np.arange(4))
+        assert ('listeners', 'mass', 'media_id') not in columns
+        assert np.isnan(columns[(
+            'listeners', 'fba_results', 'reaction_fluxes')][0]).all()
+        window = read_columns(cell_dir, [('bulk',)], time_range=(1, 2))
+        np.testing.assert_array_equal(window[('time',)], [1, 2])
+        np.testing.assert_array_equal(window[('bulk',)][:, 1], [3, 4])
+
+        data = read_data(experiment_dir)
+        assert list(data) == [0.0, 1.0, 2.0, 3.0]
+        agent_data = data[3.0]['agents']['0']
+        assert agent_data['boundary'] == {'volume': 1.0}
+        assert agent_data['listeners']['fba_results'] == {
+            'reaction_fluxes': [0, 1, 2], 'variable': [0.0, 1.0, 2.0]}
+        assert data[2.0]['fields']['GLC'] == [[2, 2], [2, 2]]
+        assert list(read_data(experiment_dir,
+            [('agents', '0', 'bulk')])[1.0]['agents']['0']) == ['bulk']
+
+
+def test_table_emitter_bulk_deltas():
+    import tempfile
+    from ecoli.library.bulk_encoding import encode_bulk_deltas
+
+    counts = np.random.RandomState(0).randint(0, 5, size=(20, 6))
+    # No counts change between some emits
+    counts[5:8] = counts[4]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        emitter = encode_bulk_deltas(TableEmitter({
+            'experiment_id': 'test', 'out_dir': tmp_dir}), 5)
+        for time, row in enumerate(counts):
+            emitter.emit({'table': 'history', 'data': {
+                'time': float(time),
+                'agents': {'0': {'bulk': row,
+                    'listeners': {'mass': {'dry_mass': float(time)}}}},
+            }})
+        cell_dir = os.path.join(tmp_dir, 'test', 'agents', '0')
+        data = emitter.get_data()
+        # Keyframes and deltas (even empty ones) share one table after
+        # the first delta
+        assert len(get_table_dirs(cell_dir)) == 2
+        assert list(data) == [float(time) for time in range(20)]
+        np.testing.assert_array_equal(
+            [data[time]['agents']['0']['bulk'] for time in data], counts)
+        columns = read_columns(cell_dir)
+        assert set(columns) == {('time',), ('bulk',), BULK_DELTA_PATHS[0],
+            BULK_DELTA_PATHS[1], ('listeners', 'mass', 'dry_mass')}
+        np.testing.assert_array_equal(
+            np.isnan(columns[('bulk',)][:, 0]), np.arange(20) % 5 != 0)
+        raw_data = read_data(os.path.join(tmp_dir, 'test'))
+        assert raw_data[6.0]['agents']['0']['bulk'] == {
+            DELTA_INDEXES: [], DELTA_VALUES: []}
+
+
+def test_table_emitter_schedule():
+    import tempfile
+    from ecoli.library.bulk_encoding import encode_bulk_deltas
+    from ecoli.library.emit_schedule import schedule_emitter
+
+    counts = np.random.RandomState(1).randint(0, 5, size=(120, 6))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        emitter = schedule_emitter(encode_bulk_deltas(TableEmitter({
+            'experiment_id': 'test', 'out_dir': tmp_dir}), 5),
+            {'bulk': 3, 'listeners/mass': 2, 'listeners/rnap': 5})
+        for time, row in enumerate(counts):
+            emitter.emit({'table': 'history', 'data': {
+                'time': float(time),
+                'agents': {'0': {'bulk': row, 'listeners': {
+                    'mass': {'dry_mass': float(time)},
+                    'rnap': {'active': np.arange(3) + time},
+                    'ribosome': {'active': time},
+                }}},
+            }})
+        cell_dir = os.path.join(tmp_dir, 'test', 'agents', '0')
+        data = emitter.get_data()
+        assert len(get_table_dirs(cell_dir)) == 2
+        assert list(data) == [float(time) for time in range(120)]
+        agents = [data[float(time)]['agents']['0'] for time in range(120)]
+        bulk_times = [time for time, agent in enumerate(agents)
+            if 'bulk' in agent]
+        assert bulk_times == list(range(0, 120, 3))
+        np.testing.assert_array_equal(
+            [agents[time]['bulk'] for time in bulk_times], counts[::3])
+        assert [time for time, agent in enumerate(agents)
+            if 'mass' in agent['listeners']] == list(range(0, 120, 2))
+        assert agents[5]['listeners']['rnap'] == {'active': [5, 6, 7]}
+        assert 'rnap' not in agents[6]['listeners']
+        assert all(agent['listeners']['ribosome'] == {'active': time}
+            for time, agent in enumerate(agents))
+
+        columns = read_columns(cell_dir, [('listeners', 'rnap')])
+        assert np.isnan(columns[('listeners', 'rnap', 'active')][1]).all()
+        np.testing.assert_array_equal(
+            columns[('listeners', 'rnap', 'active')][10], [10, 11, 12])
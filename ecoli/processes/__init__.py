@@ -18,6 +18,7 @@ from ecoli.processes.stubs.exchange_stub import Exchange
 from ecoli.processes.listeners.mass_listener import MassListener
 from ecoli.processes.listeners.mRNA_counts import mRNACounts
 from ecoli.processes.listeners.monomer_counts import MonomerCounts
+from ecoli.processes.listeners.unique_array_stats import UniqueArrayStats
 from ecoli.processes.chromosome_structure import ChromosomeStructure
 from ecoli.processes.allocator import Allocator
 from ecoli.processes.environment.lysis import Lysis
@@ -66,6 +67,7 @@ process_registry.register(MassListener.name, MassListener)
 process_registry.register(Exchange.name, Exchange)
 process_registry.register(mRNACounts.name, mRNACounts)
 process_registry.register(MonomerCounts.name, MonomerCounts)
+process_registry.register(UniqueArrayStats.name, UniqueArrayStats)
 process_registry.register(ChromosomeStructure.name, ChromosomeStructure)
 process_registry.register(Allocator.name, Allocator)
 process_registry.register(Shape.name, Shape)
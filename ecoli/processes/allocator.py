@@ -5,9 +5,18 @@ Allocator
 
 Reads requests from PartionedProcesses, and allocates molecules according to
 process priorities.
+
+Requests and allocations are both sparse: each process requests a list of
+``(bulk indices, counts)`` tuples and is allocated a single ``(sorted bulk
+indices, counts)`` tuple covering only the molecules it requested (read with
+:py:func:`ecoli.library.schema.counts`).
 """
+import json
+import time
+
 import numpy as np
 from vivarium.core.process import Deriver
+from vivarium.core.control import run_library_cli
 
 from ecoli.processes.registries import topology_registry
 from ecoli.library.schema import (counts, numpy_schema, bulk_name_to_idx,
@@ -100,21 +109,41 @@ class Allocator(Deriver):
             self.molecule_idx = bulk_name_to_idx(self.moleculeNames,
                 states['bulk']['id'])
             self.atp_idx = bulk_name_to_idx('ATP[c]', states['bulk']['id'])
-        total_counts = counts(states['bulk'], self.molecule_idx)
-        original_totals = total_counts.copy()
-        counts_requested = np.zeros((self.n_molecules, self.n_processes),
-            dtype=int)
+
+        # Requests are lists of (indices, counts) tuples. Only partition
+        # the molecules that were requested by at least one process.
+        request_idx = []
+        request_counts = []
+        request_procs = []
         for process in states['request']:
             proc_idx = self.proc_name_to_idx[process]
             for req_idx, req in states['request'][process]['bulk']:
-                counts_requested[req_idx, proc_idx] = req
+                req_idx, req = np.broadcast_arrays(req_idx, req)
+                request_idx.append(req_idx.ravel())
+                request_counts.append(req.ravel())
+                request_procs.append(np.full(req_idx.size, proc_idx))
+        if request_idx:
+            requested_molecules, request_rows = np.unique(
+                np.concatenate(request_idx), return_inverse=True)
+            request_procs = np.concatenate(request_procs)
+            request_counts = np.concatenate(request_counts)
+        else:
+            requested_molecules = np.zeros(0, dtype=int)
+            request_rows = request_procs = request_counts = requested_molecules
+        # Later requests for the same molecule replace earlier ones
+        counts_requested = np.zeros(
+            (len(requested_molecules), self.n_processes), dtype=int)
+        counts_requested[request_rows, request_procs] = request_counts
+        total_counts = counts(states['bulk'],
+            self.molecule_idx[requested_molecules])
+        original_totals = total_counts.copy()
 
         if ASSERT_POSITIVE_COUNTS and np.any(counts_requested < 0):
             raise NegativeCountsError(
                 "Negative value(s) in counts_requested:\n"
                 + "\n".join(
                     "{} in {} ({})".format(
-                        self.mol_idx_to_name[molIndex],
+                        self.mol_idx_to_name[requested_molecules[molIndex]],
                         self.proc_idx_to_name[processIndex],
                         counts_requested[molIndex, processIndex]
                         )
@@ -138,7 +167,7 @@ class Allocator(Deriver):
                     "Negative value(s) in partitioned_counts:\n"
                     + "\n".join(
                     "{} in {} ({})".format(
-                        self.mol_idx_to_name[molIndex],
+                        self.mol_idx_to_name[requested_molecules[molIndex]],
                         self.proc_idx_to_name[processIndex],
                         counts_requested[molIndex, processIndex]
                         )
@@ -156,29 +185,42 @@ class Allocator(Deriver):
                     "Negative value(s) in counts_unallocated:\n"
                     + "\n".join(
                     "{} ({})".format(
-                        self.mol_idx_to_name[molIndex],
+                        self.mol_idx_to_name[requested_molecules[molIndex]],
                         counts_unallocated[molIndex]
                         )
                     for molIndex in np.where(counts_unallocated < 0)[0]
                     )
                 )
 
+        # Each process is only sent counts for the molecules it requested
+        allocations = {}
+        for process in states['request']:
+            proc_idx = self.proc_name_to_idx[process]
+            proc_rows = np.unique(request_rows[request_procs == proc_idx])
+            allocations[process] = {
+                'bulk': (requested_molecules[proc_rows],
+                    partitioned_counts[proc_rows, proc_idx])}
+
+        atp_row = np.searchsorted(requested_molecules, self.atp_idx)
+        if (atp_row < len(requested_molecules)
+            and requested_molecules[atp_row] == self.atp_idx
+        ):
+            atp_requested = counts_requested[atp_row, :]
+            atp_allocated = partitioned_counts[atp_row, :]
+        else:
+            atp_requested = np.zeros(self.n_processes, dtype=int)
+            atp_allocated = np.zeros(self.n_processes, dtype=int)
 
         update = {
             'request': {
                 process: {
                     'bulk': []}
                 for process in states['request']},
-            'allocate': {
-                process: {
-                    'bulk': partitioned_counts[
-                        :, self.proc_name_to_idx[process]]}
-                for process in states['request']
-            },
+            'allocate': allocations,
             'evolvers_ran': False,
             'listeners': {
-                'atp_requested': counts_requested[self.atp_idx, :],
-                'atp_allocated_initial': partitioned_counts[self.atp_idx, :]
+                'atp_requested': atp_requested,
+                'atp_allocated_initial': atp_allocated
             }
         }
 
@@ -222,17 +264,261 @@ def calculatePartition(process_priorities, counts_requested, total_counts,
         # Distribute fractional counts to ensure full allocation of excess
         # request molecules
         remainders = fractional_requests % 1
-        options = np.arange(remainders.shape[1])
-        for idx, remainder in enumerate(remainders):
-            total_remainder = remainder.sum()
-            count = int(np.round(total_remainder))
-            if count > 0:
-                allocated_indices = random_state.choice(options, size=count,
-                    p=remainder/total_remainder, replace=False)
-                fractional_requests[idx, allocated_indices] += 1
+        fractional_requests += distribute_remainders(remainders, random_state)
         requests[excess_request_mask, :] = fractional_requests
 
         allocations = requests.astype(np.int64)
         partitioned_counts[:, processHasPriority] = allocations
         total_counts -= allocations.sum(axis=1)
     return partitioned_counts
+
+
+def distribute_remainders(remainders, random_state):
+    """Randomly picks ``round(row.sum())`` columns of each row of fractional
+    remainders (without replacement, weighted by the remainders) to receive
+    one extra molecule.
+
+    Gives exactly the same result and leaves ``random_state`` in exactly the
+    same state as calling ``random_state.choice(n_columns, size=count,
+    p=row/row.sum(), replace=False)`` for each row in order, but draws the
+    random numbers for all rows at once and resolves them in a single
+    vectorized pass. Only rows where the same column is drawn more than once
+    need to be redrawn like :py:meth:`numpy.random.RandomState.choice` does.
+
+    Args:
+        remainders: 2D array of fractional remainders (rows are molecules,
+            columns are processes)
+        random_state: :py:class:`numpy.random.RandomState` to draw from
+
+    Returns:
+        Integer array with the same shape as ``remainders`` that is 1 for
+        every chosen (row, column) pair and 0 elsewhere
+    """
+    n_options = remainders.shape[1]
+    extra_counts = np.zeros(remainders.shape, dtype=np.int64)
+    total_remainders = remainders.sum(axis=1)
+    n_draws = np.round(total_remainders).astype(np.int64)
+    rows = np.nonzero(n_draws > 0)[0]
+    if rows.size == 0:
+        return extra_counts
+    n_draws = n_draws[rows]
+    probabilities = remainders[rows] / total_remainders[rows, np.newaxis]
+    cdfs = np.cumsum(probabilities, axis=1)
+    cdfs /= cdfs[:, -1:]
+
+    # Each row uses at least as many uniform draws as molecules to allocate
+    draws = random_state.random_sample(n_draws.sum())
+    position = 0
+    start = 0
+    while start < rows.size:
+        row_draws = n_draws[start:]
+        draw_rows = np.repeat(np.arange(start, rows.size), row_draws)
+        x = draws[position:position + row_draws.sum()]
+        # Same as cdf.searchsorted(x, side='right') for each row
+        chosen = np.count_nonzero(cdfs[draw_rows] <= x[:, np.newaxis],
+            axis=1)
+        flat_chosen = np.sort(draw_rows * n_options + chosen)
+        repeated = flat_chosen[1:][flat_chosen[1:] == flat_chosen[:-1]]
+        if repeated.size == 0:
+            extra_counts[rows[draw_rows], chosen] = 1
+            break
+
+        # Accept all rows before the first row with a repeated choice
+        collision = repeated[0] // n_options
+        accepted = draw_rows < collision
+        extra_counts[rows[draw_rows[accepted]], chosen[accepted]] = 1
+        position += n_draws[start:collision].sum()
+
+        # Keep drawing for the remaining choices of that row until all
+        # are unique, with chosen columns excluded from later draws
+        p = probabilities[collision].copy()
+        size = n_draws[collision]
+        found = np.zeros(0, dtype=np.int64)
+        while found.size < size:
+            n_new = size - found.size
+            if position + n_new > draws.size:
+                draws = np.concatenate((draws, random_state.random_sample(
+                    position + n_new - draws.size)))
+            x = draws[position:position + n_new]
+            position += n_new
+            if found.size > 0:
+                p[found] = 0
+            cdf = np.cumsum(p)
+            cdf /= cdf[-1]
+            new = cdf.searchsorted(x, side='right')
+            _, unique_indices = np.unique(new, return_index=True)
+            unique_indices.sort()
+            found = np.concatenate((found, new.take(unique_indices)))
+        extra_counts[rows[collision], found] = 1
+
+        # Redrawing may have consumed draws meant for the remaining rows
+        start = collision + 1
+        n_remaining = n_draws[start:].sum()
+        if position + n_remaining > draws.size:
+            draws = np.concatenate((draws, random_state.random_sample(
+                position + n_remaining - draws.size)))
+    return extra_counts
+
+
+def _choice_by_row(remainders, random_state):
+    # Original per-row implementation used to check distribute_remainders
+    extra_counts = np.zeros(remainders.shape, dtype=np.int64)
+    options = np.arange(remainders.shape[1])
+    for idx, remainder in enumerate(remainders):
+        total_remainder = remainder.sum()
+        count = int(np.round(total_remainder))
+        if count > 0:
+            allocated_indices = random_state.choice(options, size=count,
+                p=remainder/total_remainder, replace=False)
+            extra_counts[idx, allocated_indices] += 1
+    return extra_counts
+
+
+def load_migration_requests(init_time=0):
+    """Load a request matrix and the available counts (reconstructed as the
+    sum of all allocations) that were saved from a wcEcoli simulation with
+    the default processes."""
+    with open(f'data/migration/bulk_requested_t{init_time}.json', 'r') as f:
+        requested = json.load(f)
+    with open(f'data/migration/bulk_partitioned_t{init_time}.json', 'r') as f:
+        partitioned = json.load(f)
+    process_names = sorted(set(requested) & set(partitioned))
+    counts_requested = np.array([requested[process]
+        for process in process_names], dtype=np.int64).T
+    total_counts = np.array([partitioned[process]
+        for process in process_names], dtype=np.int64).T.sum(axis=1)
+    return process_names, counts_requested, total_counts
+
+
+def test_distribute_remainders():
+    for seed in range(20):
+        random_state = np.random.RandomState(seed)
+        remainders = random_state.rand(500, 8)
+        # Include rows with few nonzero remainders (frequent collisions)
+        remainders[random_state.rand(*remainders.shape) < 0.5] = 0
+        remainders[::7] = 0
+        expected_state = np.random.RandomState(seed + 100)
+        actual_state = np.random.RandomState(seed + 100)
+        expected = _choice_by_row(remainders, expected_state)
+        actual = distribute_remainders(remainders, actual_state)
+        np.testing.assert_array_equal(actual, expected)
+        # Random states must stay in sync for the rest of the simulation
+        assert expected_state.rand() == actual_state.rand()
+
+
+def test_calculate_partition():
+    _, counts_requested, total_counts = load_migration_requests(2104)
+    # Skip molecules like water whose requests times counts overflow int64
+    small = counts_requested.max(axis=1) < 2**31
+    counts_requested = counts_requested[small]
+    # Make many molecules over-requested
+    total_counts = total_counts[small] // 3
+    priorities = np.zeros(counts_requested.shape[1])
+    priorities[:2] = 10
+    priorities[-1] = -5
+    for seed in range(3):
+        partitioned = calculatePartition(priorities, counts_requested,
+            total_counts.copy(), np.random.RandomState(seed))
+        assert np.all(partitioned >= 0)
+        assert np.all(partitioned <= counts_requested)
+        assert np.all(partitioned.sum(axis=1) <= total_counts)
+        # Over-requested molecules are fully allocated
+        over_requested = counts_requested.sum(axis=1) > total_counts
+        np.testing.assert_array_equal(
+            partitioned[over_requested].sum(axis=1),
+            total_counts[over_requested])
+
+
+def test_allocator_sparse():
+    names = ['A[c]', 'ATP[c]', 'B[c]', 'C[c]', 'D[c]']
+    bulk = np.zeros(len(names), dtype=[('id', 'U10'), ('count', int)])
+    bulk['id'] = names
+    bulk['count'] = [10, 5, 3, 100, 7]
+    process_names = ['p1', 'p2', 'p3']
+    requests = {
+        'p1': [(np.array([0, 1]), np.array([8, 4])), (3, 2)],
+        'p2': [(np.array([0, 1, 2]), 3)],
+        # Later requests for the same molecule replace earlier ones
+        'p3': [(np.array([2]), np.array([9])), (np.array([2]), 1)],
+    }
+    # Dense request matrix over all molecules
+    counts_requested = np.zeros((len(names), len(process_names)), dtype=int)
+    counts_requested[[0, 1, 3], 0] = [8, 4, 2]
+    counts_requested[[0, 1, 2], 1] = 3
+    counts_requested[2, 2] = 1
+
+    for seed in range(5):
+        allocator = Allocator({'molecule_names': names,
+            'process_names': process_names,
+            'custom_priorities': {'p3': 10}, 'seed': seed})
+        update = allocator.next_update(1, {'bulk': bulk,
+            'request': {process: {'bulk': request}
+                for process, request in requests.items()},
+            'evolvers_ran': True})
+        # Only the union of requested rows is partitioned (D is never
+        # requested), which gives the same result as the dense partition
+        requested = np.array([0, 1, 2, 3])
+        expected = calculatePartition(allocator.processPriorities,
+            counts_requested[requested], bulk['count'][requested],
+            np.random.RandomState(seed))
+        expected_idx = {'p1': [0, 1, 3], 'p2': [0, 1, 2], 'p3': [2]}
+        for proc_idx, process in enumerate(process_names):
+            allocated_idx, allocated = update['allocate'][process]['bulk']
+            assert allocated_idx.tolist() == expected_idx[process]
+            np.testing.assert_array_equal(allocated,
+                expected[allocated_idx, proc_idx])
+            np.testing.assert_array_equal(
+                counts(update['allocate'][process]['bulk'], np.arange(5)),
+                np.append(expected[:, proc_idx], 0))
+        # ATP row is found in the requested molecules
+        np.testing.assert_array_equal(
+            update['listeners']['atp_requested'], [4, 3, 0])
+        np.testing.assert_array_equal(
+            update['listeners']['atp_allocated_initial'], expected[1])
+
+    # No requests for ATP (or anything else)
+    update = allocator.next_update(1, {'bulk': bulk,
+        'request': {process: {'bulk': []} for process in process_names},
+        'evolvers_ran': True})
+    assert update['listeners']['atp_requested'].tolist() == [0, 0, 0]
+    assert update['allocate']['p1']['bulk'][0].size == 0
+
+
+def benchmark_distribute_remainders(n_repeats=20):
+    """Compare vectorized and per-row remainder distribution on requests
+    from the default processes, with fewer counts available so that a
+    large number of molecules is over-requested."""
+    for init_time in (0, 2104):
+        _, counts_requested, total_counts = load_migration_requests(init_time)
+        for fraction in (1, 0.5, 0.1):
+            available = (total_counts * fraction).astype(np.int64)
+            total_requested = counts_requested.sum(axis=1)
+            excess = (total_requested > available) & (total_requested > 0)
+            remainders = (counts_requested[excess] * available[
+                excess, np.newaxis] / total_requested[
+                excess, np.newaxis]) % 1
+            timings = {}
+            for name, func in (('per-row', _choice_by_row),
+                    ('vectorized', distribute_remainders)):
+                random_state = np.random.RandomState(0)
+                start = time.perf_counter()
+                for _ in range(n_repeats):
+                    func(remainders, random_state)
+                timings[name] = (time.perf_counter() - start) / n_repeats
+            print(f't={init_time}, {fraction:.0%} of counts available, '
+                f'{excess.sum()} over-requested molecules: '
+                f'per-row {timings["per-row"]*1000:.2f} ms, '
+                f'vectorized {timings["vectorized"]*1000:.2f} ms')
+
+
+test_library = {
+    '0': test_distribute_remainders,
+    '1': test_calculate_partition,
+    '2': test_allocator_sparse,
+    '3': benchmark_distribute_remainders,
+}
+
+# run tests and benchmarks from the command line with:
+# python ecoli/processes/allocator.py -n [test id]
+if __name__ == '__main__':
+    run_library_cli(test_library)
@@ -12,7 +12,7 @@ from vivarium.core.process import Step
 
 from ecoli.processes.registries import topology_registry
 from ecoli.library.schema import (create_unique_indexes, listener_schema,
-    numpy_schema, attrs, bulk_name_to_idx)
+    numpy_schema, attrs, bulk_name_to_idx, unique_isin)
 from wholecell.utils.polymerize import buildSequences
 
 # Register default topology for this process, associating it with process name
@@ -193,9 +193,8 @@ class ChromosomeStructure(Step):
         origin_domain_indexes, = attrs(states['oriCs'], ['domain_index'])
         mother_domain_indexes, = attrs(states['full_chromosomes'],
             ['domain_index'])
-        (RNA_TU_indexes, transcript_lengths, RNA_RNAP_indexes,
-            RNA_unique_indexes) = attrs(states['RNAs'], ['TU_index',
-                'transcript_length', 'RNAP_index', 'unique_index'])
+        (RNA_TU_indexes, transcript_lengths, RNA_RNAP_indexes) = attrs(
+            states['RNAs'], ['TU_index', 'transcript_length', 'RNAP_index'])
         (ribosome_protein_indexes, ribosome_peptide_lengths,
             ribosome_mRNA_indexes) = attrs(states['active_ribosome'],
                 ['protein_index', 'peptide_length', 'mRNA_index'])
@@ -432,8 +431,8 @@ class ChromosomeStructure(Step):
                 'linking_number': all_new_linking_numbers}})
 
         # Get mask for RNAs that are transcribed from removed RNAPs
-        removed_RNAs_mask = np.isin(
-            RNA_RNAP_indexes, RNAP_unique_indexes[removed_RNAPs_mask])
+        removed_RNAs_mask = unique_isin(
+            RNA_RNAP_indexes, states['active_RNAPs'], removed_RNAPs_mask)
 
         # Remove RNAPs and RNAs that have collided with replisomes
         if n_total_collisions > 0:
@@ -475,10 +474,9 @@ class ChromosomeStructure(Step):
                 update['bulk'].append((self.ppi_idx, n_initiated_sequences))
 
         # Get mask for ribosomes that are bound to nonexisting mRNAs
-        remaining_RNA_unique_indexes = RNA_unique_indexes[
-            np.logical_not(removed_RNAs_mask)]
-        removed_ribosomes_mask = np.logical_not(np.isin(
-            ribosome_mRNA_indexes, remaining_RNA_unique_indexes))
+        removed_ribosomes_mask = np.logical_not(unique_isin(
+            ribosome_mRNA_indexes, states['RNAs'],
+            np.logical_not(removed_RNAs_mask)))
         n_removed_ribosomes = np.count_nonzero(removed_ribosomes_mask)
 
         # Remove ribosomes that are bound to missing RNA molecules. This
@@ -74,6 +74,9 @@ from vivarium.library.topology import get_in
 from ecoli.library.sim_data import RAND_MAX
 from ecoli.library.schema import (
     remove_properties, empty_dict_divider, not_a_process)
+from ecoli.library.bulk_encoding import encode_bulk_deltas
+from ecoli.library.emit_schedule import schedule_emitter
+from ecoli.library.step_plan import use_step_plan
 from ecoli.library.updaters import inverse_updater_registry
 from ecoli.processes.cell_division import daughter_phylogeny_id
 
@@ -153,6 +156,12 @@ class EngineProcess(Process):
         # Map from tunnel name to schema. Schemas are optional.
         'tunnel_out_schemas': {},
         'emit_paths': tuple(),
+        # Map from path in the inner simulation to emit interval in
+        # seconds (see ecoli/library/emit_schedule.py)
+        'emit_intervals': {},
+        # Number of emits from one full emit of bulk counts to the next
+        # (see ecoli/library/bulk_encoding.py)
+        'bulk_keyframe_interval': None,
         # Map from process name to a map from path in the inner
         # simulation to the schema that should be stubbed in at that
         # path. A stub process will be added with a port for each
@@ -217,6 +226,7 @@ class EngineProcess(Process):
             progress_bar=False,
             initial_global_time=self.parameters['start_time'],
         )
+        use_step_plan(self.sim)
         # Unnecessary references to initial_state
         self.sim.initial_state = None
         self.parameters['inner_composer_config'].pop('initial_state', None)
@@ -247,7 +257,10 @@ class EngineProcess(Process):
             self.emitter_config = self.parameters['inner_emitter']
         self.emitter_config['experiment_id'] = self.parameters[
             'experiment_id']
-        self.emitter = get_emitter(self.emitter_config)
+        emitter = encode_bulk_deltas(get_emitter(self.emitter_config),
+            self.parameters['bulk_keyframe_interval'])
+        self.emitter = schedule_emitter(emitter,
+            self.parameters['emit_intervals'])
 
 
     def ports_schema(self):
@@ -0,0 +1,95 @@
+"""
+===========================
+Unique Array Stats Listener
+===========================
+
+Emits the capacity, active count, occupancy and fragmentation of each
+unique molecule array (see :py:func:`ecoli.library.schema.get_unique_array_stats`)
+to tune unique array growth and compaction. Not part of the default
+processes; add it with the ``unique_array_stats`` config.
+"""
+
+from ecoli.library.schema import (
+    numpy_schema, listener_schema, get_unique_array_stats)
+from vivarium.core.process import Step
+
+from ecoli.processes.registries import topology_registry
+
+
+NAME = 'unique_array_stats_listener'
+TOPOLOGY = {
+    "listeners": ("listeners",),
+    "active_replisomes": ("unique", "active_replisome",),
+    "oriCs": ("unique", "oriC",),
+    "chromosome_domains": ("unique", "chromosome_domain",),
+    "active_RNAPs": ("unique", "active_RNAP"),
+    "RNAs": ("unique", "RNA"),
+    "active_ribosome": ("unique", "active_ribosome"),
+    "full_chromosomes": ("unique", "full_chromosome",),
+    "promoters": ("unique", "promoter"),
+    "DnaA_boxes": ("unique", "DnaA_box"),
+}
+topology_registry.register(
+    NAME, TOPOLOGY
+)
+
+
+class UniqueArrayStats(Step):
+    """
+    Listener for the occupancy and fragmentation of unique molecule arrays.
+    """
+    name = NAME
+    topology = TOPOLOGY
+
+    defaults = {
+        'unique_ports': [port for port in TOPOLOGY if port != 'listeners'],
+    }
+
+    def __init__(self, parameters=None):
+        super().__init__(parameters)
+        self.unique_ports = self.parameters['unique_ports']
+
+    def ports_schema(self):
+        return {
+            'listeners': {
+                'unique_array_stats': {
+                    port: listener_schema({
+                        'capacity': 0,
+                        'active': 0,
+                        'occupancy': 0.0,
+                        'fragmentation': 0.0})
+                    for port in self.unique_ports
+                }
+            },
+            **{port: numpy_schema(port) for port in self.unique_ports},
+        }
+
+    def next_update(self, timestep, states):
+        return {
+            'listeners': {
+                'unique_array_stats': {
+                    port: get_unique_array_stats(states[port])
+                    for port in self.unique_ports
+                }
+            }
+        }
+
+
+def test_unique_array_stats_listener():
+    import numpy as np
+
+    rnas = np.zeros(10, dtype=[('_entryState', np.int8), ('TU_index', int)])
+    rnas['_entryState'][[0, 1, 5]] = 1
+    listener = UniqueArrayStats({'unique_ports': ['RNAs', 'active_RNAPs']})
+    assert set(listener.get_schema()) == {'listeners', 'RNAs', 'active_RNAPs'}
+    update = listener.next_update(2, {
+        'RNAs': rnas, 'active_RNAPs': rnas[:0]})
+    stats = update['listeners']['unique_array_stats']
+    assert stats['RNAs'] == {'capacity': 10, 'active': 3, 'occupancy': 0.3,
+        'fragmentation': 3 / 7}
+    assert stats['active_RNAPs'] == {'capacity': 0, 'active': 0,
+        'occupancy': 0.0, 'fragmentation': 0.0}
+
+
+if __name__ == '__main__':
+    test_unique_array_stats_listener()
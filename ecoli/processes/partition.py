@@ -12,12 +12,29 @@ A PartitionedProcess can be passed into a Requester and Evolver, which call its
 calculate_request and evolve_state methods in coordination with an Allocator process,
 which reads the requests and allocates molecular counts for the evolve_state.
 
+Intermediate values that are needed by both calculate_request and evolve_state
+(e.g. polymer sequences built from unique molecule attributes) can be computed
+once per time step with PartitionedProcess.get_cached.
+
+Evolvers can optionally compute their updates on a shared thread pool (see
+get_evolver_executor and get_evolver_locks). Each PartitionedProcess has its
+own random state and the Engine applies updates in a fixed order, so results
+do not depend on the order in which the threads finish.
+
 """
 import abc
+import atexit
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+import numpy as np
 
+from vivarium.core.control import run_library_cli
 from vivarium.core.process import Step, Process
 from vivarium.library.dict_utils import deep_merge
 
+from ecoli.library.schema import BulkOverlay, counts, numpy_schema
 from ecoli.processes.registries import topology_registry
 
 def filter_bulk_ports(schema, update=None):
@@ -72,6 +89,121 @@ def filter_bulk_topology(topology):
     return filtered
 
 
+# Stores that Evolvers can safely read concurrently. Bulk and unique molecule
+# arrays are read-only outside of their updaters and the others are only ever
+# replaced by updates, which the Engine applies after all Evolvers have run.
+THREAD_SAFE_STORES = (
+    ('bulk',),
+    ('unique',),
+    ('listeners',),
+    ('environment',),
+    ('evolvers_ran',),
+)
+
+# Thread pools shared by all cells, keyed by number of threads
+_EVOLVER_EXECUTORS = {}
+
+
+def get_evolver_executor(n_threads):
+    """Get a thread pool with ``n_threads`` threads to run Evolvers on.
+
+    The same pool is returned for every cell (e.g. after division) so that
+    the number of threads does not grow with the number of cells.
+    """
+    if n_threads not in _EVOLVER_EXECUTORS:
+        _EVOLVER_EXECUTORS[n_threads] = ThreadPoolExecutor(
+            max_workers=n_threads, thread_name_prefix='evolver')
+    return _EVOLVER_EXECUTORS[n_threads]
+
+
+@atexit.register
+def shutdown_evolver_executors():
+    """Shut down the thread pools of :py:func:`get_evolver_executor` (the
+    next call creates a new pool). Called at exit."""
+    while _EVOLVER_EXECUTORS:
+        _, executor = _EVOLVER_EXECUTORS.popitem()
+        executor.shutdown()
+
+
+def get_store_paths(topology, prefix=()):
+    """Get the absolute paths of all stores wired into a topology.
+
+    Args:
+        topology: Topology of a single process (port: path)
+        prefix: Path that relative paths in ``topology`` start from
+
+    Returns:
+        Set of store paths (tuples)
+    """
+    paths = set()
+    for port, path in topology.items():
+        if port == '_path':
+            continue
+        if isinstance(path, dict):
+            sub_prefix = prefix + (port,)
+            if '_path' in path:
+                sub_prefix = resolve_path(prefix, path['_path'])
+                paths.add(sub_prefix)
+            paths |= get_store_paths(path, sub_prefix)
+        else:
+            paths.add(resolve_path(prefix, path))
+    return paths
+
+
+def resolve_path(prefix, path):
+    resolved = list(prefix)
+    for step in path:
+        if step == '..':
+            resolved.pop()
+        else:
+            resolved.append(step)
+    return tuple(resolved)
+
+
+def get_evolver_locks(topologies, thread_safe_stores=THREAD_SAFE_STORES):
+    """Find Evolvers that cannot compute their updates at the same time.
+
+    Two Evolvers conflict if they are wired to overlapping stores that are
+    not in ``thread_safe_stores`` (e.g. a store holding a Python object that
+    both may modify in place). Each such store gets a lock that is held by
+    an Evolver while it computes its update.
+
+    Args:
+        topologies: Mapping of Evolver names to their topologies
+        thread_safe_stores: Store paths (and their children) that any number
+            of Evolvers can access at once
+
+    Returns:
+        Dictionary mapping Evolver names to the list of locks that they must
+        acquire, sorted the same way for every Evolver to avoid deadlocks
+    """
+    def thread_safe(path):
+        return any(path[:len(safe)] == safe for safe in thread_safe_stores)
+
+    paths = {
+        name: {path for path in get_store_paths(topology)
+            if not thread_safe(path)}
+        for name, topology in topologies.items()
+    }
+    shared = {}
+    names = list(topologies)
+    for i, name in enumerate(names):
+        for other in names[i + 1:]:
+            for path in paths[name]:
+                for other_path in paths[other]:
+                    # Overlapping if one path is a prefix of the other
+                    n = min(len(path), len(other_path))
+                    if path[:n] == other_path[:n]:
+                        shared.setdefault(path[:n], set()).update(
+                            (name, other))
+    locks = {name: [] for name in names}
+    for path in sorted(shared):
+        lock = threading.Lock()
+        for name in sorted(shared[path]):
+            locks[name].append(lock)
+    return locks
+
+
 class Requester(Step):
     """ Requester Step
 
@@ -103,6 +235,7 @@ class Requester(Step):
 
     def next_update(self, timestep, states):
         process = states['process'][0]
+        process.step_cache.clear()
         request = process.calculate_request(
             self.parameters['time_step'], states)
         process.request_set = True
@@ -126,15 +259,50 @@ class Evolver(Process):
     """ Evolver Process
 
     Accepts a PartitionedProcess as an input, and runs in coordination with an
-    Requester that uses the same PartitionedProcess.
+    Requester that uses the same PartitionedProcess. If ``queue_bulk`` is
+    True, bulk updates are queued so that the updates of all Evolvers can be
+    applied in a single pass (see
+    :py:class:`ecoli.library.schema.BulkNumpyUpdater`). If an ``executor``
+    is given, updates are computed on it while holding ``locks`` (see
+    :py:func:`get_evolver_locks`) so that Evolvers run concurrently.
     """
-    defaults = {'process': None}
+    defaults = {'process': None, 'queue_bulk': False}
 
     def __init__(self, parameters=None):
         assert isinstance(parameters["process"], PartitionedProcess)
         parameters['name'] = f'{parameters["process"].name}_evolver'
+        # Do not keep these in parameters (not serializable)
+        self.executor = parameters.pop('executor', None)
+        self.locks = parameters.pop('locks', [])
+        self._future = None
         super().__init__(parameters)
 
+    def send_command(self, command, args=None, kwargs=None,
+        run_pre_check=True
+    ):
+        if command != 'next_update' or self.executor is None:
+            return super().send_command(command, args, kwargs, run_pre_check)
+        if run_pre_check:
+            self.pre_send_command(command, args, kwargs)
+        self._future = self.executor.submit(
+            self._locked_next_update, *(args or ()), **(kwargs or {}))
+
+    def get_command_result(self):
+        if self._future is None:
+            return super().get_command_result()
+        self._pending_command = None
+        future, self._future = self._future, None
+        return future.result()
+
+    def _locked_next_update(self, timestep, states):
+        for lock in self.locks:
+            lock.acquire()
+        try:
+            return self.next_update(timestep, states)
+        finally:
+            for lock in reversed(self.locks):
+                lock.release()
+
     def ports_schema(self):
         ports = self.parameters.pop('process').get_schema()
         ports['allocate'] = filter_bulk_ports(ports,
@@ -184,6 +352,11 @@ class Evolver(Process):
             return {}
 
         update = process.evolve_state(timestep, states)
+        process.step_cache.clear()
+        if self.parameters['queue_bulk']:
+            for port in allocations:
+                if isinstance(update.get(port), list):
+                    update[port] = {'queue': update[port]}
         update['process'] = (process,)
         update['evolvers_ran'] = True
         return update
@@ -202,6 +375,8 @@ class PartitionedProcess(Process):
         self.evolve_only = self.parameters.get('evolve_only', False)
         self.request_only = self.parameters.get('request_only', False)
         self.request_set = False
+        # Values shared by calculate_request and evolve_state in a time step
+        self.step_cache = {}
 
         # register topology
         assert self.name
@@ -220,21 +395,279 @@ class PartitionedProcess(Process):
     def evolve_state(self, timestep, states):
         return {}
 
+    def get_cached(self, key, inputs, compute):
+        """Get a value computed in the same time step or compute it.
+
+        Values computed in calculate_request can be reused in evolve_state
+        as long as the inputs they were computed from (e.g. unique molecule
+        attributes) have not changed between the two. The inputs are copied
+        and compared element by element, which is linear in their size
+        but takes a small fraction of the time to build sequence matrices
+        from them (see :py:func:`benchmark_get_cached`).
+
+        Args:
+            key: Name of the cached value
+            inputs: List of arrays that the value is computed from
+            compute: Function with no arguments that computes the value
+
+        Returns:
+            Cached value if ``inputs`` are equal to the inputs it was computed
+            from, otherwise the (newly cached) return value of ``compute``.
+        """
+        cached = self.step_cache.get(key)
+        if cached is not None:
+            cached_inputs, value = cached
+            if len(cached_inputs) == len(inputs) and all(
+                np.array_equal(cached_input, new_input)
+                for cached_input, new_input in zip(cached_inputs, inputs)
+            ):
+                return value
+        value = compute()
+        self.step_cache[key] = ([np.array(i) for i in inputs], value)
+        return value
+
     def next_update(self, timestep, states):
         if self.request_only:
             return self.calculate_request(timestep, states)
         if self.evolve_only:
             return self.evolve_state(timestep, states)
 
+        self.step_cache.clear()
         requests = self.calculate_request(timestep, states)
         bulk_requests = requests.pop('bulk', [])
         if bulk_requests:
-            bulk_copy = states['bulk'].copy()
-            for bulk_idx, request in bulk_requests:
-                bulk_copy[bulk_idx] = request
-            states['bulk'] = bulk_copy
+            # Read requested counts without copying the bulk array
+            states['bulk'] = BulkOverlay(states['bulk'], bulk_requests)
         states = deep_merge(states, requests)
         update = self.evolve_state(timestep, states)
+        self.step_cache.clear()
         if 'listeners' in requests:
             update['listeners'] = deep_merge(update['listeners'], requests['listeners'])
         return update
+
+
+class _ToyProcess(PartitionedProcess):
+    """Requests random counts of some bulk molecules and uses a random part
+    of what it is allocated (for tests)."""
+    topology = {'bulk': ('bulk',), 'listeners': ('listeners',),
+        'log': ('log',)}
+    defaults = {'molecule_idx': [], 'seed': 0, 'time_step': 1}
+
+    def __init__(self, parameters=None):
+        super().__init__(parameters)
+        self.molecule_idx = np.array(self.parameters['molecule_idx'])
+        self.random_state = np.random.RandomState(self.parameters['seed'])
+        # Threads that evolve_state ran on
+        self.threads = set()
+
+    def ports_schema(self):
+        return {
+            'bulk': numpy_schema('bulk'),
+            'listeners': {self.name: {'used': {
+                '_default': 0, '_updater': 'set'}}},
+            'log': {'_default': [], '_updater': 'accumulate'},
+        }
+
+    def calculate_request(self, timestep, states):
+        return {'bulk': [(self.molecule_idx, self.random_state.randint(
+            0, 20, size=len(self.molecule_idx)))]}
+
+    def evolve_state(self, timestep, states):
+        allocated = counts(states['bulk'], self.molecule_idx)
+        used = self.random_state.binomial(allocated, 0.5)
+        self.threads.add(threading.current_thread().name)
+        # Give other threads a chance to run in between
+        time.sleep(0.001)
+        return {
+            'bulk': [(self.molecule_idx, -used)],
+            'listeners': {self.name: {'used': int(used.sum())}},
+            'log': [self.name],
+        }
+
+
+def _run_toy_engine(n_processes, n_steps, evolver_threads=0):
+    from vivarium.core.engine import Engine
+    from ecoli.processes.allocator import Allocator
+
+    bulk = np.zeros(4, dtype=[('id', 'U10'), ('count', int)])
+    bulk['id'] = ['A[c]', 'B[c]', 'C[c]', 'ATP[c]']
+    bulk['count'] = [100, 200, 50, 1000]
+    bulk.flags.writeable = False
+    names = [f'toy_{i}' for i in range(n_processes)]
+    toy_topology = {name: dict(_ToyProcess.topology) for name in names}
+    executor = None
+    locks = {}
+    if evolver_threads:
+        executor = get_evolver_executor(evolver_threads)
+        locks = get_evolver_locks(toy_topology)
+    processes = {}
+    steps = {'allocator': Allocator({'molecule_names': list(bulk['id']),
+        'process_names': names, 'custom_priorities': {}, 'seed': 0})}
+    flow = {'allocator': []}
+    topology = {'allocator': {'request': ('request',),
+        'allocate': ('allocate',), 'bulk': ('bulk',),
+        'evolvers_ran': ('evolvers_ran',), 'listeners': ('listeners',)}}
+    partitioned = {}
+    for i, name in enumerate(names):
+        process = _ToyProcess({'name': name, 'seed': i,
+            'molecule_idx': [i % 3, (i + 1) % 3, 3]})
+        partitioned[name] = (process,)
+        processes[f'{name}_evolver'] = Evolver({'time_step': 1,
+            'process': process, 'executor': executor,
+            'locks': locks.get(name, [])})
+        steps[f'{name}_requester'] = Requester({'time_step': 1,
+            'process': process})
+        flow[f'{name}_requester'] = []
+        flow['allocator'].append((f'{name}_requester',))
+        shared = {'evolvers_ran': ('evolvers_ran',),
+            'process': ('process', name)}
+        topology[f'{name}_evolver'] = dict(toy_topology[name], **shared,
+            allocate={'_path': ('allocate', name), 'bulk': ('bulk',)})
+        topology[f'{name}_requester'] = dict(toy_topology[name], **shared,
+            request={'_path': ('request', name), 'bulk': ('bulk',)})
+    engine = Engine(processes=processes, steps=steps, flow=flow,
+        topology=topology, initial_state={'bulk': bulk,
+            'process': partitioned})
+    engine.update(n_steps)
+    threads = set.union(*(process.threads
+        for process, in partitioned.values()))
+    return engine.state.get_value(), threads
+
+
+def test_evolver_locks():
+    assert get_store_paths({
+        'bulk': ('bulk',),
+        'boundary': ('..', 'boundary'),
+        'allocate': {'_path': ('allocate', 'p'), 'bulk': ('..', '..', 'bulk')},
+    }, ('agents', '0')) == {('agents', '0', 'bulk'), ('agents', 'boundary'),
+        ('agents', '0', 'allocate', 'p'), ('agents', '0', 'bulk')}
+
+    locks = get_evolver_locks({
+        'a': {'bulk': ('bulk',), 'shared': ('shared', 'x'),
+            'own': ('own', 'a')},
+        'b': {'listeners': ('listeners',), 'shared': ('shared',)},
+        'c': {'bulk': ('bulk',), 'own': ('own', 'c'),
+            'x': ('shared', 'x', 'y')},
+        'd': {'bulk': ('bulk',), 'listeners': ('listeners', 'd')},
+    })
+    # Thread-safe stores (bulk, listeners) and stores that only one Evolver
+    # is wired to do not need locks
+    assert [len(locks[name]) for name in 'abcd'] == [2, 1, 2, 0]
+    # Overlapping stores are locked at the shorter of the two paths:
+    # ('shared',) for a, b and c and ('shared', 'x') for a and c, always
+    # acquired in that order
+    assert locks['a'] == locks['c']
+    assert locks['b'] == locks['a'][:1]
+
+
+def test_evolver_threads():
+    serial, serial_threads = _run_toy_engine(4, 5)
+    threaded, threads = _run_toy_engine(4, 5, evolver_threads=3)
+    assert serial_threads == {threading.main_thread().name}
+    assert all(thread.startswith('evolver') for thread in threads)
+    # Same updates applied in the same order
+    np.testing.assert_array_equal(threaded['bulk'], serial['bulk'])
+    assert not np.array_equal(serial['bulk']['count'], [100, 200, 50, 1000])
+    for name in ['toy_0', 'toy_1', 'toy_2', 'toy_3']:
+        assert threaded['listeners'][name] == serial['listeners'][name]
+    for key in ['atp_requested', 'atp_allocated_initial']:
+        np.testing.assert_array_equal(
+            threaded['listeners'][key], serial['listeners'][key])
+    assert threaded['log'] == serial['log']
+    assert len(serial['log']) == 4 * 5
+
+    # Pools are shared by cells and shut down at exit
+    executor = get_evolver_executor(3)
+    assert get_evolver_executor(3) is executor
+    shutdown_evolver_executors()
+    assert not _EVOLVER_EXECUTORS
+    assert get_evolver_executor(3) is not executor
+
+
+def test_get_cached():
+    process = _ToyProcess({'name': 'toy_cached'})
+    computed = []
+
+    def compute():
+        computed.append(True)
+        return len(computed)
+
+    indexes = np.arange(5)
+    lengths = np.full(5, 10)
+    assert process.get_cached('x', [indexes, lengths], compute) == 1
+    # Equal inputs (even if they are new arrays) reuse the value
+    assert process.get_cached('x', [indexes.copy(), lengths], compute) == 1
+    # Changing the inputs after they were cached does not change the key
+    indexes[0] = 7
+    assert process.get_cached('x', [indexes, lengths], compute) == 2
+    assert process.get_cached('x', [indexes[:4], lengths[:4]], compute) == 3
+    assert process.get_cached('x', [indexes[:4]], compute) == 4
+    assert process.get_cached('y', [indexes[:4]], compute) == 5
+
+    # Values are shared by the Requester and Evolver of a process unless the
+    # inputs changed in between, and are not kept between time steps
+    class CachingProcess(_ToyProcess):
+        def calculate_request(self, timestep, states):
+            self.get_cached('x', [states['lengths']], compute)
+            return {}
+
+        def evolve_state(self, timestep, states):
+            self.get_cached('x', [states['lengths']], compute)
+            return {}
+
+    process = CachingProcess({'name': 'toy_cached'})
+    requester = Requester({'time_step': 1, 'process': process})
+    evolver = Evolver({'time_step': 1, 'process': process})
+    computed.clear()
+    for step_lengths in ([1, 2], [1, 2], [1, 3]):
+        requester.next_update(1, {'process': (process,),
+            'lengths': np.array([1, 2])})
+        evolver.next_update(1, {'process': (process,), 'allocate': {},
+            'lengths': np.array(step_lengths)})
+        assert process.step_cache == {}
+    assert len(computed) == 4
+
+
+def benchmark_get_cached(n_molecules=20000, n_repeats=20):
+    """Compare the time to check the inputs of a cached value with the time
+    to compute it for polypeptide elongation sized sequences."""
+    from wholecell.utils.polymerize import buildSequences
+
+    random_state = np.random.RandomState(0)
+    protein_sequences = random_state.randint(
+        0, 21, size=(4000, 2000)).astype(np.int8)
+    protein_indexes = random_state.randint(4000, size=n_molecules)
+    peptide_lengths = random_state.randint(1500, size=n_molecules)
+    elongation_rates = np.full(4000, 22)
+    inputs = [protein_indexes, peptide_lengths, elongation_rates]
+    process = _ToyProcess({'name': 'toy_benchmark'})
+
+    start = time.perf_counter()
+    for _ in range(n_repeats):
+        buildSequences(protein_sequences, protein_indexes, peptide_lengths,
+            elongation_rates)
+    compute_time = (time.perf_counter() - start) / n_repeats
+
+    process.get_cached('sequences', inputs, lambda: None)
+    # New arrays with the same values, like attrs() returns in evolve_state
+    new_inputs = [np.array(i) for i in inputs]
+    start = time.perf_counter()
+    for _ in range(n_repeats):
+        process.get_cached('sequences', new_inputs, lambda: None)
+    check_time = (time.perf_counter() - start) / n_repeats
+    print(f'{n_molecules} molecules: buildSequences '
+        f'{compute_time * 1000:.3f} ms, cache check '
+        f'{check_time * 1000:.3f} ms')
+
+
+test_library = {
+    '0': test_evolver_locks,
+    '1': test_evolver_threads,
+    '2': test_get_cached,
+    '3': benchmark_get_cached,
+}
+
+# run tests and benchmarks from the command line with:
+# python ecoli/processes/partition.py -n [test id]
+if __name__ == '__main__':
+    run_library_cli(test_library)
@@ -313,11 +313,14 @@ class PolypeptideElongation(PartitionedProcess):
             timestep,
             self.variable_elongation)
 
-        sequences = buildSequences(
-            self.proteinSequences,
-            proteinIndexes,
-            peptideLengths,
-            self.elongation_rates)
+        sequences = self.get_cached('sequences',
+            [proteinIndexes, peptideLengths, self.elongation_rates],
+            lambda: buildSequences(
+                self.proteinSequences,
+                proteinIndexes,
+                peptideLengths,
+                self.elongation_rates + self.next_aa_pad)
+        )[:, :-self.next_aa_pad]
 
         sequenceHasAA = (sequences != polymerize.PAD_VALUE)
         aasInSequences = np.bincount(sequences[sequenceHasAA], minlength=21)
@@ -388,11 +391,14 @@ class PolypeptideElongation(PartitionedProcess):
             states['active_ribosome'],
             ['protein_index', 'peptide_length', 'pos_on_mRNA'])
 
-        all_sequences = buildSequences(
-            self.proteinSequences,
-            protein_indexes,
-            peptide_lengths,
-            self.elongation_rates + self.next_aa_pad)
+        # Reuse sequences from calculate_request if ribosomes are unchanged
+        all_sequences = self.get_cached('sequences',
+            [protein_indexes, peptide_lengths, self.elongation_rates],
+            lambda: buildSequences(
+                self.proteinSequences,
+                protein_indexes,
+                peptide_lengths,
+                self.elongation_rates + self.next_aa_pad))
         sequences = all_sequences[:, :-self.next_aa_pad].copy()
 
         if sequences.size == 0:
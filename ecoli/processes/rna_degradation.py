@@ -459,12 +459,9 @@ class RnaDegradation(PartitionedProcess):
         update['bulk'].append((self.fragment_metabolites_idx,
             metabolitesEndoCleavage))
         # fragmentMetabolites overlaps with fragmentBases
-        bulk_count_copy = states['bulk'].copy()
-        if len(bulk_count_copy.dtype) > 1:
-            bulk_count_copy = bulk_count_copy['count']
-        bulk_count_copy[self.fragment_metabolites_idx] \
-            += metabolitesEndoCleavage
-        fragmentBases = bulk_count_copy[self.fragment_bases_idx]
+        fragmentBases = counts(states['bulk'], self.fragment_bases_idx) \
+            + np.dot(metabolitesEndoCleavage, self.fragment_bases_idx
+                == self.fragment_metabolites_idx[:, np.newaxis])
 
         # Check if exonucleolytic digestion can happen
         if fragmentBases.sum() == 0:
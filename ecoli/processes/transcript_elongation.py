@@ -245,11 +245,14 @@ class TranscriptElongation(PartitionedProcess):
         TU_indexes_partial = TU_indexes[is_partial_transcript]
         transcript_lengths_partial = transcript_lengths[is_partial_transcript]
 
-        sequences = buildSequences(
-            self.rnaSequences,
-            TU_indexes_partial,
-            transcript_lengths_partial,
-            self.elongation_rates)
+        sequences = self.get_cached('sequences',
+            [TU_indexes_partial, transcript_lengths_partial,
+                self.elongation_rates],
+            lambda: buildSequences(
+                self.rnaSequences,
+                TU_indexes_partial,
+                transcript_lengths_partial,
+                self.elongation_rates))
 
         sequenceComposition = np.bincount(
             sequences[sequences != polymerize.PAD_VALUE], minlength = 4)
@@ -336,11 +339,15 @@ class TranscriptElongation(PartitionedProcess):
             rna_to_attenuate = np.zeros(len(TU_index_partial_RNAs), bool)
         rna_to_elongate = ~rna_to_attenuate
 
-        sequences = buildSequences(
-            self.rnaSequences,
-            TU_index_partial_RNAs,
-            length_partial_RNAs,
-            self.elongation_rates)
+        # Reuse sequences from calculate_request if RNAs are unchanged
+        sequences = self.get_cached('sequences',
+            [TU_index_partial_RNAs, length_partial_RNAs,
+                self.elongation_rates],
+            lambda: buildSequences(
+                self.rnaSequences,
+                TU_index_partial_RNAs,
+                length_partial_RNAs,
+                self.elongation_rates))
 
         # Polymerize transcripts based on sequences and available nucleotides
         reactionLimit = ntpCounts.sum()
@@ -2,8 +2,12 @@ from vivarium.core.process import Step
 from ecoli.library.schema import numpy_schema
 
 class UniqueUpdate(Step):
-    """Placed after before and after all Steps to ensure that
-    unique molecules are completely up-to-date"""
+    """Signals for the queued updates of a set of unique molecule stores
+    to be applied. Placed before all Steps and after any Step whose unique
+    molecule updates must be visible to a downstream Step (see
+    :py:func:`get_unique_update_flow`). Can also be wired to the bulk store
+    to apply bulk updates queued by
+    :py:class:`ecoli.library.schema.BulkNumpyUpdater`."""
 
     name = 'unique-update'
 
@@ -17,9 +21,182 @@ class UniqueUpdate(Step):
             unique_mol: numpy_schema(unique_mol)
             for unique_mol in self.unique_dict
         }
-    
+
     def next_update(self, timestep, states):
         return {
             unique_mol: {'update': True}
             for unique_mol in self.unique_dict.keys()
         }
+
+
+def get_unique_stores(topology, unique_stores):
+    """Get the names of all unique molecule stores wired into a topology.
+
+    Args:
+        topology: Topology of a single process or step (port: path)
+        unique_stores: Names of all unique molecule stores (e.g. 'RNA')
+
+    Returns:
+        Set of unique molecule store names. A port connected to the
+        entire ``('unique',)`` store is wired to all of them.
+    """
+    stores = set()
+    for path in topology.values():
+        if isinstance(path, dict):
+            stores |= get_unique_stores(path, unique_stores)
+        elif isinstance(path, (tuple, list)) and path[:1] in (
+            ('unique',), ['unique']
+        ):
+            if len(path) == 1:
+                stores |= set(unique_stores)
+            elif path[1] in unique_stores:
+                stores.add(path[1])
+    return stores
+
+
+def get_unique_update_flow(step_topologies, flow, unique_dict, writers):
+    """Generate the minimal set of UniqueUpdate Steps for a Step flow.
+
+    Unique molecule updates are queued by
+    :py:class:`ecoli.library.schema.UniqueNumpyUpdater` until a
+    UniqueUpdate Step signals for them to be applied. Instead of applying
+    every unique store after every Step, only commit the stores that a
+    writer Step shares with at least one Step that depends on it (directly
+    or transitively) and make those readers wait for the commit. Stores that
+    no downstream Step reads are committed once after all of their writers
+    have run so that Processes see up-to-date unique molecules in the next
+    timestep.
+
+    Args:
+        step_topologies: Mapping of Step names to their topologies. Steps in
+            ``flow`` without a topology here (or with a topology of None)
+            are assumed to access every unique molecule store.
+        flow: Step dependency dictionary (name: list of dependency paths).
+            Modified in place to depend on the new UniqueUpdate Steps.
+        unique_dict: Topology for all unique molecule ports (port: path)
+        writers: Names of Steps whose updates may modify the unique
+            molecule stores wired into their topologies
+
+    Returns:
+        Dictionary of new UniqueUpdate Steps, keyed by their names
+        (``unique-update-1``, ``unique-update-2``, etc.)
+    """
+    store_to_port = {path[1]: port for port, path in unique_dict.items()}
+    accessed = {}
+    for name in flow:
+        topology = step_topologies.get(name)
+        if topology is None:
+            accessed[name] = set(store_to_port)
+        else:
+            accessed[name] = get_unique_stores(topology, store_to_port)
+    dependents = {}
+    for name, dependencies in flow.items():
+        for dependency in dependencies:
+            if len(dependency) == 1:
+                dependents.setdefault(dependency[0], set()).add(name)
+
+    commits = {}
+    readers_to_commits = {}
+    # Stores whose updates are not applied by any commit above
+    uncommitted = {}
+    for writer in writers:
+        written = accessed[writer]
+        if not written:
+            continue
+        # Find all Steps that run after the writer and share a store
+        stores_to_commit = set()
+        readers = []
+        to_visit = list(dependents.get(writer, []))
+        visited = set()
+        while to_visit:
+            name = to_visit.pop()
+            if name in visited:
+                continue
+            visited.add(name)
+            to_visit.extend(dependents.get(name, []))
+            shared = written & accessed.get(name, set())
+            if shared:
+                stores_to_commit |= shared
+                readers.append(name)
+        if written - stores_to_commit:
+            uncommitted[writer] = written - stores_to_commit
+        if not stores_to_commit:
+            continue
+        commit_name = f'unique-update-{len(commits) + 1}'
+        commits[commit_name] = UniqueUpdate({'unique_dict': {
+            store_to_port[store]: unique_dict[store_to_port[store]]
+            for store in sorted(stores_to_commit)}})
+        flow[commit_name] = [(writer,)]
+        for reader in readers:
+            readers_to_commits.setdefault(reader, []).append(commit_name)
+    for reader, commit_names in readers_to_commits.items():
+        flow[reader].extend((commit_name,) for commit_name in commit_names)
+
+    # Apply anything still queued once all writers have run
+    if uncommitted:
+        stores_to_commit = set().union(*uncommitted.values())
+        commit_name = f'unique-update-{len(commits) + 1}'
+        commits[commit_name] = UniqueUpdate({'unique_dict': {
+            store_to_port[store]: unique_dict[store_to_port[store]]
+            for store in sorted(stores_to_commit)}})
+        flow[commit_name] = [(writer,) for writer in uncommitted]
+    return commits
+
+
+
+def test_unique_update_flow():
+    unique_dict = {
+        'RNAs': ('unique', 'RNA'),
+        'active_ribosome': ('unique', 'active_ribosome'),
+        'full_chromosomes': ('unique', 'full_chromosome'),
+    }
+    step_topologies = {
+        'writer': {'bulk': ('bulk',), **unique_dict},
+        'bulk_only': {'bulk': ('bulk',)},
+        'reader': {'active_ribosome': ('unique', 'active_ribosome')},
+    }
+    flow = {
+        'unique-update': [],
+        'writer': [('unique-update',)],
+        'bulk_only': [('unique-update',), ('writer',)],
+        'reader': [('unique-update',), ('bulk_only',)],
+    }
+    commits = get_unique_update_flow(
+        step_topologies, flow, unique_dict, ['writer', 'bulk_only'])
+    # Only the store read downstream is committed before the reader runs,
+    # the rest are committed once at the end
+    assert list(commits['unique-update-1'].unique_dict) == ['active_ribosome']
+    assert flow['unique-update-1'] == [('writer',)]
+    assert ('unique-update-1',) in flow['reader']
+    assert flow['bulk_only'] == [('unique-update',), ('writer',)]
+    assert list(commits['unique-update-2'].unique_dict) == [
+        'RNAs', 'full_chromosomes']
+    assert flow['unique-update-2'] == [('writer',)]
+
+    # A listener wired to all unique molecules reads everything
+    step_topologies['listener'] = {'unique': ('unique',)}
+    flow = {
+        'unique-update': [],
+        'writer': [('unique-update',)],
+        'listener': [('unique-update',), ('writer',)],
+    }
+    commits = get_unique_update_flow(
+        step_topologies, flow, unique_dict, ['writer'])
+    assert list(commits) == ['unique-update-1']
+    assert commits['unique-update-1'].unique_dict == unique_dict
+    assert ('unique-update-1',) in flow['listener']
+
+    # Steps with an unknown topology read and write every store
+    flow = {
+        'unique-update': [],
+        'unknown': [('unique-update',)],
+        'reader': [('unique-update',), ('unknown',)],
+    }
+    commits = get_unique_update_flow(
+        step_topologies, flow, unique_dict, ['unknown'])
+    assert list(commits) == ['unique-update-1', 'unique-update-2']
+    assert list(commits['unique-update-1'].unique_dict) == ['active_ribosome']
+    assert ('unique-update-1',) in flow['reader']
+    assert list(commits['unique-update-2'].unique_dict) == [
+        'RNAs', 'full_chromosomes']
+    assert flow['unique-update-2'] == [('unknown',)]
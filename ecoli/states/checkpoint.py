@@ -0,0 +1,586 @@
+"""
+==================
+Binary Checkpoints
+==================
+
+Saving a cell state as JSON converts every row of the bulk and unique
+molecule arrays into a list, and loading it rebuilds the arrays row by row.
+A checkpoint is a directory (``<name>.ckpt``) that instead stores each Numpy
+array in the state as a raw ``.npy`` file next to a ``manifest.json`` with
+the rest of the state. Dtypes are kept exactly and arrays are memory-mapped
+(copy-on-write) on load, so loading does not copy or parse molecule data.
+
+:py:func:`ecoli.states.wcecoli_state.get_state_from_file` loads
+``data/<name>.ckpt`` instead of ``data/<name>.json`` if it exists. Convert
+existing JSON states (and back) with::
+
+    python ecoli/states/checkpoint.py data/wcecoli_t0.json
+    python ecoli/states/checkpoint.py data/wcecoli_t0.ckpt
+
+A delta checkpoint only stores the array rows that changed since a full
+checkpoint (see :py:func:`write_checkpoint`), so its size scales with the
+amount of change instead of the size of the colony. In delta mode,
+:py:class:`CheckpointWriter` diffs every save against the previous save
+(read back memory-mapped from disk) and writes a new full checkpoint every
+``full_interval`` saves, so each delta only stores the changes since the
+previous save and reading any checkpoint reads at most ``full_interval - 1``
+earlier checkpoints. Delta checkpoints are read like any other checkpoint.
+To rebuild a standalone checkpoint (e.g.
+``data/seed_0_colony_t400_full.ckpt``) that no longer needs the earlier
+checkpoints, run::
+
+    python ecoli/states/checkpoint.py --full data/seed_0_colony_t400.ckpt
+
+:py:class:`CheckpointWriter` saves states (in any format) on a background
+thread so that simulations keep running while a state is written.
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from vivarium.core.serialize import deserialize_value, serialize_value
+
+
+CHECKPOINT_SUFFIX = '.ckpt'
+CHECKPOINT_VERSION = 1
+# Number of saves from one full checkpoint to the next in delta mode
+DEFAULT_FULL_INTERVAL = 10
+MANIFEST_FILE = 'manifest.json'
+# Key of the placeholders that replace arrays in the manifest
+ARRAY_KEY = '__checkpoint_array__'
+
+
+def get_checkpoint_path(path):
+    """Get the checkpoint path corresponding to a JSON state file path."""
+    return os.path.splitext(path)[0] + CHECKPOINT_SUFFIX
+
+
+def _changed_rows(array, parent):
+    """Get the rows of an array that differ from the rows of a parent array
+    with the same dtype, including rows beyond the end of the parent."""
+    n_shared = min(len(array), len(parent))
+    changed = np.ones(len(array), dtype=np.bool_)
+    if n_shared > 0 and array.dtype.itemsize > 0:
+        # Compare raw bytes so that any dtype (e.g. structured arrays with
+        # subarray fields) can be compared row by row
+        array_bytes = np.ascontiguousarray(array[:n_shared]).view(
+            np.uint8).reshape(n_shared, -1)
+        parent_bytes = np.ascontiguousarray(parent[:n_shared]).view(
+            np.uint8).reshape(n_shared, -1)
+        changed[:n_shared] = (array_bytes != parent_bytes).any(axis=1)
+    return np.nonzero(changed)[0]
+
+
+def _extract_arrays(value, arrays, parent=None):
+    """Replace Numpy arrays in nested dictionaries with placeholders. If the
+    parent state has an array with the same dtype at the same path, only
+    save the rows that changed."""
+    if isinstance(value, dict):
+        if not isinstance(parent, dict):
+            parent = {}
+        return {key: _extract_arrays(subvalue, arrays, parent.get(key))
+            for key, subvalue in value.items()}
+    if isinstance(value, np.ndarray) and not value.dtype.hasobject:
+        if (isinstance(parent, np.ndarray) and value.ndim > 0
+            and parent.ndim == value.ndim and parent.dtype == value.dtype
+            and parent.shape[1:] == value.shape[1:]
+        ):
+            rows = _changed_rows(value, parent)
+            placeholder = {ARRAY_KEY: None, 'rows': None,
+                'length': len(value)}
+            if len(rows) > 0:
+                placeholder[ARRAY_KEY] = f'{len(arrays)}.npy'
+                arrays.append(value[rows])
+                placeholder['rows'] = f'{len(arrays)}.npy'
+                arrays.append(rows)
+            return placeholder
+        arrays.append(value)
+        return {ARRAY_KEY: f'{len(arrays) - 1}.npy'}
+    return value
+
+
+def _load_array(path, mmap):
+    try:
+        array = np.load(path, mmap_mode='c' if mmap else None,
+            allow_pickle=False)
+    except ValueError:
+        # Empty arrays cannot be memory-mapped
+        array = np.load(path, allow_pickle=False)
+    # Plain array (not np.memmap) that shares the mapped memory
+    return array.view(np.ndarray)
+
+
+def _insert_arrays(value, path, mmap, parent=None):
+    if isinstance(value, dict):
+        if ARRAY_KEY in value:
+            if 'rows' in value:
+                # Apply changed rows to array from parent checkpoint
+                n_shared = min(len(parent), value['length'])
+                if value['length'] == len(parent):
+                    array = parent
+                else:
+                    array = np.zeros((value['length'],) + parent.shape[1:],
+                        dtype=parent.dtype)
+                    array[:n_shared] = parent[:n_shared]
+                if value['rows'] is not None:
+                    rows = _load_array(
+                        os.path.join(path, value['rows']), False)
+                    array.flags.writeable = True
+                    array[rows] = _load_array(
+                        os.path.join(path, value[ARRAY_KEY]), False)
+            else:
+                array = _load_array(
+                    os.path.join(path, value[ARRAY_KEY]), mmap)
+            # Numpy arrays are read-only outside of updater
+            array.flags.writeable = False
+            return array
+        if not isinstance(parent, dict):
+            parent = {}
+        return {key: _insert_arrays(subvalue, path, mmap, parent.get(key))
+            for key, subvalue in value.items()}
+    return value
+
+
+def write_checkpoint(path, state, parent_path=None, parent_state=None):
+    """Save a state as a checkpoint directory.
+
+    To save a delta checkpoint, pass the path and state of a parent
+    checkpoint (usually a full checkpoint). Only the rows of arrays (e.g.
+    bulk counts, unique molecules and environment fields) that differ from
+    the parent state are saved. Reading a delta checkpoint reads its parent
+    (and the parent's parents, if it is a delta checkpoint too), which must
+    therefore be kept.
+
+    Args:
+        path: Checkpoint directory (replaced if it exists)
+        state: State with Numpy arrays and values that can be serialized by
+            :py:func:`vivarium.core.serialize.serialize_value`
+        parent_path: Path of previous checkpoint for delta checkpoints
+        parent_state: State saved in previous checkpoint
+    """
+    arrays = []
+    manifest = {
+        'version': CHECKPOINT_VERSION,
+        'state': serialize_value(
+            _extract_arrays(state, arrays, parent_state)),
+    }
+    if parent_path is not None:
+        manifest['parent'] = os.path.relpath(
+            parent_path, os.path.dirname(os.path.abspath(path)))
+    # Write to a temporary directory first so that an interrupted save
+    # never leaves a partial checkpoint behind
+    tmp_path = f'{path}.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    for i, array in enumerate(arrays):
+        np.save(os.path.join(tmp_path, f'{i}.npy'), array, allow_pickle=False)
+    with open(os.path.join(tmp_path, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+
+def read_checkpoint(path, mmap=True):
+    """Load a state saved with :py:func:`write_checkpoint`.
+
+    Args:
+        path: Checkpoint directory
+        mmap: Memory-map arrays (copy-on-write) instead of reading them
+
+    Returns:
+        Deserialized state with read-only Numpy arrays
+    """
+    # Follow the parents up to the full checkpoint, then apply the deltas
+    # from there
+    chain = []
+    path = os.path.abspath(path)
+    while path is not None:
+        if any(path == chain_path for chain_path, _ in chain):
+            raise ValueError(f'Checkpoint {path} is its own parent.')
+        with open(os.path.join(path, MANIFEST_FILE), 'r') as f:
+            manifest = json.load(f)
+        if manifest['version'] != CHECKPOINT_VERSION:
+            raise ValueError(f'Checkpoint {path} has version '
+                f'{manifest["version"]} (expected {CHECKPOINT_VERSION}).')
+        chain.append((path, manifest))
+        path = os.path.join(os.path.dirname(path), manifest['parent']) \
+            if manifest.get('parent') else None
+    state = None
+    for path, manifest in reversed(chain):
+        state = _insert_arrays(deserialize_value(manifest['state']), path,
+            mmap, state)
+    return state
+
+
+def restore_checkpoint(path, output_path=None):
+    """Rebuild a standalone checkpoint from a (delta) checkpoint.
+
+    Args:
+        path: Checkpoint directory
+        output_path: Output checkpoint directory (by default,
+            ``<name>_full.ckpt``)
+
+    Returns:
+        Output checkpoint directory
+    """
+    output_path = output_path or (
+        os.path.splitext(path)[0] + '_full' + CHECKPOINT_SUFFIX)
+    write_checkpoint(output_path, read_checkpoint(path, mmap=False))
+    return output_path
+
+
+class _BulkSnapshot:
+    """Bulk molecule array whose counts were copied. Only the counts of bulk
+    molecules change in place, so the rest of the array (e.g. molecule IDs)
+    is copied from the live array later, on the thread that saves it."""
+
+    def __init__(self, array):
+        self.array = array
+        self.counts = array['count'].copy()
+
+    def resolve(self):
+        array = self.array.copy()
+        array['count'] = self.counts
+        array.flags.writeable = self.array.flags.writeable
+        return array
+
+
+def _is_bulk(array):
+    return array.dtype.names is not None and {'id', 'count'}.issubset(
+        array.dtype.names)
+
+
+def _is_unique(array):
+    return array.dtype.names is not None and '_entryState' in array.dtype.names
+
+
+def snapshot_state(state):
+    """Snapshot a state so that another thread can save it while the
+    simulation continues. Call :py:func:`resolve_snapshot` on the snapshot
+    (from the saving thread) to get the saved state.
+
+    Only copies what updaters modify in place: the counts of bulk molecule
+    arrays and unique molecule arrays (see
+    :py:func:`ecoli.library.schema.numpy_schema`). Nested dictionaries are
+    rebuilt because stores replace their values. All other values (e.g.
+    listener arrays, environment fields, lists and units) are shared, so
+    they must not be modified in place."""
+    if isinstance(state, dict):
+        return {key: snapshot_state(value) for key, value in state.items()}
+    if isinstance(state, np.ndarray):
+        if _is_bulk(state):
+            return _BulkSnapshot(state)
+        if _is_unique(state):
+            return state.copy()
+    return state
+
+
+def resolve_snapshot(snapshot):
+    """Get the state saved in a snapshot from :py:func:`snapshot_state`."""
+    if isinstance(snapshot, dict):
+        return {key: resolve_snapshot(value)
+            for key, value in snapshot.items()}
+    if isinstance(snapshot, _BulkSnapshot):
+        return snapshot.resolve()
+    return snapshot
+
+
+class CheckpointWriter:
+    """Saves states on a background thread, one at a time.
+
+    :py:meth:`save` snapshots a state (see :py:func:`snapshot_state`) on the
+    calling thread and returns once the snapshot is taken. If the previous
+    save is still running, it first waits for it to finish so that saves
+    never overlap. Errors raised while saving are re-raised by the next call
+    to :py:meth:`save`, :py:meth:`save_checkpoint`, :py:meth:`wait` or
+    :py:meth:`close`.
+
+    Saving only overlaps with the simulation where it releases the GIL.
+    Checkpoints (:py:func:`write_checkpoint`) spend most of their time in
+    Numpy file writes, which do. JSON saves spend most of their time
+    serializing the state in Python, which holds the GIL, so they mostly
+    compete with the simulation for it (and only avoid blocking it on the
+    file writes).
+
+    Args:
+        delta: Save checkpoints written with :py:meth:`save_checkpoint` as
+            delta checkpoints of the previous checkpoint
+        full_interval: In delta mode, number of saves from one full
+            checkpoint to the next (reading a checkpoint reads up to
+            ``full_interval - 1`` earlier checkpoints)
+    """
+
+    def __init__(self, delta=False, full_interval=DEFAULT_FULL_INTERVAL):
+        self.executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='checkpoint')
+        self.future = None
+        self.delta = delta
+        self.full_interval = full_interval
+        # Path of the previous checkpoint (for delta checkpoints) and number
+        # of delta checkpoints since the last full checkpoint
+        self.parent_path = None
+        self.n_deltas = 0
+
+    @staticmethod
+    def _save(write, path, snapshot, message):
+        write(path, resolve_snapshot(snapshot))
+        if message:
+            print(message)
+
+    def save(self, write, path, state, message=None):
+        """Snapshot a state and save it in the background.
+
+        Args:
+            write: Function that takes a path and a state and saves it
+                (e.g. :py:func:`write_checkpoint`)
+            path: Path to save state to
+            state: State to save
+            message: Printed once the state is saved
+
+        Returns:
+            Future that is done once the state is saved
+        """
+        self.wait()
+        self.future = self.executor.submit(
+            self._save, write, path, snapshot_state(state), message)
+        return self.future
+
+    def save_checkpoint(self, path, state, message=None):
+        """Snapshot a state and save it as a checkpoint in the background
+        (as a delta checkpoint of the previous save in delta mode, unless a
+        full checkpoint is due).
+
+        Args:
+            path: Checkpoint directory
+            state: State to save
+            message: Printed once the state is saved
+
+        Returns:
+            Future that is done once the state is saved
+        """
+        self.wait()
+        snapshot = snapshot_state(state)
+        if self.n_deltas + 1 >= self.full_interval:
+            self.parent_path = None
+        parent_path = self.parent_path
+
+        def write(path, state):
+            # Diff against the parent checkpoint on disk (memory-mapped)
+            # instead of keeping its state in memory
+            parent_state = None
+            if parent_path is not None:
+                parent_state = read_checkpoint(parent_path, mmap=True)
+            write_checkpoint(path, state, parent_path, parent_state)
+
+        self.future = self.executor.submit(
+            self._save, write, path, snapshot, message)
+        if self.delta:
+            self.n_deltas = 0 if parent_path is None else self.n_deltas + 1
+            self.parent_path = path
+        return self.future
+
+    def wait(self):
+        """Wait for the current save (if any) to finish."""
+        if self.future is not None:
+            future = self.future
+            self.future = None
+            future.result()
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            self.executor.shutdown()
+
+
+def test_checkpoint():
+    import copy
+
+    bulk = np.array([('A[c]', 1), ('B[c]', 2)],
+        dtype=[('id', '<U10'), ('count', '<i8')])
+    unique = np.zeros(3, dtype=[('unique_index', '<i8'),
+        ('_entryState', 'i1'), ('massDiff', '<f8', 2)])
+    state = {
+        'bulk': bulk,
+        'unique': {'active_RNAP': unique, 'empty': unique[:0]},
+        'listeners': {'mass': {'dry_mass': 300.0}, 'ids': ['a', 'b']},
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'state.ckpt')
+        write_checkpoint(path, state)
+        write_checkpoint(path, state)
+        loaded = read_checkpoint(path)
+        assert loaded['bulk'].dtype == bulk.dtype
+        np.testing.assert_array_equal(loaded['bulk'], bulk)
+        np.testing.assert_array_equal(
+            loaded['unique']['active_RNAP'], unique)
+        assert loaded['unique']['empty'].dtype == unique.dtype
+        assert loaded['listeners'] == state['listeners']
+        assert not loaded['bulk'].flags.writeable
+        # Copy-on-write: updaters can modify arrays without changing the file
+        loaded['bulk'].flags.writeable = True
+        loaded['bulk']['count'] += 1
+        np.testing.assert_array_equal(read_checkpoint(path)['bulk'], bulk)
+
+        # Later changes to a state do not affect saves in progress
+        writer = CheckpointWriter()
+        writer.save(write_checkpoint, path, loaded)
+        loaded['bulk']['count'] += 1
+        writer.close()
+        np.testing.assert_array_equal(read_checkpoint(path)['bulk']['count'],
+            bulk['count'] + 1)
+        # Only bulk counts and unique molecules are copied
+        snapshot = snapshot_state(state)
+        assert snapshot['listeners']['ids'] is state['listeners']['ids']
+        assert snapshot['unique']['active_RNAP'] is not unique
+        resolved = resolve_snapshot(snapshot)
+        np.testing.assert_array_equal(resolved['bulk'], bulk)
+
+        # Delta checkpoints only save changed rows
+        writer = CheckpointWriter(delta=True)
+        states = [state]
+        for i in range(3):
+            writer.save_checkpoint(
+                os.path.join(tmp_dir, f'delta_{i}.ckpt'), states[-1])
+            next_state = copy.deepcopy(states[-1])
+            next_state['bulk']['count'][i % 2] += 1
+            next_state['unique']['active_RNAP'] = np.concatenate([
+                next_state['unique']['active_RNAP'], unique[:i]])
+            next_state['listeners']['mass']['dry_mass'] += 1
+            states.append(next_state)
+        writer.close()
+        assert len(os.listdir(os.path.join(tmp_dir, 'delta_2.ckpt'))) == 5
+        with open(os.path.join(tmp_dir, 'delta_2.ckpt', MANIFEST_FILE)) as f:
+            assert json.load(f)['parent'] == 'delta_1.ckpt'
+        for i in range(3):
+            loaded = read_checkpoint(os.path.join(tmp_dir, f'delta_{i}.ckpt'))
+            np.testing.assert_array_equal(loaded['bulk'], states[i]['bulk'])
+            np.testing.assert_array_equal(loaded['unique']['active_RNAP'],
+                states[i]['unique']['active_RNAP'])
+            assert loaded['listeners'] == states[i]['listeners']
+        full_path = restore_checkpoint(os.path.join(tmp_dir, 'delta_2.ckpt'))
+        np.testing.assert_array_equal(
+            read_checkpoint(full_path)['bulk'], states[2]['bulk'])
+
+
+def test_checkpoint_writer():
+    import threading
+
+    started = threading.Event()
+    release = threading.Event()
+    saved = []
+
+    def write(path, state):
+        started.set()
+        release.wait(10)
+        if path == 'fail':
+            raise OSError('Disk full')
+        saved.append((path, state['bulk']['count'].tolist()))
+
+    state = {'bulk': np.array([('A', 0), ('B', 1), ('C', 2)],
+        dtype=[('id', '<U1'), ('count', '<i8')])}
+    writer = CheckpointWriter()
+    future = writer.save(write, 'a', state)
+    started.wait(10)
+    # The simulation continues while the state is saved
+    state['bulk']['count'] += 1
+    assert not future.done()
+    release.set()
+    writer.save(write, 'b', state)
+    # The first save finished before the second started
+    assert saved[0] == ('a', [0, 1, 2])
+    writer.wait()
+    assert saved == [('a', [0, 1, 2]), ('b', [1, 2, 3])]
+
+    # Errors are raised by the next call and do not stop later saves
+    writer.save(write, 'fail', state)
+    try:
+        writer.save(write, 'c', state)
+    except OSError:
+        pass
+    else:
+        raise AssertionError('Save error was not raised.')
+    writer.save(write, 'c', state)
+    writer.save(write, 'fail', state)
+    try:
+        writer.close()
+    except OSError:
+        pass
+    else:
+        raise AssertionError('Save error was not raised by close.')
+    assert [path for path, _ in saved] == ['a', 'b', 'c']
+
+
+def test_many_delta_checkpoints():
+    import copy
+
+    random_state = np.random.RandomState(0)
+    state = {'bulk': np.zeros(50, dtype=[('id', '<U10'), ('count', '<i8')]),
+        'listeners': {'time': 0}}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        writer = CheckpointWriter(delta=True, full_interval=10)
+        states = []
+        for i in range(25):
+            state = copy.deepcopy(state)
+            state['bulk']['count'][random_state.randint(50, size=3)] += 1
+            state['listeners']['time'] = i
+            states.append(state)
+            writer.save_checkpoint(os.path.join(tmp_dir, f'{i}.ckpt'), state)
+        writer.close()
+        for i, state in enumerate(states):
+            path = os.path.join(tmp_dir, f'{i}.ckpt')
+            with open(os.path.join(path, MANIFEST_FILE), 'r') as f:
+                parent = json.load(f).get('parent')
+            # Deltas are saved against the previous checkpoint
+            if i % 10 == 0:
+                assert parent is None
+            else:
+                assert parent == f'{i - 1}.ckpt'
+            loaded = read_checkpoint(path)
+            np.testing.assert_array_equal(loaded['bulk'], state['bulk'])
+            assert loaded['listeners'] == state['listeners']
+
+        # Long chains of deltas are read without recursion
+        parent_path = os.path.join(tmp_dir, '0.ckpt')
+        parent_state = states[0]
+        for i in range(1100):
+            state = copy.deepcopy(parent_state)
+            state['bulk']['count'][i % 50] += 1
+            path = os.path.join(tmp_dir, f'chain_{i}.ckpt')
+            write_checkpoint(path, state, parent_path, parent_state)
+            parent_path, parent_state = path, state
+        np.testing.assert_array_equal(
+            read_checkpoint(parent_path)['bulk'], state['bulk'])
+
+
+def main():
+    from ecoli.states.wcecoli_state import (
+        json_to_checkpoint, checkpoint_to_json)
+
+    parser = argparse.ArgumentParser(
+        description='Convert JSON states to checkpoints and back.')
+    parser.add_argument('paths', nargs='+',
+        help=f'JSON files to convert to checkpoints or checkpoints '
+            f'({CHECKPOINT_SUFFIX}) to convert to JSON files.')
+    parser.add_argument('--full', action='store_true',
+        help='Rebuild standalone checkpoints from (delta) checkpoints '
+            'instead of converting them to JSON files.')
+    args = parser.parse_args()
+    for path in args.paths:
+        path = path.rstrip('/')
+        if args.full:
+            output_path = restore_checkpoint(path)
+        elif path.endswith(CHECKPOINT_SUFFIX):
+            output_path = checkpoint_to_json(path)
+        else:
+            output_path = json_to_checkpoint(path)
+        print(f'Converted {path} to {output_path}')
+
+
+if __name__ == '__main__':
+    main()
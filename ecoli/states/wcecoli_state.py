@@ -1,15 +1,21 @@
 import ast
 import json
+import os
+import re
+import tempfile
 import numpy as np
 import concurrent.futures
 
-from vivarium.core.serialize import deserialize_value
+from vivarium.core.serialize import deserialize_value, serialize_value
 
+from ecoli.library.logging_tools import write_json
+from ecoli.states.checkpoint import (get_checkpoint_path, read_checkpoint,
+    write_checkpoint)
 from wholecell.utils import units
 
 
 def infinitize(value):
-    if value == "__INFINITY__":
+    if isinstance(value, str) and value == "__INFINITY__":
         return float("inf")
     else:
         return value
@@ -18,6 +24,10 @@ def infinitize(value):
 def load_states(path):
     with open(path, "r") as states_file:
         states = json.load(states_file)
+    return infinitize_environment(states)
+
+
+def infinitize_environment(states):
     # Apply infinitize() to every value in each agent's environment state
     if 'agents' in states.keys():
         for agent_state in states['agents'].values():
@@ -72,28 +82,258 @@ def numpy_molecules(states):
     return states 
 
 
+def add_dtypes(states):
+    """
+    Saves the dtypes of unique and bulk molecule arrays so that
+    numpy_molecules can rebuild them from JSON lists
+    """
+    states['bulk_dtypes'] = str(states['bulk'].dtype)
+    states['unique_dtypes'] = {}
+    for name, mols in states['unique'].items():
+        states['unique_dtypes'][name] = str(mols.dtype)
+    return states
+
+
+# Bytes of a colony file scanned at a time to find agents
+SCAN_CHUNK_SIZE = 2**24
+# Decoded agent arrays are passed to the parent process through files in
+# this directory (shared memory on Linux, unless ECOLI_SHARED_MEMORY_DIR is
+# set). The default temporary directory is used if it fails (e.g. when
+# /dev/shm is too small for the colony).
+SHARED_MEMORY_DIR = os.environ.get('ECOLI_SHARED_MEMORY_DIR',
+    '/dev/shm' if os.path.isdir('/dev/shm') else None)
+_JSON_KEY = re.compile(rb'"((?:[^"\\]|\\.)*)"\s*:\s*$')
+
+
+def _read_key(f, start):
+    """Reads the JSON key of the value starting at byte start"""
+    window_start = max(0, start - 1024)
+    f.seek(window_start)
+    match = _JSON_KEY.search(f.read(start - window_start))
+    if match is None:
+        return None
+    return json.loads(b'"' + match.group(1) + b'"')
+
+
+def is_colony_file(path, chunk_size=SCAN_CHUNK_SIZE):
+    """Checks whether a JSON state file may be a colony file (has an
+    "agents" key) much faster than get_agent_ranges can scan it"""
+    key = b'"agents"'
+    with open(path, 'rb') as f:
+        previous = b''
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return False
+            if key in previous + chunk:
+                return True
+            previous = chunk[-len(key):]
+
+
+def get_agent_ranges(path, chunk_size=SCAN_CHUNK_SIZE):
+    """
+    Finds the byte ranges of the agents in a colony JSON file without
+    decoding it by scanning it in chunks for brackets outside of strings
+
+    Returns:
+        Tuple of the (start, end) byte range of the agents object and a
+        dictionary of (start, end) byte ranges for each agent ID (None
+        if the file is not a colony file)
+    """
+    # Position, whether it is an opening bracket and depth (for closing
+    # brackets) of brackets of objects and arrays at depth 2 or 3
+    brackets = []
+    offset = 0
+    depth = 0
+    in_string = 0
+    escape_next = False
+    with open(path, 'rb') as f:
+        while True:
+            chunk = np.frombuffer(f.read(chunk_size), dtype=np.uint8)
+            if len(chunk) == 0:
+                break
+            # Backslashes only appear in strings and are rare
+            escaped = np.zeros(len(chunk), dtype=np.bool_)
+            escaped[0] = escape_next
+            escape_next = False
+            for i in np.flatnonzero(chunk == ord('\\')):
+                if escaped[i]:
+                    continue
+                if i + 1 < len(chunk):
+                    escaped[i + 1] = True
+                else:
+                    escape_next = True
+            quotes = (chunk == ord('"')) & ~escaped
+            # 1 inside strings (and for opening quotes)
+            string_mask = (np.cumsum(quotes, dtype=np.int64) + in_string) & 1
+            in_string = string_mask[-1]
+            outside = string_mask == 0
+            opens = ((chunk == ord('{')) | (chunk == ord('['))) & outside
+            closes = ((chunk == ord('}')) | (chunk == ord(']'))) & outside
+            depth_after = depth + np.cumsum(
+                opens.astype(np.int64) - closes, dtype=np.int64)
+            depth = depth_after[-1]
+            # Closing brackets leave the depth of their object
+            for position in np.flatnonzero(opens & (
+                (depth_after == 2) | (depth_after == 3))):
+                brackets.append((offset + position, True, None))
+            for position in np.flatnonzero(closes & (
+                (depth_after == 1) | (depth_after == 2))):
+                brackets.append(
+                    (offset + position, False, depth_after[position] + 1))
+            offset += len(chunk)
+
+        # Pair up opening and closing brackets
+        ranges = {2: [], 3: []}
+        stack = []
+        for position, is_open, bracket_depth in sorted(brackets):
+            if is_open:
+                stack.append(position)
+            else:
+                ranges[bracket_depth].append((stack.pop(), position + 1))
+        for start, end in ranges[2]:
+            if _read_key(f, start) == 'agents':
+                agents_range = (start, end)
+                break
+        else:
+            return None
+        agent_ranges = {}
+        for start, end in ranges[3]:
+            if agents_range[0] < start < agents_range[1]:
+                agent_ranges[_read_key(f, start)] = (start, end)
+    return agents_range, agent_ranges
+
+
+def _load_agent(path, start, end, output_path):
+    """Decodes an agent from a colony JSON file and saves it as a
+    checkpoint"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        agent = json.loads(f.read(end - start))
+    agent = deserialize_value(agent)
+    agent.pop('deriver_skips', None)
+    write_checkpoint(output_path, numpy_molecules(agent))
+    return output_path
+
+
+def _load_agents(path, agent_ranges, n_workers, tmp_dir):
+    """Decodes agents in worker processes through files in a new
+    temporary directory in tmp_dir"""
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as tmp_dir:
+        with concurrent.futures.ProcessPoolExecutor(n_workers) as executor:
+            futures = {
+                agent_id: executor.submit(_load_agent, path, start, end,
+                    os.path.join(tmp_dir, f'{i}.ckpt'))
+                for i, (agent_id, (start, end)) in enumerate(
+                    agent_ranges.items())
+            }
+            # Memory stays mapped after the files are deleted
+            return {
+                agent_id: read_checkpoint(future.result())
+                for agent_id, future in futures.items()
+            }
+
+
+def load_colony_states(path, n_workers=None, ranges=None, tmp_dir=None):
+    """
+    Loads a colony JSON file, decoding agents in parallel. Agents are
+    read directly from the file by each worker, and their Numpy arrays
+    are memory-mapped from shared memory by the parent process instead
+    of being pickled.
+
+    Args:
+        path: Colony JSON file
+        n_workers: Number of worker processes (default: number of CPUs)
+        ranges: Output of get_agent_ranges (computed if not given)
+        tmp_dir: Directory to pass decoded agents through (default:
+            SHARED_MEMORY_DIR, falling back to the default temporary
+            directory if writing to it fails)
+    """
+    agents_range, agent_ranges = ranges or get_agent_ranges(path)
+    with open(path, 'rb') as f:
+        before = f.read(agents_range[0])
+        f.seek(agents_range[1])
+        after = f.read()
+    states = deserialize_value(json.loads(before + b'{}' + after))
+
+    n_workers = min(n_workers or os.cpu_count(), max(len(agent_ranges), 1))
+    if tmp_dir is not None or SHARED_MEMORY_DIR is None:
+        states['agents'] = _load_agents(
+            path, agent_ranges, n_workers, tmp_dir)
+    else:
+        try:
+            states['agents'] = _load_agents(
+                path, agent_ranges, n_workers, SHARED_MEMORY_DIR)
+        except OSError as e:
+            print(f'Warning: decoding agents through {SHARED_MEMORY_DIR}'
+                f' failed ({e!r}), using the default temporary directory.')
+            states['agents'] = _load_agents(
+                path, agent_ranges, n_workers, None)
+    return infinitize_environment(states)
+
+
+def load_numpy_states(path, n_workers=None):
+    """
+    Loads a JSON state file with unique and bulk molecules as Numpy
+    structured arrays. Use get_state_from_file to get an initial state.
+    """
+    # Decode agents of colony states in parallel
+    if is_colony_file(path):
+        ranges = get_agent_ranges(path)
+        if ranges is not None:
+            return load_colony_states(path, n_workers, ranges)
+
+    serialized_state = load_states(path)
+    deserialized_states = deserialize_value(serialized_state)
+    return numpy_molecules(deserialized_states)
+
+
+def json_to_checkpoint(path, checkpoint_path=None):
+    """
+    Converts a JSON state file (e.g. data/wcecoli_t0.json) to a binary
+    checkpoint (by default, data/wcecoli_t0.ckpt)
+    """
+    checkpoint_path = checkpoint_path or get_checkpoint_path(path)
+    write_checkpoint(checkpoint_path, load_numpy_states(path))
+    return checkpoint_path
+
+
+def checkpoint_to_json(checkpoint_path, path=None):
+    """
+    Converts a binary checkpoint (e.g. data/wcecoli_t0.ckpt) to a JSON
+    state file (by default, data/wcecoli_t0.json)
+    """
+    path = path or os.path.splitext(checkpoint_path)[0] + '.json'
+    states = read_checkpoint(checkpoint_path, mmap=False)
+    if 'agents' in states:
+        for agent_state in states['agents'].values():
+            add_dtypes(agent_state)
+    elif 'bulk' in states:
+        add_dtypes(states)
+    write_json(path, serialize_value(states))
+    return path
+
+
 def get_state_from_file( 
     path="data/wcecoli_t0.json",
+    n_workers=None,
 ):
-    serialized_state = load_states(path)
-    # Parallelize deserialization of colony states
-    if 'agents' in serialized_state:
-        agents = serialized_state.pop('agents')
-        n_agents = len(agents)
-        with concurrent.futures.ProcessPoolExecutor(n_agents) as executor:
-            deserialized_agents = executor.map(
-                deserialize_value, agents.values())
-        numpy_agents = []
-        for agent in deserialized_agents:
+    """
+    Loads an initial state from a JSON file or, if it exists, the binary
+    checkpoint with the same name (see ecoli/states/checkpoint.py). Agents
+    in colony JSON files are decoded by n_workers processes (default:
+    number of CPUs).
+    """
+    checkpoint_path = get_checkpoint_path(path)
+    if os.path.isdir(checkpoint_path):
+        states = infinitize_environment(read_checkpoint(checkpoint_path))
+        for agent in states.get('agents', {}).values():
             agent.pop('deriver_skips', None)
-            numpy_agents.append(numpy_molecules(agent))
-        agents = dict(zip(agents.keys(), numpy_agents))
-        states = deserialize_value(serialized_state)
-        states['agents'] = agents
+    else:
+        states = load_numpy_states(path, n_workers)
+    if 'agents' in states:
         return colony_initial_state(states)
-    
-    deserialized_states = deserialize_value(serialized_state)
-    states = numpy_molecules(deserialized_states)
+
     # If evolvers_ran is False, we can get an infinite loop of
     # neither evolvers nor requesters running. No saved state should
     # include evolvers_ran=False.
@@ -119,3 +359,54 @@ def get_state_from_file(
     }
     initial_state["process_state"] = {"polypeptide_elongation": {}}
     return initial_state
+
+
+def test_load_colony_states():
+    bulk = np.array([('A[c]', 1), ('B"}[c]', 2)],
+        dtype=[('id', '<U10'), ('count', '<i8')])
+    unique = np.zeros(2, dtype=[('unique_index', '<i8'), ('massDiff', '<f8')])
+    agent = add_dtypes({
+        'bulk': bulk,
+        'unique': {'active_RNAP': unique},
+        'environment': {'GLC': '__INFINITY__'},
+        'deriver_skips': {},
+    })
+    states = serialize_value({
+        'agents': {'0': agent, '01\\"{': agent},
+        'fields': {'GLC': [[1.0, 2.0]]},
+        'time': 10.0,
+    })
+    global SHARED_MEMORY_DIR
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'colony.json')
+        write_json(path, states)
+        agents_range, agent_ranges = get_agent_ranges(path, chunk_size=7)
+        assert list(agent_ranges) == ['0', '01\\"{']
+        assert is_colony_file(path, chunk_size=5)
+        loaded = load_numpy_states(path, n_workers=1)
+
+        # Agents are decoded through the default temporary directory if
+        # the shared memory directory fails
+        shared_memory_dir = SHARED_MEMORY_DIR
+        SHARED_MEMORY_DIR = os.path.join(tmp_dir, 'missing')
+        try:
+            fallback = load_colony_states(path, n_workers=1)
+        finally:
+            SHARED_MEMORY_DIR = shared_memory_dir
+        np.testing.assert_array_equal(fallback['agents']['0']['bulk'], bulk)
+
+        # Single-cell files are not scanned for agents
+        cell_path = os.path.join(tmp_dir, 'cell.json')
+        write_json(cell_path, serialize_value(agent))
+        assert not is_colony_file(cell_path, chunk_size=5)
+        cell = load_numpy_states(cell_path)
+        np.testing.assert_array_equal(cell['bulk'], bulk)
+    assert loaded['fields'] == states['fields']
+    assert loaded['time'] == 10.0
+    for agent_id in ('0', '01\\"{'):
+        loaded_agent = loaded['agents'][agent_id]
+        np.testing.assert_array_equal(loaded_agent['bulk'], bulk)
+        np.testing.assert_array_equal(
+            loaded_agent['unique']['active_RNAP'], unique)
+        assert loaded_agent['environment']['GLC'] == float('inf')
+        assert 'deriver_skips' not in loaded_agent
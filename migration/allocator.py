@@ -56,7 +56,10 @@ def run_and_compare(init_time):
         proc_name = viv_to_wc_proc.get(process, None)
         if proc_name is None or proc_name in skip_processes_wc:
             continue
-        actual_allocated[proc_name] = proc_alloc['bulk']
+        # Allocations only include requested molecules
+        alloc_idx, alloc_counts = proc_alloc['bulk']
+        actual_allocated[proc_name] = np.zeros(len(bulk_idx), dtype=int)
+        actual_allocated[proc_name][alloc_idx] = alloc_counts
     
     # Compare to wcEcoli partitioned counts
     with open(f"data/migration/bulk_partitioned_t{init_time}.json", 'r') as f:
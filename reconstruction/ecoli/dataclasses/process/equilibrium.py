@@ -188,14 +188,19 @@ class Equilibrium(object):
 		return data.dissoc_strict(self.__dict__, (
 			'_stoichMatrix',
 			'Rp', 'Pp', 'mets_to_rxn_fluxes',
-			'symbolic_rates', 'symbolic_rates_jacobian',
 			'_rates', '_rates_jacobian'))
 
 	def __setstate__(self, state):
-		"""Restore instance attributes, recomputing some of them."""
+		"""Restore instance attributes, recomputing some of them. Functions
+		are rebuilt from their pickled source code expressions if present
+		(skipping sympy) and loaded from the on-disk build_ode cache."""
 		self.__dict__.update(state)
 		self._stoichMatrix = self.stoich_matrix()
-		self._populateDerivativeAndJacobian()
+		if '_rates_expressions' in state:
+			self._makeMatrices()
+			self._build_rates()
+		else:
+			self._populateDerivativeAndJacobian()
 
 	def stoich_matrix(self):
 		'''
@@ -266,11 +271,23 @@ class Equilibrium(object):
 	def _populateDerivativeAndJacobian(self):
 		'''Compile callable functions for computing the derivative and the Jacobian.'''
 		self._makeMatrices()
-		self._make_rates()
-
-		self._rates = build_ode.rates(self.symbolic_rates)
-		self._rates_jacobian = build_ode.rates_jacobian(
-			self.symbolic_rates_jacobian)
+		self._rates_expressions = build_ode.cached_expressions(
+			('Equilibrium._make_rates', self._stoichMatrixI,
+				self._stoichMatrixJ, self._stoichMatrixV),
+			self._make_rate_expressions)
+		self._build_rates()
+
+	def _make_rate_expressions(self):
+		rates, rates_jacobian = self._make_rates()
+		return (build_ode.vector_expression(rates),
+			build_ode.matrix_expression(rates_jacobian))
+
+	def _build_rates(self):
+		rates, rates_jacobian = self._rates_expressions
+		self._rates = build_ode.build_functions(
+			build_ode.RATES_ARGUMENTS, rates)
+		self._rates_jacobian = build_ode.build_functions(
+			build_ode.RATES_ARGUMENTS, rates_jacobian)
 
 	def _makeMatrices(self):
 		'''
@@ -300,7 +317,7 @@ class Equilibrium(object):
 
 	def _make_rates(self):
 		'''
-		Creates symbolic representation of the rates for ordinary differential
+		Returns symbolic representation of the rates for ordinary differential
 		equations and the Jacobian. Used during simulations.
 		'''
 		S = self.stoich_matrix()
@@ -352,8 +369,7 @@ class Equilibrium(object):
 		dy = sp.Matrix(rates)
 		J = dy.jacobian(y)
 
-		self.symbolic_rates = dy
-		self.symbolic_rates_jacobian = J
+		return dy, J
 
 	def derivatives(self, t, y):
 		return self._stoichMatrix.dot(self._rates[0](t, y, self.rates_fwd, self.rates_rev))
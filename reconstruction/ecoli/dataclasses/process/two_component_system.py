@@ -195,16 +195,19 @@ class TwoComponentSystem(object):
 		that don't pickle.
 		"""
 		return data.dissoc_strict(self.__dict__, (
-			'symbolic_rates', 'symbolic_rates_jacobian',
-			'derivatives_parca_symbolic', 'derivatives_parca_jacobian_symbolic',
 			'_rates', '_rates_jacobian',
 			'derivatives_parca', 'derivatives_parca_jacobian',
 			'dependency_matrix', '_stoich_matrix'))
 
 	def __setstate__(self, state):
-		"""Restore instance attributes, recomputing some of them."""
+		"""Restore instance attributes, recomputing some of them. Functions
+		are rebuilt from their pickled source code expressions if present
+		(skipping sympy) and loaded from the on-disk build_ode cache."""
 		self.__dict__.update(state)
-		self._populate_derivative_and_jacobian()
+		if '_derivative_expressions' in state:
+			self._build_derivatives()
+		else:
+			self._populate_derivative_and_jacobian()
 		self.dependency_matrix = self._make_dependency_matrix()
 
 	def _buildComplexToMonomer(self, modifiedFormsMonomers, tcsMolecules):
@@ -299,16 +302,36 @@ class TwoComponentSystem(object):
 
 	def _populate_derivative_and_jacobian(self):
 		'''Compile callable functions for computing the derivative and the Jacobian.'''
-		self._make_derivative()
-		self._make_derivative_parca()
-
-		self._rates = build_ode.derivatives(self.symbolic_rates)
-		self._rates_jacobian = build_ode.derivatives_jacobian(self.symbolic_rates_jacobian)
+		self._derivative_expressions = build_ode.cached_expressions(
+			('TwoComponentSystem._make_derivative', self._stoichMatrixI,
+				self._stoichMatrixJ, self._stoichMatrixV, self.rates_fwd,
+				self.rates_rev, self.molecule_names),
+			self._make_derivative_expressions)
+		self._build_derivatives()
+
+
+	def _make_derivative_expressions(self):
+		rates, rates_jacobian = self._make_derivative()
+		parca, parca_jacobian = self._make_derivative_parca()
+		return (build_ode.vector_expression(rates),
+			build_ode.matrix_expression(rates_jacobian),
+			build_ode.vector_expression(parca),
+			build_ode.matrix_expression(parca_jacobian))
+
+
+	def _build_derivatives(self):
+		rates, rates_jacobian, parca, parca_jacobian = self._derivative_expressions
+		self._rates = build_ode.build_functions(
+			build_ode.DERIVATIVES_ARGUMENTS, rates)
+		self._rates_jacobian = build_ode.build_functions(
+			build_ode.DERIVATIVES_ARGUMENTS, rates_jacobian)
 		self._stoich_matrix = self.stoich_matrix()  # Matrix is small and can be cached for derivatives
 
 		# WORKAROUND: Avoid Numba LoweringError JIT-compiling these functions:
-		self.derivatives_parca = build_ode.derivatives(self.derivatives_parca_symbolic)[0]
-		self.derivatives_parca_jacobian = build_ode.derivatives_jacobian(self.derivatives_parca_jacobian_symbolic)[0]
+		self.derivatives_parca = build_ode.build_functions(
+			build_ode.DERIVATIVES_ARGUMENTS, parca)[0]
+		self.derivatives_parca_jacobian = build_ode.build_functions(
+			build_ode.DERIVATIVES_ARGUMENTS, parca_jacobian)[0]
 
 
 	def _make_y_dy(self):
@@ -345,7 +368,7 @@ class TwoComponentSystem(object):
 
 	def _make_derivative(self):
 		'''
-		Creates symbolic representation of the ordinary differential equations
+		Returns symbolic representation of the ordinary differential equations
 		and the Jacobian. Used during simulations.
 		'''
 		y, rates = self._make_y_dy()
@@ -353,13 +376,12 @@ class TwoComponentSystem(object):
 		rates = sp.Matrix(rates)
 		J = rates.jacobian(y)
 
-		self.symbolic_rates = rates
-		self.symbolic_rates_jacobian = J
+		return rates, J
 
 
 	def _make_derivative_parca(self):
 		'''
-		Creates symbolic representation of the ordinary differential equations
+		Returns symbolic representation of the ordinary differential equations
 		and the Jacobian assuming ATP, ADP, Pi, water and protons are at
 		steady state. Used in the parca.
 		'''
@@ -375,8 +397,7 @@ class TwoComponentSystem(object):
 		dy = sp.Matrix(dy)
 		J = dy.jacobian(y)
 
-		self.derivatives_parca_jacobian_symbolic = J
-		self.derivatives_parca_symbolic = dy
+		return dy, J
 
 
 	def molecules_to_next_time_step(self, moleculeCounts, cellVolume,
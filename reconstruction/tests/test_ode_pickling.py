@@ -0,0 +1,152 @@
+"""Unit test for pickling the ODE functions of Equilibrium and TwoComponentSystem."""
+from __future__ import absolute_import, division, print_function
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import numpy.testing as npt
+
+from reconstruction.ecoli.dataclasses.process.equilibrium import Equilibrium
+from reconstruction.ecoli.dataclasses.process.two_component_system import (
+	TwoComponentSystem)
+from wholecell.utils import build_ode
+
+
+def make_equilibrium():
+	"""Make an Equilibrium with A[c] + B[c] <-> AB[c], skipping raw_data."""
+	equilibrium = Equilibrium.__new__(Equilibrium)
+	equilibrium.molecule_names = ['A[c]', 'B[c]', 'AB[c]']
+	equilibrium.rxn_ids = ['AB_RXN']
+	equilibrium._stoichMatrixI = np.array([0, 1, 2])
+	equilibrium._stoichMatrixJ = np.array([0, 0, 0])
+	equilibrium._stoichMatrixV = np.array([-1., -1., 1.])
+	equilibrium._stoichMatrixMass = np.array([1., 2., 3.])
+	equilibrium.rates_fwd = np.array([2.])
+	equilibrium.rates_rev = np.array([0.5])
+	equilibrium._populateDerivativeAndJacobian()
+	equilibrium._stoichMatrix = equilibrium.stoich_matrix()
+	return equilibrium
+
+
+def make_two_component_system():
+	"""Make a TwoComponentSystem that phosphorylates HK[c] with ATP[c] and
+	dephosphorylates it again, skipping raw_data."""
+	system = TwoComponentSystem.__new__(TwoComponentSystem)
+	system.molecule_names = np.array(['HK[c]', 'ATP[c]', 'PHOSPHO-HK[c]',
+		'ADP[c]', 'PROTON[c]', 'WATER[c]', 'Pi[c]'], dtype='U')
+	system.rxn_ids = ['HK_PHOSPHORYLATION', 'HK_DEPHOSPHORYLATION']
+	system._stoichMatrixI = np.array([0, 1, 2, 3, 4, 2, 5, 0, 6])
+	system._stoichMatrixJ = np.array([0, 0, 0, 0, 0, 1, 1, 1, 1])
+	system._stoichMatrixV = np.array([-1., -1., 1., 1., 1., -1., -1., 1., 1.])
+	system.rates_fwd = np.array([3., 0.25])
+	system.rates_rev = np.array([0.1, 0.])
+	system.independent_molecules = np.array(['ATP[c]', 'HK[c]'], dtype='U')
+	system.independent_molecule_indexes = np.array([1, 0])
+	system.independent_to_dependent_molecules = {'HK[c]': 'PHOSPHO-HK[c]'}
+	system._populate_derivative_and_jacobian()
+	system.dependency_matrix = system._make_dependency_matrix()
+	return system
+
+
+class Test_OdePickling(unittest.TestCase):
+	def setUp(self):
+		self.original_cache_dir = build_ode.ODE_CACHE_DIR
+		self.tmp_dir = tempfile.mkdtemp()
+		build_ode.ODE_CACHE_DIR = os.path.join(self.tmp_dir, 'ode')
+		build_ode._EXPRESSIONS.clear()
+		self.y = np.array([1.5, 0.5, 0.25, 2., 1., 3., 0.75])
+
+	def tearDown(self):
+		build_ode.ODE_CACHE_DIR = self.original_cache_dir
+		build_ode._EXPRESSIONS.clear()
+		shutil.rmtree(self.tmp_dir)
+
+	def assert_same_derivatives(self, expected, actual, y):
+		for method in ('derivatives', 'derivatives_jacobian',
+				'derivatives_jit', 'derivatives_jacobian_jit'):
+			npt.assert_array_equal(
+				getattr(expected, method)(0, y), getattr(actual, method)(0, y))
+
+	def test_equilibrium_pickle(self):
+		equilibrium = make_equilibrium()
+		y = self.y[:3]
+		self.assertEqual(equilibrium.derivatives(0, y).shape, (3,))
+		self.assertEqual(equilibrium.derivatives_jacobian(0, y).shape, (3, 3))
+
+		unpickled = pickle.loads(pickle.dumps(equilibrium))
+		self.assertEqual(
+			unpickled._rates_expressions, equilibrium._rates_expressions)
+		self.assert_same_derivatives(equilibrium, unpickled, y)
+		npt.assert_array_equal(unpickled.Rp, equilibrium.Rp)
+		npt.assert_array_equal(
+			unpickled.mets_to_rxn_fluxes, equilibrium.mets_to_rxn_fluxes)
+
+		# Pickles without expressions rebuild them (from the cache)
+		state = equilibrium.__getstate__()
+		del state['_rates_expressions']
+		old_pickle = Equilibrium.__new__(Equilibrium)
+		old_pickle.__setstate__(state)
+		self.assert_same_derivatives(equilibrium, old_pickle, y)
+
+	def test_two_component_system_pickle(self):
+		system = make_two_component_system()
+		unpickled = pickle.loads(pickle.dumps(system))
+		self.assertEqual(
+			unpickled._derivative_expressions, system._derivative_expressions)
+		self.assert_same_derivatives(system, unpickled, self.y)
+		for method in ('derivatives_parca', 'derivatives_parca_jacobian'):
+			npt.assert_array_equal(getattr(system, method)(self.y, 0.),
+				getattr(unpickled, method)(self.y, 0.))
+		npt.assert_array_equal(
+			unpickled.dependency_matrix, system.dependency_matrix)
+
+	def test_stoichiometry_changes_cache_key(self):
+		# Like LoadSimData adding the marR-tet reaction, then rebuilding
+		equilibrium = make_equilibrium()
+		expressions = equilibrium._rates_expressions
+		built = []
+		make_rate_expressions = equilibrium._make_rate_expressions
+		def count_builds():
+			built.append(True)
+			return make_rate_expressions()
+		equilibrium._make_rate_expressions = count_builds
+
+		equilibrium._populateDerivativeAndJacobian()
+		self.assertEqual(built, [])
+		self.assertEqual(equilibrium._rates_expressions, expressions)
+
+		equilibrium._stoichMatrixI = np.append(equilibrium._stoichMatrixI, [0, 3])
+		equilibrium._stoichMatrixJ = np.append(equilibrium._stoichMatrixJ, [1, 1])
+		equilibrium._stoichMatrixV = np.append(equilibrium._stoichMatrixV, [-2., 1.])
+		equilibrium.rates_fwd = np.append(equilibrium.rates_fwd, 1.)
+		equilibrium.rates_rev = np.append(equilibrium.rates_rev, 1.)
+		equilibrium._populateDerivativeAndJacobian()
+		equilibrium._stoichMatrix = equilibrium.stoich_matrix()
+		self.assertEqual(len(built), 1)
+		self.assertNotEqual(equilibrium._rates_expressions, expressions)
+		y = self.y[:4]
+		self.assertEqual(equilibrium.derivatives(0, y).shape, (4,))
+		# dA/dt = -kf0 A B + kr0 AB - 2 (kf1 A^2 - kr1^2 A2)
+		self.assertAlmostEqual(equilibrium.derivatives(0, y)[0],
+			-2. * 1.5 * 0.5 + 0.5 * 0.25 - 2. * (1.5 ** 2 - 2.))
+
+		del equilibrium._make_rate_expressions
+		unpickled = pickle.loads(pickle.dumps(equilibrium))
+		self.assert_same_derivatives(equilibrium, unpickled, y)
+
+		# The two component system key includes its rate constants
+		system = make_two_component_system()
+		expressions = system._derivative_expressions
+		system.rates_fwd = system.rates_fwd * 2
+		system._populate_derivative_and_jacobian()
+		self.assertNotEqual(system._derivative_expressions, expressions)
+		self.assertFalse(np.allclose(system.derivatives(0, self.y),
+			make_two_component_system().derivatives(0, self.y)))
+
+
+if __name__ == '__main__':
+	unittest.main()
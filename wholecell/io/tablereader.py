@@ -2,11 +2,12 @@
 from __future__ import absolute_import, division, print_function
 
 from chunk import Chunk
+import collections
+from concurrent.futures import ThreadPoolExecutor
 import os
 import json
 import numpy as np
-from typing import Any, Callable, Iterable, List, Text, Tuple, Union
-import zlib
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Text, Tuple, Union
 
 from wholecell.utils import filepath
 from . import tablewriter as tw
@@ -20,7 +21,7 @@ __all__ = [
 	"VariableLengthColumnError",
 	]
 
-SUPPORTED_COMPRESSION_TYPES = (tw.COMPRESSION_TYPE_NONE, tw.COMPRESSION_TYPE_ZLIB)
+SUPPORTED_COMPRESSION_TYPES = tuple(tw.CODECS)
 SUBCOLUMNS_KEY = "subcolumns"
 
 
@@ -76,8 +77,9 @@ class _ColumnHeader(object):
 			self.compression_type) = tw.COLUMN_STRUCT.unpack(header_struct)
 
 		if self.compression_type not in SUPPORTED_COMPRESSION_TYPES:
-			raise VersionError('Unsupported Column compression type {}'.format(
-				self.compression_type))
+			raise VersionError('Unsupported Column compression type {}.'
+				' Install lz4 or zstandard to read columns compressed with'
+				' them.'.format(self.compression_type))
 
 		descr_json = chunk.read()
 		descr = json.loads(descr_json)
@@ -91,12 +93,50 @@ class _ColumnHeader(object):
 			self.dtype = [(str(n), str(t)) for n, t in descr]
 
 
+def _read_block_index(data_file):
+	# type: (Any) -> Optional[np.ndarray]
+	'''
+	Read the block index chunk at the end of a column file.
+
+	Returns:
+		A (number of blocks + 1) x 2 array of (first row, file offset) of each
+		block, followed by (total rows, file offset of the index chunk), or
+		None if the column has no block index (e.g. it was written before
+		block indexes were added).
+	'''
+	data_file.seek(0, os.SEEK_END)
+	file_size = data_file.tell()
+	if file_size < tw.INDEX_FOOTER_STRUCT.size:
+		return None
+
+	data_file.seek(file_size - tw.INDEX_FOOTER_STRUCT.size)
+	(num_index_rows,) = tw.INDEX_FOOTER_STRUCT.unpack(
+		data_file.read(tw.INDEX_FOOTER_STRUCT.size))
+	index_bytes = num_index_rows * 2 * tw.INDEX_CHUNK_DTYPE.itemsize
+	chunk_size = index_bytes + tw.INDEX_FOOTER_STRUCT.size
+	chunk_start = file_size - chunk_size - tw.CHUNK_HEADER.size
+	if num_index_rows < 2 or chunk_start < 0:
+		return None
+
+	data_file.seek(chunk_start)
+	chunk_type, size = tw.CHUNK_HEADER.unpack(
+		data_file.read(tw.CHUNK_HEADER.size))
+	if chunk_type != tw.INDEX_CHUNK_TYPE or size != chunk_size:
+		return None
+
+	index = np.frombuffer(data_file.read(index_bytes), tw.INDEX_CHUNK_DTYPE)
+	return index.reshape(num_index_rows, 2).astype(np.int64)
+
+
 class TableReader(object):
 	"""
 	Reads output generated by TableWriter.
 
 	Parameters:
 		path (str): Path to the input location (a directory).
+		threads (int): Number of threads to decompress data blocks on in
+			readColumn(). 0 or 1 decompresses on the calling thread. Helps for
+			large columns since zlib, lz4, and zstd release the GIL.
 
 	See also
 	--------
@@ -106,9 +146,10 @@ class TableReader(object):
 	"docs/misc/byte_strings_to_2D_arrays.md"
 	"""
 
-	def __init__(self, path):
-		# type: (str) -> None
+	def __init__(self, path, threads=0):
+		# type: (str, int) -> None
 		self._path = path
+		self._threads = threads
 
 		# Read the table's attributes file
 		attributes_filename = os.path.join(path, tw.FILE_ATTRIBUTES)
@@ -153,8 +194,8 @@ class TableReader(object):
 		return self._attributes[name]
 
 
-	def readColumn(self, name, indices=None, squeeze=True):
-		# type: (str, Any, bool) -> np.ndarray
+	def readColumn(self, name, indices=None, squeeze=True, rows=None):
+		# type: (str, Any, bool, Any) -> np.ndarray
 		"""
 		Load a full column (all rows). Each row entry is a 1-D NumPy array of
 		subcolumns, so the initial result is a 2-D array row x subcolumn, which
@@ -192,6 +233,11 @@ class TableReader(object):
 				1 row x 1 subcolumn => 0D.
 				n rows x 1 subcolumn or 1 row x m subcolumns => 1D.
 				n rows x m subcolumns => 2D.
+			rows: The rows to read, as a slice or an array of row indices, or
+				None for all rows. Only the blocks that contain these rows are
+				read and decompressed (uncompressed fixed-length columns are
+				memory-mapped), using the block index at the end of the column
+				file. Columns without a block index are read in full.
 
 		Returns:
 			ndarray: A writable 0D, 1D, or 2D array.
@@ -208,11 +254,9 @@ class TableReader(object):
 			measure_bulk_reader.py. The differences are more pronounced for a
 			smaller table like BulkMolecules/atpRequested.
 		"""
-		def decomp(raw_block):
+		def unpack(data):
 			# type: (bytes) -> np.ndarray
-			'''Decompress and unpack a raw block to an ndarray.'''
-			data = decompressor(raw_block)
-
+			'''Unpack a decompressed block to an ndarray.'''
 			if variable_length:
 				entries_ = np.frombuffer(data, header.dtype)
 			else:
@@ -226,6 +270,13 @@ class TableReader(object):
 		if name not in self._columnNames:
 			raise DoesNotExistError("No such column: {}".format(name))
 
+		if rows is not None:
+			result, variable_length = self._readRows(name, indices, rows)
+			# Variable-length columns should not be squeezed.
+			if squeeze and not variable_length:
+				result = result.squeeze()
+			return result
+
 		entry_blocks = []  # type: List[bytes]
 		row_size_blocks = []
 
@@ -244,10 +295,7 @@ class TableReader(object):
 			if variable_length:
 				squeeze = False
 
-			if header.compression_type == tw.COMPRESSION_TYPE_ZLIB:
-				decompressor = lambda data_bytes: zlib.decompress(data_bytes)  # type: Callable[[bytes], bytes]
-			else:
-				decompressor = lambda data_bytes: data_bytes
+			decompressor = tw.CODECS[header.compression_type][1]  # type: Callable[[bytes], bytes]
 
 			while True:
 				try:
@@ -289,8 +337,10 @@ class TableReader(object):
 			result = np.full((len(all_row_sizes), all_row_sizes.max()), np.nan)
 
 			row = 0
-			for raw_entry, row_sizes_ in zip(entry_blocks, row_sizes_list):
-				entries = decomp(raw_entry)
+			for data, row_sizes_ in zip(
+					self._decompress_blocks(entry_blocks, decompressor),
+					row_sizes_list):
+				entries = unpack(data)
 				entry_idx = 0
 
 				# Fill each row with the length given by values in row_sizes_
@@ -302,15 +352,15 @@ class TableReader(object):
 		# Constant-length columns
 		else:
 			# Decompress the last block to get its shape, then allocate the result.
-			last_entries = decomp(entry_blocks.pop())
+			last_entries = unpack(decompressor(entry_blocks.pop()))
 			last_num_rows = last_entries.shape[0]
 			num_rows = len(entry_blocks) * header.entries_per_block + last_num_rows
 			num_subcolumns = header.elements_per_entry if indices is None else len(indices)
 			result = np.zeros((num_rows, num_subcolumns), header.dtype)
 
 			row = 0
-			for raw_entry in entry_blocks:
-				entries = decomp(raw_entry)
+			for data in self._decompress_blocks(entry_blocks, decompressor):
+				entries = unpack(data)
 				additional_rows = entries.shape[0]
 				result[row : (row + additional_rows)] = entries
 				row += additional_rows
@@ -324,8 +374,149 @@ class TableReader(object):
 		return result
 
 
-	def readSubcolumn(self, column, subcolumn_name):
-		# type: (str, str) -> np.ndarray
+	def _readRows(self, name, indices, rows):
+		# type: (str, Any, Any) -> Tuple[np.ndarray, bool]
+		"""
+		Read the given rows of a column as a 2-D array, using the block index
+		to read and decompress only the blocks that contain them.
+
+		Returns:
+			The rows and whether the column is variable-length.
+		"""
+		path = os.path.join(self._path, name)
+		with open(path, 'rb') as dataFile:
+			chunk = Chunk(dataFile, align=False)
+			header = _ColumnHeader(chunk)
+			variable_length = header.variable_length
+			chunk.close()
+
+			if variable_length and indices is not None:
+				raise VariableLengthColumnError(
+					'Attempted to access subcolumns of a variable-length column {}.'.format(name))
+
+			block_index = _read_block_index(dataFile)
+			if block_index is None:
+				# Read the whole column
+				column = self.readColumn(name, indices, squeeze=False)
+				return column[rows], variable_length
+
+			selected = np.arange(block_index[-1, 0])[rows]
+			if selected.ndim != 1:
+				raise ValueError('rows must select a 1-D array of rows')
+			first_row = selected.min() if selected.size else 0
+			end_row = selected.max() + 1 if selected.size else 0
+
+			# (First row, end row, file offset) of the blocks that overlap
+			# [first_row, end_row)
+			block_starts = block_index[:-1, 0]
+			blocks = [
+				(block_index[i, 0], block_index[i + 1, 0], block_index[i, 1])
+				for i in range(
+					np.searchsorted(block_starts, first_row, 'right') - 1,
+					np.searchsorted(block_starts, end_row, 'left'))
+				] if selected.size else []
+
+			# Memory-map uncompressed fixed-length data instead of reading it
+			mapped = (header.compression_type == tw.COMPRESSION_TYPE_NONE
+				and not variable_length)
+
+			# Read the row size chunks and the data chunks (or their offsets)
+			entry_blocks = []  # type: List[Any]
+			row_sizes_list = []  # type: List[np.ndarray]
+			for _, _, offset in blocks:
+				dataFile.seek(offset)
+				if variable_length:
+					chunk = Chunk(dataFile, align=False)
+					row_sizes_list.append(
+						np.frombuffer(chunk.read(), tw.ROW_SIZE_CHUNK_DTYPE))
+					chunk.close()
+
+				chunk = Chunk(dataFile, align=False)
+				if chunk.getname() != tw.BLOCK_CHUNK_TYPE:
+					raise VersionError(
+						'Block index of column {} does not point to a data'
+						' block'.format(name))
+				entry_blocks.append(dataFile.tell() if mapped else chunk.read())
+				chunk.close()
+
+		num_rows = end_row - first_row
+		if variable_length:
+			row_sizes = [
+				sizes[max(first_row - start, 0):end_row - start]
+				for (start, _, _), sizes in zip(blocks, row_sizes_list)]
+			max_row_size = max([sizes.max() for sizes in row_sizes if sizes.size] or [0])
+			result = np.full((num_rows, max_row_size), np.nan)
+		else:
+			num_subcolumns = header.elements_per_entry if indices is None else len(
+				np.arange(header.elements_per_entry)[indices])
+			result = np.zeros((num_rows, num_subcolumns), header.dtype)
+
+		if mapped:
+			file_map = np.memmap(path, np.uint8, 'r') if blocks else None
+		else:
+			decompressor = tw.CODECS[header.compression_type][1]
+			data_blocks = self._decompress_blocks(entry_blocks, decompressor)
+
+		for i, (block_start, block_end, _) in enumerate(blocks):
+			# Rows [start, end) of the block are rows [row, row + end - start)
+			# of the result
+			start = max(first_row, block_start) - block_start
+			end = min(end_row, block_end) - block_start
+			row = block_start + start - first_row
+
+			if mapped:
+				# Only touch the pages of the selected rows
+				entries = np.frombuffer(file_map, header.dtype,
+					count=(end - start) * header.elements_per_entry,
+					offset=entry_blocks[i] + start * header.bytes_per_entry
+					).reshape(-1, header.elements_per_entry)
+			else:
+				entries = np.frombuffer(next(data_blocks), header.dtype)
+
+			if variable_length:
+				offsets = np.zeros(len(row_sizes_list[i]) + 1, np.int64)
+				np.cumsum(row_sizes_list[i], out=offsets[1:])
+				for j in range(start, end):
+					result[row, :offsets[j + 1] - offsets[j]] = entries[
+						offsets[j]:offsets[j + 1]]
+					row += 1
+				continue
+
+			if not mapped:
+				entries = entries.reshape(
+					-1, header.elements_per_entry)[start:end]
+			if indices is not None:
+				entries = entries[:, indices]
+			result[row:row + end - start] = entries
+
+		return result[selected - first_row], variable_length
+
+
+	def _decompress_blocks(self, blocks, decompressor):
+		# type: (List[bytes], Callable[[bytes], bytes]) -> Iterator[bytes]
+		"""
+		Yield the decompressed blocks in order. With multiple threads, only a
+		few blocks per thread are decompressed ahead of the caller to bound the
+		memory use.
+		"""
+		if self._threads <= 1 or len(blocks) <= 1:
+			for block in blocks:
+				yield decompressor(block)
+			return
+
+		max_pending = self._threads * tw.MAX_PENDING_BLOCKS
+		with ThreadPoolExecutor(self._threads) as executor:
+			pending = collections.deque()  # type: collections.deque
+			for block in blocks:
+				pending.append(executor.submit(decompressor, block))
+				if len(pending) >= max_pending:
+					yield pending.popleft().result()
+			while pending:
+				yield pending.popleft().result()
+
+
+	def readSubcolumn(self, column, subcolumn_name, rows=None):
+		# type: (str, str, Any) -> np.ndarray
 		"""Read in a subcolumn from a table by name
 
 		Each column of a table is a 2D matrix. The SUBCOLUMNS_KEY attribute
@@ -337,6 +528,7 @@ class TableReader(object):
 			column: Name of the column.
 			subcolumn_name: Name of the ID or object associated with the
 				desired subcolumn.
+			rows: The rows to read (see readColumn()), or None for all rows.
 
 		Returns:
 			The subcolumn, as a 1-dimensional array.
@@ -344,7 +536,7 @@ class TableReader(object):
 		subcol_name_map = self.readAttribute(SUBCOLUMNS_KEY)
 		subcols = self.readAttribute(subcol_name_map[column])
 		index = subcols.index(subcolumn_name)
-		return self.readColumn(column, [index], squeeze=False)[:, 0]
+		return self.readColumn(column, [index], squeeze=False, rows=rows)[:, 0]
 
 
 	def allAttributeNames(self):
@@ -382,3 +574,108 @@ class TableReader(object):
 			beneficial or necessary.
 		"""
 		pass
+
+
+def test_decompress_blocks():
+	import tempfile
+	import threading
+	import zlib
+
+	with tempfile.TemporaryDirectory() as tmp_dir:
+		writer = tw.TableWriter(tmp_dir)
+		writer.append(x=np.arange(3))
+		writer.close()
+
+		# Only a few blocks per thread are decompressed ahead of the caller
+		blocks = [zlib.compress(bytes([i]) * 100) for i in range(50)]
+		lock = threading.Lock()
+		decompressed = []
+		def decompress(block):
+			with lock:
+				decompressed.append(block)
+			return zlib.decompress(block)
+		reader = TableReader(tmp_dir, threads=2)
+		max_pending = 2 * tw.MAX_PENDING_BLOCKS
+		data_blocks = reader._decompress_blocks(blocks, decompress)
+		assert next(data_blocks) == bytes([0]) * 100
+		assert len(decompressed) <= max_pending
+		assert list(data_blocks) == [bytes([i]) * 100 for i in range(1, 50)]
+		assert len(decompressed) == 50
+
+		# Columns compressed with unknown codecs (or ones that are not
+		# installed) can't be read
+		with open(os.path.join(tmp_dir, 'x'), 'rb') as f:
+			data = f.read()
+		offset = tw.CHUNK_HEADER.size
+		header = list(tw.COLUMN_STRUCT.unpack_from(data, offset))
+		header[-1] = max(tw.CODECS) + 100
+		with open(os.path.join(tmp_dir, 'bogus'), 'wb') as f:
+			f.write(data[:offset] + tw.COLUMN_STRUCT.pack(*header)
+				+ data[offset + tw.COLUMN_STRUCT.size:])
+		try:
+			TableReader(tmp_dir).readColumn('bogus')
+		except VersionError:
+			pass
+		else:
+			raise AssertionError('Unsupported codec was read.')
+		np.testing.assert_array_equal(reader.readColumn('x'), np.arange(3))
+
+
+def test_read_rows():
+	import shutil
+	import tempfile
+
+	fixed = np.arange(200 * 100, dtype=np.float64).reshape(200, 100)
+	variable = [np.arange(i % 7 * 50) + i for i in range(200)]
+	row_selections = [slice(None), slice(35, 97), slice(150, 10, -3),
+		np.array([199, 0, 57, 57, 120]), np.array([], int), fixed[:, 0] % 3 == 0]
+
+	with tempfile.TemporaryDirectory() as tmp_dir:
+		for compression_type in (tw.COMPRESSION_TYPE_NONE, tw.COMPRESSION_TYPE_ZLIB):
+			path = os.path.join(tmp_dir, str(compression_type))
+			writer = tw.TableWriter(path, compression_type)
+			writer.set_variable_length_columns('variable')
+			for fixed_row, variable_row in zip(fixed, variable):
+				writer.append(fixed=fixed_row, variable=variable_row)
+			writer.close()
+
+			# Without a block index, whole columns are read
+			no_index_path = path + '-no-index'
+			shutil.copytree(path, no_index_path)
+			for name in ('fixed', 'variable'):
+				with open(os.path.join(no_index_path, name), 'r+b') as f:
+					block_index = _read_block_index(f)
+					assert len(block_index) > 3
+					f.truncate(block_index[-1, 1])
+					assert _read_block_index(f) is None
+
+			for table_path in (path, no_index_path):
+				reader = TableReader(table_path, threads=2)
+				fixed_reader = TableReader(table_path)
+				if compression_type == tw.COMPRESSION_TYPE_NONE and table_path == path:
+					# Uncompressed fixed-length columns are memory-mapped
+					def no_decompress(blocks, decompressor):
+						raise AssertionError('Decompressed a memory-mapped column.')
+					fixed_reader._decompress_blocks = no_decompress
+				full_variable = reader.readColumn('variable')
+
+				for rows in row_selections:
+					for indices in (None, [3, 1], np.arange(2, 5)):
+						np.testing.assert_array_equal(
+							fixed_reader.readColumn('fixed', indices, squeeze=False, rows=rows),
+							fixed[:, slice(None) if indices is None else indices][rows])
+
+					result = reader.readColumn('variable', rows=rows)
+					expected = full_variable[rows]
+					assert result.shape[0] == expected.shape[0]
+					np.testing.assert_array_equal(result, expected[:, :result.shape[1]])
+					assert np.isnan(expected[:, result.shape[1]:]).all()
+
+				np.testing.assert_array_equal(
+					fixed_reader.readColumn('fixed', rows=[7]), fixed[7])
+				try:
+					reader.readColumn('variable', [0], rows=slice(3))
+				except VariableLengthColumnError:
+					pass
+				else:
+					raise AssertionError('Read subcolumns of a variable-length column.')
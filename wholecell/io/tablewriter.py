@@ -1,11 +1,13 @@
 
 from __future__ import absolute_import, division, print_function
 
+import collections
+from concurrent.futures import ThreadPoolExecutor
 import os
 import json
 import numpy as np
 import struct
-from typing import Any, Dict, List, Optional, Set
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
 import zlib
 
 from wholecell.utils import filepath
@@ -35,6 +37,7 @@ COLUMN_CHUNK_TYPE = b'COLM'  # column file's header chunk
 VARIABLE_COLUMN_CHUNK_TYPE = b'VCOL'  # variable-length column's header chunk
 BLOCK_CHUNK_TYPE = b'BLOC'   # data block chunk
 ROW_SIZE_CHUNK_TYPE = b'RWSZ'  # row size block chunk
+INDEX_CHUNK_TYPE = b'BIDX'  # block index chunk, the last chunk in the file
 
 # Datatype of row size chunks (contains number of array elements for each row)
 ROW_SIZE_CHUNK_DTYPE = np.uint32
@@ -43,14 +46,27 @@ ROW_SIZE_CHUNK_DTYPE = np.uint32
 # np.nan as filler values when reading)
 VARIABLE_COLUMN_DATA_DTYPE = np.float64
 
+# Datatype of the block index chunk. Each row is (first row, file offset) of a
+# block, i.e. of its row size chunk if there is one or else of its data chunk,
+# followed by a row (total rows, file offset of the index chunk).
+INDEX_CHUNK_DTYPE = np.dtype('>i8')
+
+# Block index footer struct, ending the index chunk: the number of rows in the
+# index (number of blocks + 1). Lets readers find the index chunk from the end
+# of the file.
+INDEX_FOOTER_STRUCT = struct.Struct('>I')
+
 # Column header struct. See the pack() calls for field details.
 COLUMN_STRUCT = struct.Struct('>2I 2H')
 
 # Variable-length column header struct.
 VARIABLE_COLUMN_STRUCT = struct.Struct('H')
 
+# Compression types (codecs) stored in column headers
 COMPRESSION_TYPE_NONE = 0
 COMPRESSION_TYPE_ZLIB = 1
+COMPRESSION_TYPE_LZ4 = 2
+COMPRESSION_TYPE_ZSTD = 3
 
 V2_DIR_COLUMNS = "columns"  # format v2's directory of column files
 # ----------------------------------------
@@ -82,9 +98,9 @@ ZLIB_LEVEL = 6
 # Packing also saves compression time and presumably I/O time.
 # TODO: Measure I/O time at different block sizes.
 #
-# The column file format isn't designed for random access but a reader could
-# skip chunk to chunk without decompressing them to get to a desired block, and
-# adding a chunk index would enable block-level random access.
+# The column file ends with a block index chunk for block-level random access.
+# A reader can also skip chunk to chunk without decompressing them to get to a
+# desired block.
 #
 # zlib supports incrementally compressing a bytestring at a time to save buffers
 # and use the cumulative data history to improve the overall compression ratio,
@@ -100,6 +116,60 @@ ZLIB_LEVEL = 6
 # See wholecell/tests/io/measure_zlib.py
 BLOCK_BYTES_GOAL = 16384
 
+# Maximum number of blocks per column that a TableWriter with compression
+# threads holds while they are compressed. append() waits for the oldest
+# block when a column has more, which bounds memory use if the threads can't
+# keep up.
+MAX_PENDING_BLOCKS = 4
+
+
+# Compression and decompression functions by compression type. zlib is always
+# available. LZ4 and Zstandard are much faster and are available if the
+# optional lz4 or zstandard packages are installed. All of them release the
+# GIL, so blocks can be compressed and decompressed on parallel threads.
+CODECS = {
+	COMPRESSION_TYPE_NONE: (lambda data: data, lambda data: data),
+	COMPRESSION_TYPE_ZLIB: (
+		lambda data: zlib.compress(data, ZLIB_LEVEL), zlib.decompress),
+	}  # type: Dict[int, Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]]
+
+try:
+	import lz4.frame
+except ImportError:
+	pass
+else:
+	CODECS[COMPRESSION_TYPE_LZ4] = (lz4.frame.compress, lz4.frame.decompress)
+
+try:
+	import zstandard
+except ImportError:
+	pass
+else:
+	CODECS[COMPRESSION_TYPE_ZSTD] = (
+		lambda data: zstandard.ZstdCompressor().compress(data),
+		lambda data: zstandard.ZstdDecompressor().decompress(data))
+
+COMPRESSION_TYPES = {
+	'none': COMPRESSION_TYPE_NONE,
+	'zlib': COMPRESSION_TYPE_ZLIB,
+	'lz4': COMPRESSION_TYPE_LZ4,
+	'zstd': COMPRESSION_TYPE_ZSTD,
+	}
+
+
+def get_compression_type(name):
+	# type: (str) -> int
+	"""
+	Get the compression type for a codec name ('none', 'zlib', 'lz4' or
+	'zstd'), raising ValueError if the codec is unknown or not installed.
+	"""
+	if COMPRESSION_TYPES.get(name) not in CODECS:
+		raise ValueError('Compression codec {!r} is unknown or not installed.'
+			' Available codecs: {}'.format(name, ', '.join(
+				codec for codec, compression_type in COMPRESSION_TYPES.items()
+				if compression_type in CODECS)))
+	return COMPRESSION_TYPES[name]
+
 
 class TableWriterError(Exception):
 	"""
@@ -164,11 +234,16 @@ class _Column(object):
 	optionally compressed NumPy ndarray data. In the case of variable-length
 	columns, each data chunk is preceded by a row size chunk that specifies the
 	sizes (number of array elements) for each row included in the data chunk.
-	The format is extensible since readers should skip unrecognized chunk
-	types.
+	The file ends with an INDEX_CHUNK_TYPE chunk with the first row and file
+	offset of each block (see INDEX_CHUNK_DTYPE). The format is extensible
+	since readers should skip unrecognized chunk types.
 
 	Parameters:
 		path (str): The path for this particular column's data file.
+		compression_type (int): Codec to compress data blocks with (see
+			CODECS).
+		executor (Optional[ThreadPoolExecutor]): Threads to compress data
+			blocks on. Blocks are compressed on the calling thread if None.
 
 	Notes
 	-----
@@ -184,17 +259,28 @@ class _Column(object):
 		as a lightweight alternative to TableWriter in addition to part of
 		TableWriter's internal implementation.
 	"""
-	def __init__(self, path, compression_type=COMPRESSION_TYPE_ZLIB):
-		# type: (str, int) -> None
-		if compression_type not in (COMPRESSION_TYPE_NONE, COMPRESSION_TYPE_ZLIB):
-			raise ValueError('Unknown compression type {}'.format(compression_type))
+	def __init__(self, path, compression_type=COMPRESSION_TYPE_ZLIB, executor=None):
+		# type: (str, int, Optional[ThreadPoolExecutor]) -> None
+		if compression_type not in CODECS:
+			raise ValueError('Unknown or unavailable compression type {}'.format(
+				compression_type))
 
 		self._path = path
 		self._data = open(path, "wb")
 		self._dtype = None
 		self._compression_type = compression_type
+		self._compress = CODECS[compression_type][0]
+		self._executor = executor
 		self._current_data_block = []  # type: List[bytes]
 
+		# (Uncompressed chunks to write first, number of rows, future
+		# compressed block chunk)
+		self._pending_blocks = collections.deque()  # type: Deque[Tuple[bytes, int, Any]]
+
+		# (First row, file offset) of each written block
+		self._block_index = []  # type: List[Tuple[int, int]]
+		self._num_rows = 0
+
 
 	def append(self, value):
 		# type: (Any) -> None
@@ -219,6 +305,73 @@ class _Column(object):
 		pass
 
 
+	def _compress_block(self, block_data):
+		# type: (bytes) -> bytes
+		"""
+		Compress a data block and return it as a BLOCK_CHUNK_TYPE chunk.
+		"""
+		block_data = self._compress(block_data)
+		return CHUNK_HEADER.pack(BLOCK_CHUNK_TYPE, len(block_data)) + block_data
+
+
+	def _write_compressed(self, prefix, block_data, num_rows):
+		# type: (bytes, bytes, int) -> None
+		"""
+		Write a data block of `num_rows` rows after the `prefix` chunks (if
+		any), compressing the block on the executor threads if there are any.
+		Blocks are written in order as soon as they and all previous blocks are
+		compressed.
+		"""
+		if self._executor is None:
+			self._write_chunks(prefix, self._compress_block(block_data), num_rows)
+			return
+
+		self._pending_blocks.append((prefix, num_rows,
+			self._executor.submit(self._compress_block, block_data)))
+
+		while self._pending_blocks and (
+				len(self._pending_blocks) > MAX_PENDING_BLOCKS
+				or self._pending_blocks[0][2].done()):
+			prefix, num_rows, future = self._pending_blocks.popleft()
+			self._write_chunks(prefix, future.result(), num_rows)
+
+
+	def _write_chunks(self, prefix, block_chunk, num_rows):
+		# type: (bytes, bytes, int) -> None
+		"""
+		Write the chunks of a block and add the block to the block index.
+		"""
+		self._block_index.append((self._num_rows, self._data.tell()))
+		self._num_rows += num_rows
+		self._data.write(prefix + block_chunk)
+
+
+	def _flush_blocks(self):
+		# type: () -> None
+		"""
+		Wait for and write all blocks that are being compressed.
+		"""
+		while self._pending_blocks:
+			prefix, num_rows, future = self._pending_blocks.popleft()
+			self._write_chunks(prefix, future.result(), num_rows)
+
+
+	def _write_index(self):
+		# type: () -> None
+		"""
+		Write the block index chunk after the last block, if any.
+		"""
+		if not self._block_index:
+			return
+
+		index = np.array(
+			self._block_index + [(self._num_rows, self._data.tell())],
+			INDEX_CHUNK_DTYPE)
+		index_data = index.tobytes() + INDEX_FOOTER_STRUCT.pack(len(index))
+		self._data.write(
+			CHUNK_HEADER.pack(INDEX_CHUNK_TYPE, len(index_data)) + index_data)
+
+
 	def _get_dtype_descr(self):
 		# type: () -> bytes
 		"""
@@ -245,6 +398,8 @@ class _Column(object):
 		if not self._data.closed:
 			try:
 				self._write_block()
+				self._flush_blocks()
+				self._write_index()
 				self._data.truncate()
 			finally:
 				self._data.close()
@@ -275,10 +430,10 @@ class _FixedLengthColumn(_Column):
 	one or more BLOCK_CHUNK_TYPE data chunks that contain the values of the
 	actual rows. The data chunks are optionally compressed.
 	"""
-	def __init__(self, path, compression_type=COMPRESSION_TYPE_ZLIB):
-		# type: (str, int) -> None
+	def __init__(self, path, compression_type=COMPRESSION_TYPE_ZLIB, executor=None):
+		# type: (str, int, Optional[ThreadPoolExecutor]) -> None
 		super(_FixedLengthColumn, self).__init__(
-			path, compression_type=compression_type)
+			path, compression_type=compression_type, executor=executor)
 
 		self._bytes_per_entry = 0
 		self._entries_per_block = 0
@@ -353,13 +508,8 @@ class _FixedLengthColumn(_Column):
 		"""
 		if self._current_data_block:
 			block_data = b''.join(self._current_data_block)
-
-			if self._compression_type == COMPRESSION_TYPE_ZLIB:
-				block_data = zlib.compress(block_data, ZLIB_LEVEL)
-
-			block_header = CHUNK_HEADER.pack(BLOCK_CHUNK_TYPE, len(block_data))
-
-			self._data.write(block_header + block_data)
+			self._write_compressed(
+				b'', block_data, len(self._current_data_block))
 			del self._current_data_block[:]
 
 
@@ -380,9 +530,10 @@ class _VariableLengthColumn(_Column):
 	data type to avoid any unexpected behavior (np.nan is not defined for
 	integer arrays).
 	"""
-	def __init__(self, path, compression_type=COMPRESSION_TYPE_ZLIB):
-		# type: (str, int) -> None
-		super(_VariableLengthColumn, self).__init__(path, compression_type)
+	def __init__(self, path, compression_type=COMPRESSION_TYPE_ZLIB, executor=None):
+		# type: (str, int, Optional[ThreadPoolExecutor]) -> None
+		super(_VariableLengthColumn, self).__init__(
+			path, compression_type=compression_type, executor=executor)
 
 		self._current_row_sizes_block = []  # type: List[int]
 		self._remaining_bytes_in_block = BLOCK_BYTES_GOAL
@@ -445,13 +596,8 @@ class _VariableLengthColumn(_Column):
 				ROW_SIZE_CHUNK_TYPE, len(row_size_data))
 
 			block_data = b''.join(self._current_data_block)
-
-			if self._compression_type == COMPRESSION_TYPE_ZLIB:
-				block_data = zlib.compress(block_data, ZLIB_LEVEL)
-
-			block_header = CHUNK_HEADER.pack(BLOCK_CHUNK_TYPE, len(block_data))
-
-			self._data.write(row_size_header + row_size_data + block_header + block_data)
+			self._write_compressed(row_size_header + row_size_data, block_data,
+				len(self._current_row_sizes_block))
 			self._remaining_bytes_in_block = BLOCK_BYTES_GOAL
 			del self._current_row_sizes_block[:]
 			del self._current_data_block[:]
@@ -481,6 +627,10 @@ class TableWriter(object):
 			not OK if it contains Table files since existing or concurrent
 			Table files would confuse each other, so this will raise
 			TableExistsError if its attributes.json file already exists.
+		compression_type (int): Codec to compress the columns with. zlib by
+			default; see get_compression_type() for faster codecs.
+		threads (int): Number of background threads that compress data blocks
+			while the caller continues. Blocks are compressed by append() if 0.
 
 	See also
 	--------
@@ -520,11 +670,17 @@ class TableWriter(object):
 		as part of a structured array (i.e. a hybrid data type).
 	"""
 
-	def __init__(self, path):
-		# type: (str) -> None
-		self._path = filepath.makedirs(path)
+	def __init__(self, path, compression_type=COMPRESSION_TYPE_ZLIB, threads=0):
+		# type: (str, int, int) -> None
 		self._columns = None  # type: Optional[Dict[str, _Column]]
+		self._executor = None  # type: Optional[ThreadPoolExecutor]
+		if compression_type not in CODECS:
+			raise ValueError('Unknown or unavailable compression type {}'.format(
+				compression_type))
+
+		self._path = filepath.makedirs(path)
 		self._variable_length_columns = set()  # type: Set[str]
+		self._compression_type = compression_type
 
 		self._attributes = {}  # type: Dict[str, Any]
 		self._attributes_filename = os.path.join(path, FILE_ATTRIBUTES)
@@ -538,6 +694,9 @@ class TableWriter(object):
 		# also prevent competing TableWriters.
 		self.writeAttributes(_version=VERSION)
 
+		if threads > 0:
+			self._executor = ThreadPoolExecutor(threads)
+
 
 	def append(self, **namesAndValues):
 		# type: (**Any) -> None
@@ -559,9 +718,12 @@ class TableWriter(object):
 		# First call - instantiate all columns
 		if self._columns is None:
 			self._columns = {
-				name: _VariableLengthColumn(os.path.join(self._path, name))
-				if name in self._variable_length_columns
-				else _FixedLengthColumn(os.path.join(self._path, name))
+				name: (_VariableLengthColumn
+					if name in self._variable_length_columns
+					else _FixedLengthColumn)(
+						os.path.join(self._path, name),
+						self._compression_type,
+						self._executor)
 				for name in namesAndValues
 				}
 
@@ -665,6 +827,9 @@ class TableWriter(object):
 			for column in six.viewvalues(self._columns):
 				column.close()
 
+		if self._executor is not None:
+			self._executor.shutdown()
+
 
 	def __del__(self):
 		# type: () -> None
@@ -672,3 +837,72 @@ class TableWriter(object):
 		Close the output files once the instance is totally dereferenced.
 		"""
 		self.close()
+
+
+def test_compressed_round_trip():
+	import tempfile
+	import time
+	from wholecell.io.tablereader import TableReader
+
+	fixed = [np.arange(i, i + 5000, dtype=np.float64) for i in range(12)]
+	variable = [np.arange(i * 700) for i in range(12)]
+	with tempfile.TemporaryDirectory() as tmp_dir:
+		for name, compression_type in COMPRESSION_TYPES.items():
+			if compression_type not in CODECS:
+				continue
+			for threads in (0, 2):
+				path = os.path.join(tmp_dir, '{}-{}'.format(name, threads))
+				writer = TableWriter(path, compression_type, threads=threads)
+				writer.set_variable_length_columns('variable')
+				for fixed_row, variable_row in zip(fixed, variable):
+					writer.append(fixed=fixed_row, variable=variable_row)
+				writer.close()
+
+				for reader_threads in (0, 2):
+					reader = TableReader(path, threads=reader_threads)
+					np.testing.assert_array_equal(
+						reader.readColumn('fixed'), fixed)
+					column = reader.readColumn('variable')
+					for row, expected in zip(column, variable):
+						np.testing.assert_array_equal(
+							row[:len(expected)], expected)
+						assert np.isnan(row[len(expected):]).all()
+
+		# Slow compression: append() waits for the oldest block once a column
+		# has MAX_PENDING_BLOCKS blocks being compressed
+		def slow_compress(data):
+			time.sleep(0.02)
+			return zlib.compress(data, ZLIB_LEVEL)
+		codec = CODECS[COMPRESSION_TYPE_ZLIB]
+		CODECS[COMPRESSION_TYPE_ZLIB] = (slow_compress, codec[1])
+		try:
+			path = os.path.join(tmp_dir, 'slow')
+			writer = TableWriter(path, threads=1)
+			pending = []
+			for row in fixed:
+				writer.append(fixed=row)
+				pending.append(len(writer._columns['fixed']._pending_blocks))
+			writer.close()
+		finally:
+			CODECS[COMPRESSION_TYPE_ZLIB] = codec
+		assert max(pending) == MAX_PENDING_BLOCKS
+		np.testing.assert_array_equal(
+			TableReader(path).readColumn('fixed'), fixed)
+
+		# Codecs that are not installed are rejected
+		removed = CODECS.pop(COMPRESSION_TYPE_ZSTD, None)
+		try:
+			for create in (
+					lambda: get_compression_type('zstd'),
+					lambda: get_compression_type('gzip'),
+					lambda: TableWriter(os.path.join(tmp_dir, 'zstd'),
+						COMPRESSION_TYPE_ZSTD)):
+				try:
+					create()
+				except ValueError:
+					pass
+				else:
+					raise AssertionError('Unavailable codec was accepted.')
+		finally:
+			if removed is not None:
+				CODECS[COMPRESSION_TYPE_ZSTD] = removed
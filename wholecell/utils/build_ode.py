@@ -1,13 +1,99 @@
 """
 Utilities to compile functions, esp. from Sympy-constructed Matrix math.
+
+Functions are written to content-hashed modules in a cache directory (set by
+the WC_ODE_CACHE_DIR environment variable, default: ~/.cache/wholecell/ode) so
+that Numba can cache the compiled machine code across processes. The source
+code expressions derived from Sympy can be cached there too (see
+cached_expressions()).
+
+Modules in the cache directory are imported and expressions are compiled, so
+the directory is created with mode 0700 and is only used if it (and each file
+read from it) is owned by the current user and not writable by anyone else.
+Otherwise functions are compiled in memory and expressions are rebuilt.
 """
 
 from __future__ import absolute_import, division, print_function
 
+import hashlib
+import importlib.util
+import json
+import os
+import stat
+import sys
+import tempfile
+
 import numpy as np
 from numba import njit
 from sympy import Matrix
-from typing import Callable, Tuple
+from typing import Any, Callable, Dict, Iterable, Tuple
+
+
+DERIVATIVES_ARGUMENTS = 'y, t'
+RATES_ARGUMENTS = 't, y, kf, kr'
+
+ODE_CACHE_DIR = os.environ.get('WC_ODE_CACHE_DIR', os.path.join(
+	os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')),
+	'wholecell', 'ode'))
+
+# Functions built in this process, keyed by source code hash
+_FUNCTIONS = {}  # type: Dict[str, Tuple[Callable, Callable]]
+# Expressions built or loaded in this process, keyed by cache key hash
+_EXPRESSIONS = {}  # type: Dict[str, Tuple[str, ...]]
+
+
+class UnsafeCacheError(OSError):
+	"""
+	An error raised when a file or directory in the cache could have been
+	written by another user.
+	"""
+	pass
+
+
+def _check_owner(path):
+	# type: (str) -> None
+	"""Raise UnsafeCacheError unless path is owned by the current user and not
+	writable by the group or others."""
+	st = os.stat(path)
+	if hasattr(os, 'getuid') and st.st_uid != os.getuid():
+		raise UnsafeCacheError('{} is owned by another user'.format(path))
+	if st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+		raise UnsafeCacheError('{} is writable by other users'.format(path))
+
+
+def _get_cache_dir():
+	# type: () -> str
+	"""Create ODE_CACHE_DIR (only accessible by the current user) if needed
+	and check that no other user can write to it."""
+	os.makedirs(ODE_CACHE_DIR, mode=0o700, exist_ok=True)
+	_check_owner(ODE_CACHE_DIR)
+	return ODE_CACHE_DIR
+
+
+def _load_module(arguments, expression):
+	# type: (str, str) -> Callable
+	"""Write a function to a module named by the hash of its source code
+	(unless it already exists) and import it."""
+	source = 'import numpy as np\n\n\ndef f({}):\n\treturn {}\n'.format(
+		arguments, expression)
+	name = 'ode_' + hashlib.sha256(source.encode('utf-8')).hexdigest()[:32]
+	cache_dir = _get_cache_dir()
+	path = os.path.join(cache_dir, name + '.py')
+	if not os.path.exists(path):
+		# Write to a temporary file first so that processes building the same
+		# function at the same time never import a partially written module
+		with tempfile.NamedTemporaryFile(
+				'w', dir=cache_dir, suffix='.tmp', delete=False) as f:
+			f.write(source)
+		os.replace(f.name, path)
+	if name not in sys.modules:
+		_check_owner(path)
+		spec = importlib.util.spec_from_file_location(name, path)
+		module = importlib.util.module_from_spec(spec)
+		spec.loader.exec_module(module)
+		# Numba imports the module by name when loading cached code
+		sys.modules[name] = module
+	return sys.modules[name].f
 
 
 def build_functions(arguments, expression):
@@ -17,6 +103,10 @@ def build_functions(arguments, expression):
 	There will be overhead to compile the first time the jit version is called
 	so two functions are returned and can be selected for optimal performance.
 
+	The function is written to a module in ODE_CACHE_DIR so the compiled
+	code is cached on disk and reused by other processes. Functions are also
+	reused within a process (e.g. when unpickling sim_data again).
+
 	Numba will optimize expressions like 1.0*y[2]**1.0 while compiling it
 	to machine code.
 
@@ -25,15 +115,78 @@ def build_functions(arguments, expression):
 		expression (str): expression to compile
 
 	Returns:
-		a lambda function(arguments)
+		a Python function(arguments)
 		a Numba Dispatcher function(arguments)
 	"""
-	f = eval('lambda {}: {}'.format(arguments, expression), {'np': np}, {})
+	key = hashlib.sha256(
+		'{}:{}'.format(arguments, expression).encode('utf-8')).hexdigest()
+	if key not in _FUNCTIONS:
+		try:
+			f = _load_module(arguments, expression)
+			f_jit = njit(f, error_model='numpy', cache=True)
+		except OSError:
+			# Cache directory is not writable or not safe: compile in memory
+			f = eval('lambda {}: {}'.format(arguments, expression),
+				{'np': np}, {})
+			f_jit = njit(f, error_model='numpy')
+		_FUNCTIONS[key] = (f, f_jit)
 
-	# Too bad cache=True doesn't work with string source code.
-	f_jit = njit(f, error_model='numpy')
+	return _FUNCTIONS[key]
 
-	return f, f_jit
+
+def _hash_key(key):
+	# type: (Iterable[Any]) -> str
+	"""Hash strings and arrays (including their dtype and shape)."""
+	sha = hashlib.sha256()
+	for item in key:
+		if isinstance(item, str):
+			sha.update(item.encode('utf-8'))
+		else:
+			array = np.ascontiguousarray(item)
+			sha.update('{}{}'.format(array.dtype.str, array.shape).encode('utf-8'))
+			sha.update(array.tobytes())
+		sha.update(b'\0')
+	return sha.hexdigest()
+
+
+def cached_expressions(key, build):
+	# type: (Iterable[Any], Callable[[], Tuple[str, ...]]) -> Tuple[str, ...]
+	"""Get source code expressions from the cache in ODE_CACHE_DIR, building
+	and caching them if needed. Use this to skip slow Sympy math (e.g.
+	symbolic Jacobians) when the same expressions were built before.
+
+	Args:
+		key: strings and arrays that determine the expressions, e.g. the
+			name of the method that builds them and the stoichiometry
+		build: function that returns a tuple of expressions
+
+	Returns:
+		tuple of expressions
+	"""
+	name = 'expressions_' + _hash_key(key)[:32]
+	if name not in _EXPRESSIONS:
+		path = os.path.join(ODE_CACHE_DIR, name + '.json')
+		try:
+			_get_cache_dir()
+			_check_owner(path)
+			with open(path, 'r') as f:
+				expressions = json.load(f)
+			if not (isinstance(expressions, list)
+					and all(isinstance(e, str) for e in expressions)):
+				raise ValueError('Invalid cached expressions in {}'.format(path))
+			_EXPRESSIONS[name] = tuple(expressions)
+		except (OSError, ValueError):
+			_EXPRESSIONS[name] = tuple(build())
+			try:
+				cache_dir = _get_cache_dir()
+				with tempfile.NamedTemporaryFile(
+						'w', dir=cache_dir, suffix='.tmp', delete=False) as f:
+					json.dump(_EXPRESSIONS[name], f)
+				os.replace(f.name, path)
+			except OSError:
+				pass
+
+	return _EXPRESSIONS[name]
 
 
 # TODO(jerry): Surely we can extract the argument array of "Matrix([...])" via
@@ -46,25 +199,77 @@ def _matrix_to_array(matrix):
 	return 'np.array({})'.format(matrix_string[7:-1])
 
 
+def vector_expression(matrix):
+	# type: (Matrix) -> str
+	"""Convert a sympy column Matrix to a 1D array expression. Pickle this
+	instead of the sympy expression to rebuild functions quickly."""
+	return _matrix_to_array(matrix) + '.reshape(-1)'
+
+def matrix_expression(matrix):
+	# type: (Matrix) -> str
+	"""Convert a sympy Matrix to a 2D array expression."""
+	return _matrix_to_array(matrix)
+
 def derivatives(matrix):
 	# type: (Matrix) -> Tuple[Callable, Callable]
 	"""Build an optimized derivatives ODE function(y, t)."""
-	return build_functions('y, t',
-		_matrix_to_array(matrix) + '.reshape(-1)')
+	return build_functions(DERIVATIVES_ARGUMENTS, vector_expression(matrix))
 
 def derivatives_jacobian(jacobian_matrix):
 	# type: (Matrix) -> Tuple[Callable, Callable]
 	"""Build an optimized derivatives ODE Jacobian function(y, t)."""
-	return build_functions('y, t', _matrix_to_array(jacobian_matrix))
+	return build_functions(DERIVATIVES_ARGUMENTS,
+		matrix_expression(jacobian_matrix))
 
 def rates(matrix):
 	# type: (Matrix) -> Tuple[Callable, Callable]
 	"""Build an optimized rates function(t, y, kf, kr)."""
-	return build_functions('t, y, kf, kr',
-		_matrix_to_array(matrix) + '.reshape(-1)')
+	return build_functions(RATES_ARGUMENTS, vector_expression(matrix))
 
 def rates_jacobian(jacobian_matrix):
 	# type: (Matrix) -> Tuple[Callable, Callable]
 	"""Build an optimized rates Jacobian function(t, y, kf, kr)."""
-	return build_functions('t, y, kf, kr',
-		_matrix_to_array(jacobian_matrix))
+	return build_functions(RATES_ARGUMENTS, matrix_expression(jacobian_matrix))
+
+
+def test_ode_cache():
+	global ODE_CACHE_DIR
+	original_cache_dir = ODE_CACHE_DIR
+	with tempfile.TemporaryDirectory() as tmp_dir:
+		ODE_CACHE_DIR = os.path.join(tmp_dir, 'ode')
+		try:
+			# Miss: expressions are built and functions are written to the cache
+			built = []
+			key = ('test_ode_cache', np.arange(3))
+			def build():
+				built.append(True)
+				return ('np.array([y[0] * t, y[1]])',)
+			expressions = cached_expressions(key, build)
+			f, f_jit = build_functions(DERIVATIVES_ARGUMENTS, expressions[0])
+			assert stat.S_IMODE(os.stat(ODE_CACHE_DIR).st_mode) == 0o700
+			assert sorted(os.path.splitext(name)[1]
+				for name in os.listdir(ODE_CACHE_DIR)) == ['', '.json', '.py']
+			np.testing.assert_array_equal(f(np.array([2., 3.]), 2.), [4., 3.])
+			np.testing.assert_array_equal(f_jit(np.array([2., 3.]), 2.), [4., 3.])
+
+			# Hit: expressions are read from the cache (as in a new process)
+			_EXPRESSIONS.clear()
+			assert cached_expressions(key, build) == expressions
+			assert len(built) == 1
+			assert cached_expressions(('test_ode_cache', np.arange(4)), build)
+			assert len(built) == 2
+
+			# Files that other users can write to are not used
+			_EXPRESSIONS.clear()
+			os.chmod(ODE_CACHE_DIR, 0o777)
+			try:
+				_get_cache_dir()
+			except UnsafeCacheError:
+				pass
+			else:
+				raise AssertionError('Unsafe cache directory was used.')
+			assert cached_expressions(key, build) == expressions
+			assert len(built) == 3
+		finally:
+			ODE_CACHE_DIR = original_cache_dir
+			_EXPRESSIONS.clear()